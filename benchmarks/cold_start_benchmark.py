@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+This script measures the cold start of the CN-CLIP server: it launches `uvicorn server:app` in a fresh process
+and records the time until the server answers /health (process up and accepting connections), until /ready
+reports the model as loaded, and until the first text (and image) embedding request succeeds.
+The server is configured by the environment as usual (CN_CLIP_MODEL_PATH, MODEL_TOWERS, ...); a .safetensors
+checkpoint gives the fastest model loading, see cn_clip/deploy/pytorch_to_safetensors.py.
+"""
+
+import argparse
+import base64
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+from cn_clip.deploy.benchmark_utils import print_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-path', type=str, default=None,
+                        help='CN_CLIP_MODEL_PATH of the server, default to the value in the environment.')
+    parser.add_argument('--towers', choices=["both", "text", "vision"], default=None,
+                        help='MODEL_TOWERS of the server, default to the value in the environment.')
+    parser.add_argument('--image', type=str, default="pokemon.jpeg",
+                        help='The image file sent by the first image request, skipped for text-only servers.')
+    parser.add_argument('--text', type=str, default="杰尼龟", help='The query text sent by the first text request.')
+    parser.add_argument('--n', default=3, type=int, help='Number of cold starts. Default to 3.')
+    parser.add_argument('--timeout', default=600, type=float, help='Seconds to wait for the server to become ready.')
+    parser.add_argument('--poll-interval', default=0.05, type=float,
+                        help='Seconds between two /health or /ready probes. Frequent probes compete with the model '
+                             'loading for the CPU on small machines. Default to 0.05.')
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(process, check, timeout, interval):
+    """Poll check() until it returns True, return the time it happened."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with code {process.returncode}")
+        try:
+            if check():
+                return time.perf_counter()
+        except requests.ConnectionError:
+            pass
+        time.sleep(interval)
+    raise TimeoutError(f"The server was not ready after {timeout}s")
+
+
+def ready(url):
+    response = requests.get(url + "/ready")
+    if response.status_code == 503 and response.json()["status"] == "failed":
+        raise RuntimeError(f"Model loading failed: {response.json()['error']}")
+    return response.status_code == 200
+
+
+def cold_start(args, cwd, env, image_base64):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                                "--port", str(port)], cwd=cwd, env=env)
+    try:
+        live = wait_until(process, lambda: requests.get(url + "/health").status_code == 200, args.timeout,
+                          args.poll_interval)
+        loaded = wait_until(process, lambda: ready(url), args.timeout, args.poll_interval)
+        towers = env.get("MODEL_TOWERS", "both")
+        timings = {"/health": live - start, "/ready": loaded - start}
+        if towers != "vision":
+            requests.post(url + "/embeddings/text", json={"text": args.text}).raise_for_status()
+            timings["first text embedding"] = time.perf_counter() - start
+        if towers != "text":
+            requests.post(url + "/embeddings/image", json={"image_base64": image_base64}).raise_for_status()
+            timings["first image embedding"] = time.perf_counter() - start
+        return timings
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    env = dict(os.environ)
+    if args.model_path:
+        env["CN_CLIP_MODEL_PATH"] = os.path.abspath(args.model_path)
+    if args.towers:
+        env["MODEL_TOWERS"] = args.towers
+    with open(args.image, 'rb') as image_file:
+        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+
+    # the server is started from the repository root, as in the Dockerfile
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = [cold_start(args, cwd, env, image_base64) for i in range(args.n)]
+    print(f"Cold start of the server (time since the process was launched, {args.n} runs):")
+    for phase in results[0]:
+        print_timings(name=phase, timings=[result[phase] for result in results])
+
+    print("Done!")
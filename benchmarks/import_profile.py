@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+This script profiles the import time of the serving modules with `python -X importtime` in fresh processes.
+It prints the total import time of each module, the time spent per top-level package and the slowest
+individual modules, and lists which heavy packages (torch, torchvision, ...) end up imported.
+`import server` should not import torch at all: the model and its dependencies are loaded by the startup
+hook in the background.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+HEAVY_PACKAGES = ["torch", "torchvision", "timm", "onnx", "onnxruntime", "tensorrt", "coremltools", "modelscope",
+                  "requests", "lmdb"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=str, default="server,cn_clip.clip,service.runner",
+                        help='Comma separated modules to profile. Default to server,cn_clip.clip,service.runner.')
+    parser.add_argument('--top', default=15, type=int, help='Number of slowest packages and modules printed. Default to 15.')
+    parser.add_argument('--n', default=3, type=int,
+                        help='Number of fresh processes per module, the fastest run is reported. Default to 3.')
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='If set, fail when importing the first module takes longer than this many seconds.')
+    return parser.parse_args()
+
+
+def profile_import(module, cwd):
+    """Import module in a fresh interpreter, return [(module name, self seconds, cumulative seconds, depth)]."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    records = []
+    for line in result.stderr.splitlines():
+        # import time:  self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return records
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    # the serving modules are imported from the repository root, as uvicorn does
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    totals = {}
+    for module in args.modules.split(","):
+        runs = [profile_import(module, cwd) for i in range(args.n)]
+        # the root module is the last record at depth 0 with the module's name
+        run_totals = [next(cumulative for name, _, cumulative, depth in reversed(records) if name == module)
+                      for records in runs]
+        records = runs[int(np.argmin(run_totals))]
+        totals[module] = min(run_totals)
+
+        packages = defaultdict(float)
+        for name, self_time, _, _ in records:
+            packages[name.split(".")[0]] += self_time
+        imported = {name.split(".")[0] for name, _, _, _ in records}
+
+        print(f"import {module}: {totals[module] * 1e3:.1f}ms (fastest of {args.n}), {len(records)} modules")
+        print(f"  heavy packages imported: {', '.join(p for p in HEAVY_PACKAGES if p in imported) or 'none'}")
+        print("  slowest top-level packages (self time of all their modules):")
+        for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {package:<40}{seconds * 1e3:>10.1f}ms")
+        print("  slowest modules (self time):")
+        for name, self_time, cumulative, _ in sorted(records, key=lambda record: -record[1])[:args.top]:
+            print(f"    {name:<40}{self_time * 1e3:>10.1f}ms  (cumulative {cumulative * 1e3:.1f}ms)")
+
+    if args.max_seconds is not None:
+        module = args.modules.split(",")[0]
+        assert totals[module] <= args.max_seconds, \
+            f"import {module} takes {totals[module]:.2f}s (> {args.max_seconds}s)"
+
+    print("Done!")
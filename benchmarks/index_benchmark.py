@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+This script benchmarks the in-process embedding index of the server (service/index.py) on random normalized
+vectors: adding vectors, and the blocked exact top-k search for several query batch sizes with float32 and
+float16 storage. Results are checked against a full matrix product followed by a complete sort.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+from service.index import VectorIndex, normalize_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default=200000, type=int, help='Number of indexed vectors. Default to 200000.')
+    parser.add_argument('--dim', default=768, type=int, help='Embedding dimension. Default to 768 (ViT-L-14).')
+    parser.add_argument('--batch-sizes', type=str, default="1,16,128",
+                        help='Comma separated query batch sizes. Default to 1,16,128.')
+    parser.add_argument('--top-k', default=10, type=int, help='Number of results per query. Default to 10.')
+    parser.add_argument('--block-rows', default=16384, type=int, help='Rows per matrix product. Default to 16384.')
+    parser.add_argument('--n', default=20, type=int, help='The iteration number for the speed test. Default to 20.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed.')
+    return parser.parse_args()
+
+
+def exact_topk(vectors, queries, top_k):
+    scores = normalize_rows(queries) @ vectors.astype(np.float32).T
+    return np.argsort(-scores, axis=1)[:, :top_k], scores
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    rng = np.random.RandomState(args.seed)
+    vectors = rng.randn(args.size, args.dim).astype(np.float32)
+    ids = [str(i) for i in range(args.size)]
+
+    for dtype in ("float32", "float16"):
+        index = VectorIndex("benchmark", args.dim, dtype=dtype, block_rows=args.block_rows)
+        start = time.perf_counter()
+        for begin in range(0, args.size, 10000):
+            index.add(ids[begin:begin + 10000], vectors[begin:begin + 10000])
+        elapsed = time.perf_counter() - start
+        print(f"[{dtype}] added {args.size} vectors in {elapsed:.2f}s ({args.size / elapsed:.0f} vectors/s), "
+              f"{index.size * args.dim * np.dtype(dtype).itemsize / 2 ** 20:.0f} MB")
+
+        stored, stored_ids, _ = index.snapshot()
+        queries = rng.randn(max(int(x) for x in args.batch_sizes.split(",")), args.dim)
+        result_ids, result_scores = index.search(queries, args.top_k)
+        reference, scores = exact_topk(stored, queries, args.top_k)
+        # ties aside, the blocked search returns exactly the rows of the full sort
+        assert all([stored_ids[row] for row in rows] == found for rows, found in zip(reference, result_ids)), \
+            "blocked top-k differs from the full sort"
+        assert np.allclose(np.take_along_axis(scores, reference, axis=1), result_scores, atol=1e-5)
+        print(f"[{dtype}] blocked top-k matches the full sort for {len(queries)} queries")
+
+        for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+            batches = [rng.randn(batch_size, args.dim) for i in range(args.n)]
+            for name, search in (("full sort", lambda batch: exact_topk(stored, batch, args.top_k)),
+                                 ("blocked top-k", lambda batch: index.search(batch, args.top_k))):
+                search(batches[0])
+                time_buffer = list()
+                for batch in batches:
+                    with track_infer_time(time_buffer):
+                        search(batch)
+                print_timings(name=f"{dtype} {name} (batch-size: {batch_size})", timings=time_buffer)
+
+    print("Done!")
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+This script load-tests a running CN-CLIP server: it measures the latency of cheap text embedding
+requests (and health checks) alone, and again while large image embedding requests are in flight.
+With inference running on the executor instead of the event loop, the two distributions should be close.
+"""
+
+import argparse
+import base64
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default="http://localhost:8000", help='The base url of the CN-CLIP server.')
+    parser.add_argument('--image', type=str, default="pokemon.jpeg", help='The image file sent by the image requests.')
+    parser.add_argument('--text', type=str, default="杰尼龟", help='The query text sent by the text requests.')
+    parser.add_argument('--text-requests', type=int, default=200, help='Number of text requests per phase. Default to 200.')
+    parser.add_argument('--text-concurrency', type=int, default=4, help='Concurrent text clients. Default to 4.')
+    parser.add_argument('--image-concurrency', type=int, default=8,
+                        help='Concurrent image clients kept busy during the loaded phase. Default to 8.')
+    parser.add_argument('--warmup', type=int, default=10, help='Warmup requests. Default to 10.')
+    return parser.parse_args()
+
+
+def run_text_phase(args, session, path="/embeddings/text"):
+    timings = []
+
+    def one_request(_):
+        buffer = []
+        with track_infer_time(buffer):
+            if path == "/health":
+                response = session.get(args.url + path)
+            else:
+                response = session.post(args.url + path, json={"text": args.text})
+        response.raise_for_status()
+        return buffer[0]
+
+    with ThreadPoolExecutor(max_workers=args.text_concurrency) as pool:
+        timings.extend(pool.map(one_request, range(args.text_requests)))
+    return timings
+
+
+def image_load(args, image_base64, stop_event, counter):
+    session = requests.Session()
+    while not stop_event.is_set():
+        response = session.post(args.url + "/embeddings/image", json={"image_base64": image_base64})
+        response.raise_for_status()
+        counter.append(1)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    with open(args.image, 'rb') as image_file:
+        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+
+    session = requests.Session()
+    for _ in range(args.warmup):
+        session.post(args.url + "/embeddings/text", json={"text": args.text}).raise_for_status()
+        session.post(args.url + "/embeddings/image", json={"image_base64": image_base64}).raise_for_status()
+
+    print("Measure text requests without image load...")
+    print_timings(name="text latency (idle)", timings=run_text_phase(args, session))
+    print_timings(name="health latency (idle)", timings=run_text_phase(args, session, path="/health"))
+
+    print(f"Measure text requests with {args.image_concurrency} concurrent image clients...")
+    stop_event = threading.Event()
+    finished_images = []
+    image_threads = [threading.Thread(target=image_load, args=(args, image_base64, stop_event, finished_images))
+                     for _ in range(args.image_concurrency)]
+    for thread in image_threads:
+        thread.start()
+    time.sleep(1.0)
+    del finished_images[:]
+    start = time.perf_counter()
+    text_timings = run_text_phase(args, session)
+    health_timings = run_text_phase(args, session, path="/health")
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    for thread in image_threads:
+        thread.join()
+    print_timings(name="text latency (under image load)", timings=text_timings)
+    print_timings(name="health latency (under image load)", timings=health_timings)
+    print(f"Image throughput during the loaded phase: {len(finished_images) / elapsed:.2f} images/s")
+    print("Done!")
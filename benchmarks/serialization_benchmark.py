@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+This script compares the serialization time and payload size of the embedding response formats
+(json float lists, base64-packed json, raw binary and msgpack) for float32 and float16 vectors.
+"""
+
+import argparse
+
+import numpy as np
+
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+from service.encoding import DTYPES, EmbeddingFormat, msgpack
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=768, help='Embedding dimension. Default to 768 (ViT-L-14-336).')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Number of embeddings per response, as returned by /embeddings. Default to 1.')
+    parser.add_argument('--n', type=int, default=200, help='The iteration number for each format. Default to 200.')
+    parser.add_argument('--warmup', type=int, default=10, help='Warmup iterations. Default to 10.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    embeddings = np.random.randn(args.batch_size, args.dim).astype(np.float32)
+    content = {
+        "success": True,
+        "results": [{"type": "image", "input": "base64_image", "embedding": embedding} for embedding in embeddings]
+    }
+
+    formats = ["json", "base64", "binary"] + (["msgpack"] if msgpack is not None else [])
+    if msgpack is None:
+        print("msgpack is not installed, skip the msgpack format.")
+    for format in formats:
+        for dtype in DTYPES:
+            response_format = EmbeddingFormat(format, dtype)
+            for i in range(args.warmup):
+                response = response_format.render(content)
+            time_buffer = list()
+            for i in range(args.n):
+                with track_infer_time(time_buffer):
+                    response = response_format.render(content)
+            print_timings(name=f"{format}/{dtype} serialization (batch-size: {args.batch_size})", timings=time_buffer)
+            print(f"  payload size: {len(response.body)} bytes "
+                  f"({len(response.body) / args.batch_size / 1024:.2f} KB per embedding)")
+    print("Done!")
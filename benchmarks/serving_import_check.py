@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+This script checks that the HTTP server only needs the packages of requirements-serving.txt.
+It collects every module imported by server.py and the service package, including the imports deferred into
+functions (loading the model, building classifiers, searching indexes, ...), and imports each of them in a fresh
+process in which the packages listed in requirements.txt but not in requirements-serving.txt cannot be imported,
+as in the Docker image.
+"""
+
+import argparse
+import ast
+import glob
+import os
+import re
+import subprocess
+import sys
+
+# pip distribution name -> imported top-level package, when they differ
+IMPORT_NAMES = {
+    "pillow": "PIL",
+    "python-dotenv": "dotenv",
+    "python-multipart": "multipart",
+    "onnxruntime": "onnxruntime",
+}
+
+BLOCKER = """
+import importlib.abc, sys
+class Blocker(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path=None, target=None):
+        if name.split(".")[0] in BLOCKED:
+            raise ModuleNotFoundError(f"No module named '{name}' (not in requirements-serving.txt)", name=name)
+sys.meta_path.insert(0, Blocker())
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sources', type=str, default="server.py,service/*.py",
+                        help='Comma separated files (globs) whose imports are checked. Default to server.py,service/*.py.')
+    return parser.parse_args()
+
+
+def requirement_names(path):
+    names = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line:
+                names.add(re.split(r"[<>=!~\[ ]", line)[0].lower())
+    return names
+
+
+def collected_imports(path):
+    """Every absolute module imported anywhere in the file, at module level or inside functions."""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.add(node.module)
+    return modules
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    serving = requirement_names(os.path.join(root, "requirements-serving.txt"))
+    # cn-clip is this repository
+    blocked = {IMPORT_NAMES.get(name, name.replace("-", "_"))
+               for name in requirement_names(os.path.join(root, "requirements.txt")) - serving - {"cn-clip"}}
+    print(f"Blocked packages: {', '.join(sorted(blocked))}")
+
+    modules = set()
+    for pattern in args.sources.split(","):
+        for path in glob.glob(os.path.join(root, pattern)):
+            modules.update(collected_imports(path))
+    # the whole cn_clip.clip package is loaded by the model runner
+    modules.add("cn_clip.clip")
+
+    failures = []
+    for module in sorted(modules):
+        code = f"BLOCKED = {sorted(blocked)!r}\n{BLOCKER}\nimport {module}"
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        status = "ok" if result.returncode == 0 else "FAILED"
+        print(f"  import {module:<48}{status}")
+        if result.returncode != 0:
+            failures.append((module, result.stderr.strip().splitlines()[-1]))
+
+    for module, error in failures:
+        print(f"import {module}: {error}")
+    assert not failures, f"{len(failures)} modules need packages outside requirements-serving.txt"
+    print("Done!")
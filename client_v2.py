@@ -1,8 +1,15 @@
 # 图像embedding
 import requests
-# files = {'file': open('first_frame.png', 'rb')}
-# response = requests.post('http://localhost:8000/embeddings/image', files=files)
-# print(response.json())
+# 通过multipart上传图片文件,可以一次上传多张
+files = [('files', open('pokemon.jpeg', 'rb'))]
+response = requests.post('http://localhost:8000/embeddings/image/upload', files=files)
+print(response.json())
+
+# 请求体直接为图片原始字节
+with open('pokemon.jpeg', 'rb') as image_file:
+    response = requests.post('http://localhost:8000/embeddings/image/raw', data=image_file.read(),
+                             headers={'Content-Type': 'application/octet-stream'})
+print(response.json())
 
 response = requests.post('http://localhost:8000/embeddings/image',
                          json={
@@ -1,5 +1,7 @@
-from .bert_tokenizer import FullTokenizer
+from .bert_tokenizer import FullTokenizer, FastTokenizer, LazyTokenizer
 
-_tokenizer = FullTokenizer()
+# the vocab is read on the first tokenization, not at import
+_tokenizer = LazyTokenizer()
 from .model import convert_state_dict
-from .utils import load_from_name, available_models, tokenize, image_transform, load
+from .utils import load_from_name, available_models, tokenize, image_transform, load, draft_image, \
+    BatchImageTransform, quantize_dynamic_int8, tokenize_batch, TokenizedTexts
@@ -23,6 +23,7 @@ import collections
 import re
 import unicodedata
 import six
+import threading
 from functools import lru_cache
 import os
 
@@ -186,6 +187,10 @@ class FullTokenizer(object):
     def convert_ids_to_tokens(self, ids):
         return convert_by_vocab(self.inv_vocab, ids)
 
+    def encode(self, text):
+        """Tokenizes a piece of text into token ids (without [CLS] and [SEP])."""
+        return self.convert_tokens_to_ids(self.tokenize(text))
+
     @staticmethod
     def convert_tokens_to_string(tokens, clean_up_tokenization_spaces=True):
         """ Converts a sequence of tokens (string) in a single string. """
@@ -219,6 +224,163 @@ class FullTokenizer(object):
         return len(self.vocab)
 
 
+class _CharTable(dict):
+    """A str.translate table doing the per-character steps of BasicTokenizer in one pass: invalid and
+    control characters are removed, whitespace becomes a space and CJK characters are surrounded by spaces.
+    Entries are computed on first use with the same predicates as BasicTokenizer."""
+
+    def __init__(self, basic_tokenizer):
+        super(_CharTable, self).__init__()
+        self.basic_tokenizer = basic_tokenizer
+
+    def __missing__(self, cp):
+        char = chr(cp)
+        if cp == 0 or cp == 0xfffd or _is_control(char):
+            value = None
+        elif _is_whitespace(char):
+            value = " "
+        elif self.basic_tokenizer._is_chinese_char(cp):
+            value = " " + char + " "
+        else:
+            value = char
+        self[cp] = value
+        return value
+
+
+class FastTokenizer(FullTokenizer):
+    """A FullTokenizer producing identical tokens and ids with much less Python work per text.
+
+    The character-level cleanup of BasicTokenizer runs as a single str.translate over a memoized
+    character table, each whitespace-separated token is converted to ids once (greedy longest-match
+    WordPiece over a trie of the vocab) and memoized, and whole-text results are kept in an LRU cache
+    of `cache_size` entries.
+    """
+
+    # per-token memo is cleared when it grows beyond this many entries
+    max_token_cache_size = 1 << 18
+
+    def __init__(self, vocab_file=default_vocab(), do_lower_case=True, cache_size=65536):
+        super(FastTokenizer, self).__init__(vocab_file=vocab_file, do_lower_case=do_lower_case)
+        self.cache_size = cache_size
+        self.unk_id = self.vocab[self.wordpiece_tokenizer.unk_token]
+        # tries of the vocab: word-initial pieces, and word-continuation pieces with their "##" stripped
+        self._word_trie, self._suffix_trie = {}, {}
+        for token, index in self.vocab.items():
+            self._add_to_trie(self._word_trie, token, index)
+            if token.startswith("##"):
+                self._add_to_trie(self._suffix_trie, token[2:], index)
+        self._init_caches()
+
+    def _init_caches(self):
+        self._char_table = _CharTable(self.basic_tokenizer)
+        self._token_cache = {}
+        self._encode_cached = lru_cache(maxsize=self.cache_size)(self._encode)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_char_table", "_token_cache", "_encode_cached"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
+
+    @staticmethod
+    def _add_to_trie(trie, token, index):
+        if not token:
+            return
+        node = trie
+        for char in token:
+            node = node.setdefault(char, {})
+        # "" never is a character, so it marks the end of a vocab entry
+        node[""] = index
+
+    def _wordpiece_ids(self, word):
+        if len(word) > self.wordpiece_tokenizer.max_input_chars_per_word:
+            return [self.unk_id]
+        ids = []
+        trie = self._word_trie
+        start = 0
+        while start < len(word):
+            node = trie
+            match_id, match_end = None, start
+            for end in range(start, len(word)):
+                node = node.get(word[end])
+                if node is None:
+                    break
+                if "" in node:
+                    match_id, match_end = node[""], end + 1
+            if match_id is None:
+                return [self.unk_id]
+            ids.append(match_id)
+            start = match_end
+            trie = self._suffix_trie
+        return ids
+
+    def _token_ids(self, token):
+        ids = self._token_cache.get(token)
+        if ids is None:
+            text = token
+            if self.basic_tokenizer.do_lower_case:
+                text = self.basic_tokenizer._run_strip_accents(text.lower())
+            ids = []
+            for piece in whitespace_tokenize(" ".join(self.basic_tokenizer._run_split_on_punc(text))):
+                ids.extend(self._wordpiece_ids(piece))
+            if len(self._token_cache) >= self.max_token_cache_size:
+                self._token_cache.clear()
+            self._token_cache[token] = ids
+        return ids
+
+    def _encode(self, text):
+        ids = []
+        for token in text.translate(self._char_table).split():
+            ids.extend(self._token_ids(token))
+        return tuple(ids)
+
+    def encode(self, text):
+        """Tokenizes a piece of text into a tuple of token ids (without [CLS] and [SEP])."""
+        return self._encode_cached(convert_to_unicode(text))
+
+    def tokenize(self, text):
+        return [self.inv_vocab[index] for index in self.encode(text)]
+
+
+class LazyTokenizer(object):
+    """Builds a tokenizer (FastTokenizer by default) on first use and forwards attribute access to it.
+
+    Reading the vocab and building the tries takes a noticeable part of `import cn_clip.clip`, which
+    processes that never tokenize (image-only serving, decode workers) should not pay for.
+    """
+
+    def __init__(self, tokenizer_class=FastTokenizer, **kwargs):
+        self._tokenizer_class = tokenizer_class
+        self._kwargs = kwargs
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the underlying tokenizer, building it if needed."""
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = self._tokenizer_class(**self._kwargs)
+        return self._tokenizer
+
+    def __getattr__(self, name):
+        # only called for names missing on the proxy itself; never build the tokenizer for
+        # special method lookups (copy, pickle) or before __init__ has run
+        if name.startswith("__") or name in ("_tokenizer_class", "_kwargs", "_tokenizer", "_lock"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __reduce__(self):
+        return self.__class__, (self._tokenizer_class,), {"_kwargs": self._kwargs}
+
+    def __setstate__(self, state):
+        self._kwargs = state["_kwargs"]
+
+
 class BasicTokenizer(object):
     """Runs basic tokenization (punctuation splitting, lower casing, etc.)."""
 
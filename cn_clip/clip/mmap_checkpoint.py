@@ -0,0 +1,103 @@
+"""
+Reading and writing flat, memory-mappable checkpoints in the safetensors layout:
+an 8-byte little-endian header size, a JSON header mapping each tensor name to its dtype, shape and byte
+offsets (plus a "__metadata__" dict of strings), then the raw little-endian tensor data.
+Files written here can be read by the safetensors library and vice versa, but the library is not required.
+"""
+
+import json
+import mmap
+import struct
+from typing import Dict, Optional, Tuple
+
+import torch
+
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+_DTYPE_NAMES = {dtype: name for name, dtype in _DTYPES.items()}
+_ITEMSIZES = {dtype: torch.empty(0, dtype=dtype).element_size() for dtype in _DTYPES.values()}
+
+
+def save_mmap_checkpoint(tensors: Dict[str, torch.Tensor], path: str, metadata: Optional[Dict[str, str]] = None):
+    """
+    Write the tensors to path. Tensors are laid out by decreasing element size, so that every tensor is
+    aligned to its element size and can be mapped without a copy.
+    """
+    tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in tensors.items()}
+    names = sorted(tensors, key=lambda name: -tensors[name].element_size())
+
+    header = {}
+    if metadata:
+        header["__metadata__"] = {key: str(value) for key, value in metadata.items()}
+    offset = 0
+    for name in names:
+        tensor = tensors[name]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": _DTYPE_NAMES[tensor.dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + nbytes],
+        }
+        offset += nbytes
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # pad the header with spaces so that the tensor data starts at an 8-byte boundary
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name in names:
+            tensor = tensors[name]
+            if tensor.numel() > 0:
+                f.write(tensor.reshape(-1).view(torch.uint8).numpy())
+
+
+def _read_header(f) -> Tuple[dict, int]:
+    header_size, = struct.unpack("<Q", f.read(8))
+    header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def read_mmap_checkpoint_metadata(path: str) -> Dict[str, str]:
+    """Return the "__metadata__" dict of a checkpoint without mapping its tensors."""
+    with open(path, "rb") as f:
+        header, _ = _read_header(f)
+    return header.get("__metadata__", {})
+
+
+def load_mmap_checkpoint(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Memory-map the checkpoint at path and return (tensors, metadata). The tensors are views into a private
+    copy-on-write mapping of the file: nothing is read until a tensor is used, and pages of unused tensors
+    are never loaded. The mapping stays alive as long as any of the tensors does.
+    """
+    with open(path, "rb") as f:
+        header, data_start = _read_header(f)
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop("__metadata__", {})
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = _DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        offset = data_start + begin
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        elif offset % _ITEMSIZES[dtype] == 0:
+            tensors[name] = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // _ITEMSIZES[dtype],
+                                             offset=offset).view(info["shape"])
+        else:
+            # files written by other tools do not have to keep tensors aligned, copy those
+            tensors[name] = torch.frombuffer(buffer, dtype=torch.uint8, count=end - begin,
+                                             offset=offset).clone().view(dtype).view(info["shape"])
+    return tensors, metadata
@@ -19,6 +19,10 @@ from cn_clip.clip import _tokenizer
 from cn_clip.clip.configuration_bert import BertConfig
 from cn_clip.clip.modeling_bert import BertModel
 
+# which towers of CLIP to instantiate: the text-only and vision-only models keep the logit scale, and their
+# own projection, so that encode_text / encode_image give the same features as the full model
+TOWERS = ("both", "text", "vision")
+
 
 class Bottleneck(nn.Module):
     expansion = 4
@@ -183,7 +187,8 @@ class QuickGELU(nn.Module):
 
 
 class ResidualAttentionBlock(nn.Module):
-    def __init__(self, d_model: int, n_head: int, attn_mask: torch.Tensor = None, use_flash_attention: bool = False):
+    def __init__(self, d_model: int, n_head: int, attn_mask: torch.Tensor = None, use_flash_attention: bool = False,
+                 use_sdpa: bool = False):
         super().__init__()
 
         self.attn = nn.MultiheadAttention(d_model, n_head) if not use_flash_attention else FlashMHA(d_model, n_head)
@@ -196,12 +201,27 @@ class ResidualAttentionBlock(nn.Module):
         self.ln_2 = LayerNorm(d_model)
         self.attn_mask = attn_mask
         self.use_flash_attention = use_flash_attention
+        self.use_sdpa = use_sdpa and not use_flash_attention
+
+    def sdpa_attention(self, x: torch.Tensor):
+        # Same computation as nn.MultiheadAttention using its own projection weights,
+        # with the attention itself done by the fused scaled_dot_product_attention kernel.
+        length, batch_size, width = x.shape
+        n_head = self.attn.num_heads
+        q, k, v = F.linear(x, self.attn.in_proj_weight, self.attn.in_proj_bias).chunk(3, dim=-1)
+        q, k, v = [t.reshape(length, batch_size, n_head, width // n_head).permute(1, 2, 0, 3) for t in (q, k, v)]
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=self.attn_mask,
+                                             dropout_p=self.attn.dropout if self.training else 0.0)
+        out = out.permute(2, 0, 1, 3).reshape(length, batch_size, width)
+        return self.attn.out_proj(out)
 
     def attention(self, x: torch.Tensor):
         self.attn_mask = self.attn_mask.to(dtype=x.dtype, device=x.device) if self.attn_mask is not None else None
         if self.use_flash_attention:
             # Batch first is needed for FlashAttention. See https://github.com/HazyResearch/flash-attention/issues/84 for more information.
             return self.attn(x.transpose(1, 0))[0].transpose(1, 0)
+        elif self.use_sdpa:
+            return self.sdpa_attention(x)
         else:
             return self.attn(x, x, x, need_weights=False, attn_mask=self.attn_mask)[0]
 
@@ -212,12 +232,13 @@ class ResidualAttentionBlock(nn.Module):
 
 
 class Transformer(nn.Module):
-    def __init__(self, width: int, layers: int, heads: int, attn_mask: torch.Tensor = None, use_flash_attention: bool = False):
+    def __init__(self, width: int, layers: int, heads: int, attn_mask: torch.Tensor = None, use_flash_attention: bool = False,
+                 use_sdpa: bool = False):
         super().__init__()
         self.width = width
         self.layers = layers
         self.grad_checkpointing = False
-        self.resblocks = nn.Sequential(*[ResidualAttentionBlock(width, heads, attn_mask, use_flash_attention) for _ in range(layers)])
+        self.resblocks = nn.Sequential(*[ResidualAttentionBlock(width, heads, attn_mask, use_flash_attention, use_sdpa) for _ in range(layers)])
 
     def forward(self, x: torch.Tensor):
         if self.grad_checkpointing and not torch.jit.is_scripting():
@@ -228,7 +249,8 @@ class Transformer(nn.Module):
 
 
 class VisualTransformer(nn.Module):
-    def __init__(self, input_resolution: int, patch_size: int, width: int, layers: int, heads: int, output_dim: int, use_flash_attention: bool = False):
+    def __init__(self, input_resolution: int, patch_size: int, width: int, layers: int, heads: int, output_dim: int, use_flash_attention: bool = False,
+                 use_sdpa: bool = False):
         super().__init__()
         self.input_resolution = input_resolution
         self.grid_size = (self.input_resolution // patch_size, self.input_resolution // patch_size)
@@ -240,7 +262,7 @@ class VisualTransformer(nn.Module):
         self.positional_embedding = nn.Parameter(scale * torch.randn((input_resolution // patch_size) ** 2 + 1, width))
         self.ln_pre = LayerNorm(width)
 
-        self.transformer = Transformer(width, layers, heads, use_flash_attention=use_flash_attention)
+        self.transformer = Transformer(width, layers, heads, use_flash_attention=use_flash_attention, use_sdpa=use_sdpa)
 
         self.ln_post = LayerNorm(width)
         self.proj = nn.Parameter(scale * torch.randn(width, output_dim))
@@ -311,10 +333,19 @@ class CLIP(nn.Module):
                  # vision head width, added this param for ViT-H
                  vision_head_width: int = 64,
                  use_flash_attention: bool = False,
+                 # route attention through torch.nn.functional.scaled_dot_product_attention (PyTorch >= 2.0)
+                 use_sdpa: bool = False,
+                 towers: str = "both",
                  ):
         super().__init__()
-
-        if isinstance(vision_layers, (tuple, list)):
+        if use_sdpa:
+            assert hasattr(F, "scaled_dot_product_attention"), "use_sdpa requires PyTorch >= 2.0"
+        assert towers in TOWERS, f"towers should be one of {TOWERS}, got {towers}"
+        self.towers = towers
+
+        if towers == "text":
+            self.visual = None
+        elif isinstance(vision_layers, (tuple, list)):
             vision_heads = vision_width * 32 // vision_head_width
             self.visual = ModifiedResNet(
                 layers=vision_layers,
@@ -332,7 +363,8 @@ class CLIP(nn.Module):
                 layers=vision_layers,
                 heads=vision_heads,
                 output_dim=embed_dim,
-                use_flash_attention=use_flash_attention
+                use_flash_attention=use_flash_attention,
+                use_sdpa=use_sdpa
             )
 
         self.bert_config = BertConfig(
@@ -348,11 +380,15 @@ class CLIP(nn.Module):
             type_vocab_size=text_type_vocab_size,
             initializer_range=text_initializer_range,
             layer_norm_eps=1e-12,
-            use_flash_attention=use_flash_attention
+            use_flash_attention=use_flash_attention,
+            use_sdpa=use_sdpa
         )
-        self.bert = BertModel(self.bert_config)
-
-        self.text_projection = nn.Parameter(torch.empty(text_hidden_size, embed_dim))
+        if towers == "vision":
+            self.bert = None
+            self.text_projection = None
+        else:
+            self.bert = BertModel(self.bert_config)
+            self.text_projection = nn.Parameter(torch.empty(text_hidden_size, embed_dim))
         self.logit_scale = nn.Parameter(torch.ones([]) * np.log(1 / 0.07))
 
         self.tokenizer = tokenizer
@@ -380,22 +416,46 @@ class CLIP(nn.Module):
 
     @torch.jit.ignore
     def set_grad_checkpointing(self, enable=True):
-        self.visual.set_grad_checkpointing(enable)
-        self.bert.set_grad_checkpointing(enable)
+        if self.visual is not None:
+            self.visual.set_grad_checkpointing(enable)
+        if self.bert is not None:
+            self.bert.set_grad_checkpointing(enable)
 
     @property
     def dtype(self):
+        if self.visual is None:
+            return self.text_projection.dtype
         return self.visual.conv1.weight.dtype
 
     def encode_image(self, image, mask_ratio=0):
+        assert self.visual is not None, "The vision tower is not loaded (towers='text')"
         if isinstance(self.visual, ModifiedResNet):
             # mask_ratio > 0 (FLIP strategy) is currently only implemented for VisualTransformer.
             return self.visual(image.type(self.dtype))
         return self.visual(image.type(self.dtype), mask_ratio)
 
-    def encode_text(self, text):
+    def encode_text(self, text, attention_mask=None, lengths=None, trim_padding=True):
+        """
+        attention_mask ([batch_size, seq_length], 1 for real tokens) and lengths ([batch_size]), as returned by
+        clip.tokenize_batch, are optional; when given they are used instead of being derived from the padding.
+        """
+        assert self.bert is not None, "The text tower is not loaded (towers='vision')"
         pad_index = self.tokenizer.vocab['[PAD]']
-        attn_mask = text.ne(pad_index).type(self.dtype)
+        if trim_padding and not torch.jit.is_tracing() and not torch.onnx.is_in_onnx_export():
+            # Padding is masked out of attention and only the [CLS] output is used, so trailing
+            # columns that are padding in every row can be dropped without changing the result.
+            if lengths is not None:
+                max_length = int(lengths.max()) if lengths.numel() > 0 else 0
+            else:
+                columns = text.ne(pad_index).any(dim=0).nonzero()
+                max_length = int(columns.max()) + 1 if columns.numel() > 0 else 0
+            if max_length > 0:
+                text = text[:, :max_length]
+                if attention_mask is not None:
+                    attention_mask = attention_mask[:, :max_length]
+        if attention_mask is None:
+            attention_mask = text.ne(pad_index)
+        attn_mask = attention_mask.type(self.dtype)
         x = self.bert(text, attention_mask=attn_mask)[0].type(self.dtype) # [batch_size, seq_length, hidden_size]
         return x[:, 0, :] @ self.text_projection
 
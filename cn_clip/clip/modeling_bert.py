@@ -25,6 +25,7 @@ import sys
 from io import open
 
 import torch
+import torch.nn.functional as F
 from torch import nn
 from torch.utils.checkpoint import checkpoint
 
@@ -109,6 +110,7 @@ class BertSelfAttention(nn.Module):
         self.value = nn.Linear(config.hidden_size, self.all_head_size)
 
         self.dropout = nn.Dropout(config.attention_probs_dropout_prob)
+        self.use_sdpa = getattr(config, "use_sdpa", False)
 
     def transpose_for_scores(self, x):
         new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
@@ -124,6 +126,15 @@ class BertSelfAttention(nn.Module):
         key_layer = self.transpose_for_scores(mixed_key_layer)
         value_layer = self.transpose_for_scores(mixed_value_layer)
 
+        if self.use_sdpa and not self.output_attentions and head_mask is None:
+            # Fused kernel computing the same masked softmax attention without materializing the scores.
+            context_layer = F.scaled_dot_product_attention(
+                query_layer, key_layer, value_layer, attn_mask=attention_mask,
+                dropout_p=self.dropout.p if self.training else 0.0)
+            context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
+            new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
+            return (context_layer.view(*new_context_layer_shape),)
+
         # Take the dot product between "query" and "key" to get the raw attention scores.
         attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
         attention_scores = attention_scores / math.sqrt(self.attention_head_size)
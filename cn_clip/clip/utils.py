@@ -1,19 +1,26 @@
 # Code modified from https://github.com/openai/CLIP
 
+import inspect
+import itertools
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Union, List
+from typing import Union, List, NamedTuple
 import urllib
 
+import numpy as np
 import torch
-from torchvision.transforms import Compose, ToTensor, Normalize, Resize, InterpolationMode
+from PIL import Image
 from tqdm import tqdm
 
 from cn_clip.clip import _tokenizer
-from cn_clip.clip.model import convert_weights, CLIP, restore_model
+from cn_clip.clip.model import convert_weights, CLIP, restore_model, VisualTransformer
+from cn_clip.clip.mmap_checkpoint import load_mmap_checkpoint, read_mmap_checkpoint_metadata
 
-__all__ = ["load", "tokenize", "available_models", "image_transform", "load_from_name"]
+__all__ = ["load", "tokenize", "tokenize_batch", "TokenizedTexts", "available_models", "image_transform", "load_from_name", "draft_image",
+           "BatchImageTransform", "quantize_dynamic_int8"]
 
 _MODELS = {
     "ViT-B-16": "https://clip-cn-beijing.oss-cn-beijing.aliyuncs.com/checkpoints/clip_cn_vit-b-16.pt",
@@ -82,27 +89,64 @@ def available_models() -> List[str]:
 
 
 def load_from_name(name: str, device: Union[str, torch.device] = "cuda" if torch.cuda.is_available() else "cpu",
-                   download_root: str = None, vision_model_name: str = None, text_model_name: str = None, input_resolution: int = None):
+                   download_root: str = None, vision_model_name: str = None, text_model_name: str = None, input_resolution: int = None,
+                   use_sdpa: bool = False, towers: str = "both"):
+    """
+    Load a pretrained Chinese-CLIP model by name or checkpoint path.
+    With use_sdpa=True, BERT self-attention and the ViT attention blocks run through
+    torch.nn.functional.scaled_dot_product_attention (PyTorch >= 2.0) for faster inference.
+    With towers="text" (or "vision") only the text (or vision) encoder is built and loaded, the weights of
+    the other tower are skipped; the returned model then only supports encode_text (or encode_image).
+    A .safetensors checkpoint converted by cn_clip/deploy/pytorch_to_safetensors.py is memory-mapped instead
+    of unpickled, see create_model_from_mmap; its model names and resolution default to the ones stored in it.
+    """
     if name in _MODELS:
         model_path = _download(_MODELS[name], download_root or os.path.expanduser("~/.cache/clip"))
         model_name, model_input_resolution = _MODEL_INFO[name]['struct'], _MODEL_INFO[name]['input_resolution']
     elif os.path.isfile(name):
+        if name.endswith(".safetensors"):
+            metadata = read_mmap_checkpoint_metadata(name)
+            if "model_name" in metadata:
+                default_vision_model_name, default_text_model_name = metadata["model_name"].split("@")
+                vision_model_name = vision_model_name or default_vision_model_name
+                text_model_name = text_model_name or default_text_model_name
+                input_resolution = input_resolution or int(metadata["input_resolution"])
         assert vision_model_name and text_model_name and input_resolution, "Please specify specific 'vision_model_name', 'text_model_name', and 'input_resolution'"
         model_path = name
         model_name, model_input_resolution = f'{vision_model_name}@{text_model_name}', input_resolution
     else:
         raise RuntimeError(f"Model {name} not found; available models = {available_models()}")
 
-    with open(model_path, 'rb') as opened_file:
+    if model_path.endswith(".safetensors"):
+        model = create_model_from_mmap(model_name, model_path, use_sdpa=use_sdpa, towers=towers)
+    else:
         # loading saved checkpoint
-        checkpoint = torch.load(opened_file, map_location="cpu")
-
-    model = create_model(model_name, checkpoint)
+        checkpoint = _load_checkpoint(model_path)
+        model = create_model(model_name, checkpoint, use_sdpa=use_sdpa, towers=towers)
+        del checkpoint
     if str(device) == "cpu":
         model.float()
     else:
         model.to(device)
-    return model, image_transform(model_input_resolution)
+        # memory-mapped checkpoints may be stored in fp32, use the same precision as create_model on GPU
+        convert_weights(model)
+    return model, _DeferredImageTransform(model_input_resolution)
+
+
+def _load_checkpoint(model_path: str):
+    """
+    Load a checkpoint on CPU. Zipfile checkpoints are memory-mapped when PyTorch supports it (>= 2.1),
+    so tensors that are never copied into the model, e.g. the weights of a tower that is not built,
+    are not read from disk.
+    """
+    if "mmap" in inspect.signature(torch.load).parameters:
+        try:
+            return torch.load(model_path, map_location="cpu", mmap=True)
+        except RuntimeError:
+            # checkpoints saved in the legacy (non-zipfile) format cannot be memory-mapped
+            pass
+    with open(model_path, 'rb') as opened_file:
+        return torch.load(opened_file, map_location="cpu")
 
 
 def load(model, device: Union[str, torch.device] = "cuda" if torch.cuda.is_available() else "cpu", clip_path=None,
@@ -120,6 +164,21 @@ def load(model, device: Union[str, torch.device] = "cuda" if torch.cuda.is_avail
     return model
 
 
+def quantize_dynamic_int8(model):
+    """
+    Apply dynamic int8 quantization (int8 weights, activations quantized on the fly) to the Linear layers of
+    the BERT text encoder and of the visual Transformer, for CPU inference. The model is modified in place.
+    Linear layers inside nn.MultiheadAttention, the patch embedding and the projections stay in fp32.
+    """
+    quantize_dynamic = getattr(torch, "ao", torch).quantization.quantize_dynamic
+    model.float().eval()
+    if model.bert is not None:
+        quantize_dynamic(model.bert, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if isinstance(model.visual, VisualTransformer):
+        quantize_dynamic(model.visual.transformer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
 def tokenize(texts: Union[str, List[str]], context_length: int = 52) -> torch.LongTensor:
     """
     Returns the tokenized representation of given input string(s)
@@ -133,38 +192,191 @@ def tokenize(texts: Union[str, List[str]], context_length: int = 52) -> torch.Lo
     -------
     A two-dimensional tensor containing the resulting tokens, shape = [number of input strings, context_length]
     """
-    if isinstance(texts, str):
-        texts = [texts]
+    return tokenize_batch(texts, context_length).input_ids
 
-    all_tokens = []
-    for text in texts:
-        all_tokens.append([_tokenizer.vocab['[CLS]']] + _tokenizer.convert_tokens_to_ids(_tokenizer.tokenize(text))[
-                                                        :context_length - 2] + [_tokenizer.vocab['[SEP]']])
 
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
+class TokenizedTexts(NamedTuple):
+    input_ids: torch.LongTensor  # [number of input strings, context_length], zero padded
+    attention_mask: torch.LongTensor  # [number of input strings, context_length], 1 for real tokens
+    lengths: torch.LongTensor  # [number of input strings], real tokens including [CLS] and [SEP]
 
-    for i, tokens in enumerate(all_tokens):
-        assert len(tokens) <= context_length
-        result[i, :len(tokens)] = torch.tensor(tokens)
 
-    return result
+def _encode_texts(texts):
+    encode = _tokenizer.encode
+    return [encode(text) for text in texts]
+
+
+def tokenize_batch(texts: Union[str, List[str]], context_length: int = 52, executor=None,
+                   chunk_size: int = 1024) -> TokenizedTexts:
+    """
+    Tokenizes a batch of strings into a single preallocated id matrix, together with the attention mask and the
+    true lengths that CLIP.encode_text accepts, so that the encoder does not recompute them from the padding.
+    For huge batches, pass a concurrent.futures executor (threads or processes) to tokenize chunks of
+    chunk_size strings in parallel.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    assert context_length >= 2, "context_length should leave room for [CLS] and [SEP]"
+
+    if executor is not None and len(texts) > chunk_size:
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        encoded = list(itertools.chain.from_iterable(executor.map(_encode_texts, chunks)))
+    else:
+        encoded = _encode_texts(texts)
+
+    # scatter all token ids into the padded matrix at once: row i gets [CLS] ids[:context_length - 2] [SEP]
+    num_texts, max_tokens = len(encoded), context_length - 2
+    body_lengths = np.fromiter((min(len(ids), max_tokens) for ids in encoded), dtype=np.int64, count=num_texts)
+    flat_ids = np.fromiter(itertools.chain.from_iterable(ids[:max_tokens] for ids in encoded), dtype=np.int64,
+                           count=int(body_lengths.sum()))
+    row_starts = np.arange(num_texts, dtype=np.int64) * context_length
+    positions = np.arange(len(flat_ids), dtype=np.int64) + np.repeat(
+        row_starts + 1 - (np.cumsum(body_lengths) - body_lengths), body_lengths)
+    input_ids = np.zeros((num_texts, context_length), dtype=np.int64)
+    input_ids.reshape(-1)[positions] = flat_ids
+    lengths = body_lengths + 2
+    input_ids[:, 0] = _tokenizer.vocab['[CLS]']
+    input_ids.reshape(-1)[row_starts + lengths - 1] = _tokenizer.vocab['[SEP]']
+    attention_mask = (np.arange(context_length) < lengths[:, None]).astype(np.int64)
+
+    return TokenizedTexts(torch.from_numpy(input_ids), torch.from_numpy(attention_mask), torch.from_numpy(lengths))
 
 
 def _convert_to_rgb(image):
     return image.convert('RGB')
 
 
-def image_transform(image_size=224):
-    transform = Compose([
+_IMAGE_MEAN = (0.48145466, 0.4578275, 0.40821073)
+_IMAGE_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def draft_image(image, image_size=224):
+    """
+    Configure a not-yet-loaded JPEG image to be decoded in the DCT domain at 1/2, 1/4 or 1/8 scale,
+    choosing the strongest reduction that keeps both sides no smaller than image_size.
+    Images of other formats, or images that are already loaded, are returned unchanged.
+    """
+    image.draft(None, (image_size, image_size))
+    return image
+
+
+def image_transform(image_size=224, fast_decode=False):
+    """
+    Build the image preprocessing pipeline. With fast_decode=True, JPEG inputs are decoded
+    directly near the target resolution (see draft_image) before the bicubic resize, which is much
+    cheaper for high-resolution inputs and gives numerically close results.
+    """
+    # torchvision takes seconds to import and the serving path only needs BatchImageTransform
+    from torchvision.transforms import Compose, ToTensor, Normalize, Resize, InterpolationMode
+
+    transforms = [
         Resize((image_size, image_size), interpolation=InterpolationMode.BICUBIC),
         _convert_to_rgb,
         ToTensor(),
-        Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
-    ])
+        Normalize(_IMAGE_MEAN, _IMAGE_STD),
+    ]
+    if fast_decode:
+        transforms.insert(0, partial(draft_image, image_size=image_size))
+    transform = Compose(transforms)
     return transform
 
 
-def create_model(model_name, checkpoint=None):
+class _DeferredImageTransform:
+    """image_transform(image_size), built on the first call so that loading a model does not import torchvision."""
+
+    def __init__(self, image_size):
+        self.image_size = image_size
+        self._transform = None
+
+    def __call__(self, image):
+        if self._transform is None:
+            self._transform = image_transform(self.image_size)
+        return self._transform(image)
+
+
+class BatchImageTransform:
+    """
+    Batched counterpart of image_transform producing the same model inputs.
+
+    Images are resized (bicubic, then converted to RGB, in the same order as image_transform) by a
+    thread pool directly into one preallocated uint8 NHWC buffer. Normalization is then applied once
+    to the whole batch as a single fused multiply-add, optionally on the target device and in fp16,
+    so no per-image float tensors are allocated.
+    """
+
+    def __init__(self, image_size=224, fast_decode=False, num_threads=0):
+        self.image_size = image_size
+        self.fast_decode = fast_decode
+        self.num_threads = num_threads or min(8, os.cpu_count() or 1)
+        self._pool = None
+        # (x / 255 - mean) / std == x * scale + shift
+        mean, std = torch.tensor(_IMAGE_MEAN), torch.tensor(_IMAGE_STD)
+        self._scale = (1.0 / (255.0 * std)).view(1, 3, 1, 1)
+        self._shift = (-mean / std).view(1, 3, 1, 1)
+
+    def __getstate__(self):
+        # the thread pool is not picklable, e.g. when the dataset is sent to DataLoader workers
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    def resize(self, image):
+        """Resize a single PIL image to a uint8 HWC RGB array."""
+        if self.fast_decode:
+            draft_image(image, self.image_size)
+        image = image.resize((self.image_size, self.image_size), Image.BICUBIC)
+        return np.asarray(_convert_to_rgb(image))
+
+    def to_uint8(self, images, out=None):
+        """Resize a list of PIL images in parallel into a uint8 NHWC buffer (allocated if out is None)."""
+        if out is None:
+            out = np.empty((len(images), self.image_size, self.image_size, 3), dtype=np.uint8)
+
+        def fill(i):
+            out[i] = self.resize(images[i])
+
+        if len(images) > 1 and self.num_threads > 1:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.num_threads, thread_name_prefix="image_transform")
+            list(self._pool.map(fill, range(len(images))))
+        else:
+            for i in range(len(images)):
+                fill(i)
+        return out
+
+    def stack(self, arrays, out=None):
+        """Stack already resized uint8 HWC arrays into a uint8 NHWC buffer."""
+        if out is None:
+            out = np.empty((len(arrays), self.image_size, self.image_size, 3), dtype=np.uint8)
+        for i, array in enumerate(arrays):
+            out[i] = array
+        return out
+
+    def normalize(self, pixels, dtype=torch.float32, device=None):
+        """
+        Normalize a uint8 NHWC batch (numpy array or tensor) into the NCHW model input.
+        The uint8 batch is moved to the device first, which transfers 4x less data than float32.
+        """
+        pixels = torch.as_tensor(pixels)
+        if device is not None:
+            pixels = pixels.to(device)
+        images = pixels.permute(0, 3, 1, 2).to(dtype)
+        scale = self._scale.to(device=images.device, dtype=dtype)
+        shift = self._shift.to(device=images.device, dtype=dtype)
+        return torch.addcmul(shift, images, scale).contiguous()
+
+    def __call__(self, images, dtype=torch.float32, device=None):
+        return self.normalize(self.to_uint8(images), dtype=dtype, device=device)
+
+
+# checkpoint keys of each tower, dropped when that tower is not built
+_TOWER_KEY_PREFIXES = {
+    "text": ("bert.", "text_projection"),
+    "vision": ("visual.",),
+}
+
+
+def _model_info(model_name):
     vision_model, text_model = model_name.split('@')
     # Initialize the model.
     vision_model_config_file = Path(
@@ -184,11 +396,38 @@ def create_model(model_name, checkpoint=None):
     if isinstance(model_info['vision_layers'], str):
         model_info['vision_layers'] = eval(model_info['vision_layers'])
     print('Model info', model_info)
-    model = CLIP(**model_info)
+    return model_info
+
+
+def create_model(model_name, checkpoint=None, use_sdpa=False, towers="both"):
+    model = CLIP(**_model_info(model_name), use_sdpa=use_sdpa, towers=towers)
     convert_weights(model)
     if checkpoint:
         sd = checkpoint["state_dict"]
         if next(iter(sd.items()))[0].startswith('module'):
             sd = {k[len('module.'):]: v for k, v in sd.items() if "bert.pooler" not in k}
-        model.load_state_dict(sd)
+        model.load_state_dict(_tower_state_dict(sd, towers))
+    return model
+
+
+def _tower_state_dict(sd, towers):
+    if towers == "both":
+        return sd
+    skipped = _TOWER_KEY_PREFIXES["vision" if towers == "text" else "text"]
+    return {k: v for k, v in sd.items() if not k.startswith(skipped)}
+
+
+def create_model_from_mmap(model_name, model_path, use_sdpa=False, towers="both"):
+    """
+    Build a model from a .safetensors checkpoint without copying its weights (PyTorch >= 2.1).
+    The model is constructed on the meta device, so no random initialization is done, and its parameters
+    are assigned views into the memory-mapped file, so weights are only read from disk when first used.
+    The parameters keep the dtypes stored in the file.
+    """
+    assert "assign" in inspect.signature(torch.nn.Module.load_state_dict).parameters, \
+        "Loading memory-mapped checkpoints requires PyTorch >= 2.1"
+    sd, _ = load_mmap_checkpoint(model_path)
+    with torch.device("meta"):
+        model = CLIP(**_model_info(model_name), use_sdpa=use_sdpa, towers=towers)
+    model.load_state_dict(_tower_state_dict(sd, towers), assign=True)
     return model
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+This script checks that the scaled_dot_product_attention fast path (use_sdpa=True) gives the same image and
+text features as the default attention implementation, and compares their inference latencies.
+"""
+
+import argparse
+
+import torch
+
+import cn_clip.clip as clip
+from cn_clip.clip.utils import create_model, _MODEL_INFO
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model-arch",
+        default="ViT-B-16",
+        choices=["ViT-B-16", "ViT-L-14", "ViT-L-14-336", "ViT-H-14", "RN50"],
+        help="Specify the architecture (model scale) of Chinese-CLIP model for speed comparison."
+    )
+    parser.add_argument('--pytorch-ckpt', type=str, default=None,
+                        help='The file path of pytorch checkpoint, if not set, a randomly initialized model is used.')
+    parser.add_argument("--device", choices=["cuda", "cpu"], default="cpu", help="CPU or GPU speed test. Default to cpu")
+    parser.add_argument('--batch-size', default=1, type=int, help='The batch-size of the inference input. Default to 1.')
+    parser.add_argument('--n', default=20, type=int, help='The iteration number for inference speed test. Default to 20.')
+    parser.add_argument('--warmup', default=3, type=int, help='Warmup iterations. Default to 3.')
+    parser.add_argument('--atol', default=1e-4, type=float,
+                        help='Max allowed absolute difference between the features of both implementations.')
+    parser.add_argument(
+        "--context-length", type=int, default=52, help="The padded length of input text (include [CLS] & [SEP] tokens). Default to 52."
+    )
+    return parser.parse_args()
+
+
+def prepare_pytorch_models(args):
+    checkpoint = None
+    if args.pytorch_ckpt:
+        with open(args.pytorch_ckpt, 'rb') as opened_file:
+            checkpoint = torch.load(opened_file, map_location="cpu")
+    models = {}
+    for use_sdpa in (False, True):
+        model = create_model(_MODEL_INFO[args.model_arch]['struct'], checkpoint, use_sdpa=use_sdpa)
+        if not use_sdpa and checkpoint is None:
+            state_dict = model.state_dict()
+        elif checkpoint is None:
+            # share the random weights so that the features are comparable
+            model.load_state_dict(state_dict)
+        model.float().eval()
+        if args.device == "cuda":
+            model.cuda()
+        models["sdpa" if use_sdpa else "default"] = model
+    return models
+
+
+def benchmark(name, fn, args):
+    with torch.no_grad():
+        for i in range(args.warmup):
+            fn()
+        time_buffer = list()
+        for i in range(args.n):
+            with track_infer_time(time_buffer):
+                output = fn()
+                if args.device == "cuda":
+                    torch.cuda.synchronize()
+    print_timings(name=name, timings=time_buffer)
+    return output
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    models = prepare_pytorch_models(args)
+    resolution = _MODEL_INFO[args.model_arch]['input_resolution']
+    torch.manual_seed(0)
+    image = torch.randn(args.batch_size, 3, resolution, resolution, device=args.device)
+    # a padded batch with queries of different lengths exercises the attention mask
+    queries = ["杰尼龟", "一只在草地上奔跑的金毛寻回犬", "皮卡丘", "城市夜景中的霓虹灯招牌和来往的行人"]
+    text = clip.tokenize([queries[i % len(queries)] for i in range(max(args.batch_size, 2))],
+                         context_length=args.context_length).to(args.device)
+
+    for modality, inputs in (("image", image), ("text", text)):
+        outputs = {}
+        for name, model in models.items():
+            encode = model.encode_image if modality == "image" else model.encode_text
+            outputs[name] = benchmark(f"Pytorch {name} attention {modality} inference speed (batch-size: {args.batch_size}):",
+                                      lambda: encode(inputs), args)
+        max_diff = (outputs["default"] - outputs["sdpa"]).abs().max().item()
+        print(f"Max abs difference of {modality} features between default and sdpa attention: {max_diff:.2e}")
+        assert max_diff <= args.atol, f"sdpa {modality} features differ from the default implementation"
+
+    print("Done!")
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+This script compares the full JPEG decode + preprocessing pipeline with the fast path that decodes
+JPEGs in the DCT domain near the target resolution (image_transform(..., fast_decode=True)).
+It reports the latencies of both pipelines, the pixel difference of the preprocessed tensors and,
+if a Pytorch checkpoint is given, the cosine similarity of the resulting image embeddings.
+"""
+
+import argparse
+import io
+
+import torch
+from PIL import Image
+
+from cn_clip.clip.utils import create_model, _MODEL_INFO, image_transform
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', type=str, default="examples/pokemon.jpeg", help='The JPEG image used for the test.')
+    parser.add_argument('--upscale', type=str, default="3840x2160",
+                        help='Re-encode the image in memory at this WIDTHxHEIGHT to emulate high-resolution inputs '
+                             '(e.g. 4K video frames). Set to empty string to use the original image.')
+    parser.add_argument('--quality', default=95, type=int, help='JPEG quality used when re-encoding. Default to 95.')
+    parser.add_argument(
+        "--model-arch",
+        default="ViT-L-14-336",
+        choices=["ViT-B-16", "ViT-L-14", "ViT-L-14-336", "ViT-H-14", "RN50"],
+        help="Specify the architecture (model scale) of Chinese-CLIP model, which decides the input resolution."
+    )
+    parser.add_argument('--pytorch-ckpt', type=str, default=None,
+                        help='The file path of pytorch checkpoint, if set, the embeddings of both pipelines are compared.')
+    parser.add_argument("--device", choices=["cuda", "cpu"], default="cpu", help="Device for the embedding comparison.")
+    parser.add_argument('--min-cosine', default=0.99, type=float,
+                        help='The minimal cosine similarity between fast and full decode embeddings. Default to 0.99.')
+    parser.add_argument('--n', default=50, type=int, help='The iteration number for decode speed test. Default to 50.')
+    parser.add_argument('--warmup', default=5, type=int, help='Warmup iterations. Default to 5.')
+    return parser.parse_args()
+
+
+def load_jpeg_bytes(args):
+    with open(args.image, 'rb') as f:
+        data = f.read()
+    if not args.upscale:
+        return data
+    width, height = (int(x) for x in args.upscale.lower().split("x"))
+    image = Image.open(io.BytesIO(data)).convert("RGB").resize((width, height), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=args.quality)
+    return buffer.getvalue()
+
+
+def benchmark(name, transform, data, args):
+    for i in range(args.warmup):
+        transform(Image.open(io.BytesIO(data)))
+    time_buffer = list()
+    for i in range(args.n):
+        with track_infer_time(time_buffer):
+            output = transform(Image.open(io.BytesIO(data)))
+    print_timings(name=name, timings=time_buffer)
+    return output
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    resolution = _MODEL_INFO[args.model_arch]['input_resolution']
+    data = load_jpeg_bytes(args)
+    print(f"Input JPEG: {Image.open(io.BytesIO(data)).size}, {len(data)} bytes")
+
+    full = benchmark(f"Full decode ({resolution}px):", image_transform(resolution), data, args)
+    fast = benchmark(f"Fast decode ({resolution}px):", image_transform(resolution, fast_decode=True), data, args)
+
+    diff = (full - fast).abs()
+    print(f"Preprocessed pixel difference: max={diff.max().item():.4f}, mean={diff.mean().item():.4f}")
+
+    if args.pytorch_ckpt:
+        with open(args.pytorch_ckpt, 'rb') as opened_file:
+            checkpoint = torch.load(opened_file, map_location="cpu")
+        model = create_model(_MODEL_INFO[args.model_arch]['struct'], checkpoint).float().to(args.device).eval()
+        with torch.no_grad():
+            features = model.encode_image(torch.stack([full, fast]).to(args.device))
+        features = features / features.norm(dim=-1, keepdim=True)
+        cosine = (features[0] @ features[1]).item()
+        print(f"Embedding cosine similarity between fast and full decode: {cosine:.6f}")
+        assert cosine >= args.min_cosine, \
+            f"Fast decode embedding drifted: cosine {cosine:.6f} < {args.min_cosine}"
+
+    print("Done!")
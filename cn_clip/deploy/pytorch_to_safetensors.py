@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+This script converts a PyTorch Chinese-CLIP checkpoint (.pt) to the flat, memory-mapped .safetensors format.
+load_from_name maps such a checkpoint into a model built on the meta device, without unpickling, random
+initialization or copying of the weights. The model structure and input resolution are stored in the file.
+"""
+
+import os
+import argparse
+
+import torch
+
+from cn_clip.clip.mmap_checkpoint import save_mmap_checkpoint, load_mmap_checkpoint
+from cn_clip.clip.utils import _MODELS, _MODEL_INFO, _download, _load_checkpoint, available_models, create_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model-arch",
+        required=True,
+        choices=["ViT-B-16", "ViT-L-14", "ViT-L-14-336", "ViT-H-14", "RN50"],
+        help="Specify the architecture (model scale) of Chinese-CLIP model to be converted."
+    )
+    parser.add_argument(
+        "--pytorch-ckpt-path",
+        default=None,
+        type=str,
+        help="Path of the input PyTorch Chinese-CLIP checkpoint. Default to None which will automatically download the pretrained checkpoint."
+    )
+    parser.add_argument(
+        "--download-root",
+        default=None,
+        type=str,
+        help="If --pytorch-ckpt-path is None, official pretrained ckpt will be downloaded under --download-root directory and converted. Default to ~/cache/clip/ ."
+    )
+    parser.add_argument(
+        "--save-path",
+        required=True,
+        type=str,
+        help="Path of the output .safetensors checkpoint."
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["fp32", "fp16"],
+        default="fp32",
+        help="Precision of the stored weights. fp32 (default) is mapped without any copy on CPU; "
+             "fp16 keeps the mixed precision of the .pt checkpoint (half the file size) and suits GPU serving."
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+    assert args.save_path.endswith(".safetensors"), "--save-path should end with .safetensors"
+
+    # prepare the PyTorch model weights
+    if args.pytorch_ckpt_path and os.path.isfile(args.pytorch_ckpt_path):
+        input_ckpt_path = args.pytorch_ckpt_path
+    elif args.model_arch in _MODELS:
+        input_ckpt_path = _download(_MODELS[args.model_arch], args.download_root or os.path.expanduser("~/.cache/clip"))
+    else:
+        raise RuntimeError(f"Model {args.model_arch} not found; available models = {available_models()}")
+
+    # restoring the weights into the model validates the checkpoint and normalizes its keys
+    model_name = _MODEL_INFO[args.model_arch]['struct']
+    model = create_model(model_name, _load_checkpoint(input_ckpt_path))
+    if args.dtype == "fp32":
+        model.float()
+    state_dict = model.state_dict()
+
+    metadata = {
+        "format": "pt",
+        "model_name": model_name,
+        "input_resolution": _MODEL_INFO[args.model_arch]['input_resolution'],
+    }
+    save_mmap_checkpoint(state_dict, args.save_path, metadata)
+
+    # check the round trip
+    restored, _ = load_mmap_checkpoint(args.save_path)
+    assert restored.keys() == state_dict.keys()
+    for key, tensor in state_dict.items():
+        assert restored[key].dtype == tensor.dtype and torch.equal(restored[key], tensor), f"Mismatch at {key}"
+    print(f"Converted {len(state_dict)} tensors ({os.path.getsize(args.save_path) / 2 ** 20:.1f} MB) to {args.save_path}")
+    print("Done!")
@@ -7,7 +7,7 @@ import argparse
 import torch
 from PIL import Image
 import cn_clip.clip as clip
-from cn_clip.clip.utils import create_model, _MODEL_INFO, image_transform
+from cn_clip.clip.utils import create_model, _MODEL_INFO, BatchImageTransform, quantize_dynamic_int8
 from cn_clip.training.main import convert_models_to_fp32, convert_weights
 from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
 
@@ -22,8 +22,9 @@ def parse_args():
     )
     parser.add_argument('--pytorch-ckpt', type=str, default=None, 
                         help='The file path of pytorch checkpoint, if not set, the program will not run Pytorch model.')
-    parser.add_argument('--pytorch-precision', choices=["fp16", "fp32"], default="fp16", 
-                        help='Flag for Pytorch model float point precision, default to using FP16 for evaluation.')
+    parser.add_argument('--pytorch-precision', choices=["fp16", "fp32", "int8"], default="fp16", 
+                        help='Flag for Pytorch model float point precision, default to using FP16 for evaluation. '
+                             'int8 applies dynamic quantization and only runs on CPU.')
     
     parser.add_argument('--onnx-image-model', type=str, default=None,
                         help='The file path of onnx image model, if not set, the program will not run image ONNX model.')
@@ -58,6 +59,9 @@ def prepare_pytorch_model(args):
         convert_weights(pt_model)
     else:
         convert_models_to_fp32(pt_model)
+    if args.pytorch_precision == "int8":
+        assert args.device == "cpu", "Dynamic int8 quantization only supports CPU inference."
+        quantize_dynamic_int8(pt_model)
     if args.device == "cuda":
         pt_model.cuda()
     return pt_model
@@ -78,8 +82,8 @@ if __name__ == '__main__':
         val = getattr(args, name)
         print(f"  {name}: {val}")
 
-    preprocess = image_transform(_MODEL_INFO[args.model_arch]['input_resolution'])
-    image = torch.vstack([preprocess(Image.open("examples/pokemon.jpeg")).unsqueeze(0)] * args.batch_size)
+    preprocess = BatchImageTransform(_MODEL_INFO[args.model_arch]['input_resolution'])
+    image = preprocess([Image.open("examples/pokemon.jpeg") for _ in range(args.batch_size)])
     text = torch.vstack([clip.tokenize(["杰尼龟"], context_length=args.context_length)] * args.batch_size)
     if args.device == "cuda":
         image = image.cuda()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+This script measures the cold start of a serving process: importing cn_clip, loading a checkpoint with
+load_from_name and running the first inference, together with the peak resident memory.
+Each run happens in a freshly spawned process. The checkpoint file may still be in the OS page cache from
+a previous run; drop the caches before the script (e.g. `echo 3 > /proc/sys/vm/drop_caches` as root) to
+include the disk reads.
+Compare a .pt checkpoint with the .safetensors file converted from it by pytorch_to_safetensors.py.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+from cn_clip.deploy.benchmark_utils import print_timings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, required=True,
+                        help='Comma separated checkpoint paths (.pt or .safetensors) to compare.')
+    parser.add_argument("--vision-model", type=str, default="ViT-L-14-336", help="Name of the vision backbone.")
+    parser.add_argument("--text-model", type=str, default="RoBERTa-wwm-ext-base-chinese", help="Name of the text backbone.")
+    parser.add_argument("--input-resolution", type=int, default=336, help="Input resolution of the vision backbone.")
+    parser.add_argument("--towers", choices=["both", "text", "vision"], default="both", help="Towers to load.")
+    parser.add_argument("--device", choices=["cuda", "cpu"], default="cpu", help="CPU or GPU startup test. Default to cpu")
+    parser.add_argument('--n', default=3, type=int, help='Number of cold starts per checkpoint. Default to 3.')
+    return parser.parse_args()
+
+
+def cold_start(args, checkpoint, queue):
+    start = time.perf_counter()
+    import torch
+    import cn_clip.clip as clip
+    imported = time.perf_counter()
+
+    model, _ = clip.load_from_name(checkpoint, device=args.device, vision_model_name=args.vision_model,
+                                   text_model_name=args.text_model, input_resolution=args.input_resolution,
+                                   towers=args.towers)
+    model.eval()
+    loaded = time.perf_counter()
+
+    with torch.no_grad():
+        if args.towers != "vision":
+            model.encode_text(clip.tokenize(["杰尼龟"]).to(args.device))
+        if args.towers != "text":
+            image = torch.zeros(1, 3, args.input_resolution, args.input_resolution, device=args.device)
+            model.encode_image(image)
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+    inferred = time.perf_counter()
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    queue.put((imported - start, loaded - imported, inferred - loaded, inferred - start, max_rss))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    context = multiprocessing.get_context("spawn")
+    for checkpoint in args.checkpoints.split(","):
+        results = []
+        for i in range(args.n):
+            queue = context.Queue()
+            process = context.Process(target=cold_start, args=(args, checkpoint, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+        print(f"Cold start of {checkpoint} (towers: {args.towers}):")
+        for i, phase in enumerate(["import", "load_from_name", "first inference", "total"]):
+            print_timings(name=phase, timings=[result[i] for result in results])
+        print(f"  peak RSS: {max(result[4] for result in results):.0f} MB")
+
+    print("Done!")
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+This script measures the text encoder speedup of trimming padding columns (CLIP.encode_text with
+trim_padding=True) on a realistic short-query distribution, and checks that the trimmed and the
+fully padded encoder produce the same features.
+Queries are sampled from the Chinese ImageNet class names, which are typically 2-6 characters long.
+"""
+
+import argparse
+import random
+
+import torch
+
+import cn_clip.clip as clip
+from cn_clip.clip.utils import create_model, _MODEL_INFO
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+from cn_clip.eval.imagenet_zeroshot_templates import imagenet_classnames, openai_imagenet_template
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model-arch",
+        default="ViT-B-16",
+        choices=["ViT-B-16", "ViT-L-14", "ViT-L-14-336", "ViT-H-14", "RN50"],
+        help="Specify the architecture (model scale) of Chinese-CLIP model for speed comparison."
+    )
+    parser.add_argument('--pytorch-ckpt', type=str, default=None,
+                        help='The file path of pytorch checkpoint, if not set, a randomly initialized model is used '
+                             '(the speed does not depend on the weights).')
+    parser.add_argument("--device", choices=["cuda", "cpu"], default="cpu", help="CPU or GPU speed test. Default to cpu")
+    parser.add_argument('--batch-sizes', type=str, default="1,8,32",
+                        help='Comma separated batch sizes to test. Default to 1,8,32.')
+    parser.add_argument('--with-templates', action="store_true",
+                        help='Wrap each class name with a random ImageNet prompt template to get longer queries.')
+    parser.add_argument(
+        "--context-length", type=int, default=52, help="The padded length of input text (include [CLS] & [SEP] tokens). Default to 52."
+    )
+    parser.add_argument('--n', default=50, type=int, help='The iteration number for inference speed test. Default to 50.')
+    parser.add_argument('--warmup', default=5, type=int, help='Warmup iterations. Default to 5.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed for sampling queries.')
+    return parser.parse_args()
+
+
+def prepare_pytorch_model(args):
+    checkpoint = None
+    if args.pytorch_ckpt:
+        with open(args.pytorch_ckpt, 'rb') as opened_file:
+            checkpoint = torch.load(opened_file, map_location="cpu")
+    model = create_model(_MODEL_INFO[args.model_arch]['struct'], checkpoint)
+    model.float().eval()
+    if args.device == "cuda":
+        model.cuda()
+    return model
+
+
+def sample_queries(args, batch_size):
+    queries = random.sample(imagenet_classnames, batch_size)
+    if args.with_templates:
+        queries = [random.choice(openai_imagenet_template)(query) for query in queries]
+    return queries
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    random.seed(args.seed)
+    model = prepare_pytorch_model(args)
+
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        text = clip.tokenize(sample_queries(args, batch_size), context_length=args.context_length).to(args.device)
+        real_length = int(text.ne(0).sum(dim=1).max())
+        print(f"Batch size {batch_size}: longest real sequence {real_length} of {args.context_length} tokens")
+
+        results = {}
+        for trim_padding in (False, True):
+            name = "trimmed" if trim_padding else "padded"
+            with torch.no_grad():
+                for i in range(args.warmup):
+                    model.encode_text(text, trim_padding=trim_padding)
+                time_buffer = list()
+                for i in range(args.n):
+                    with track_infer_time(time_buffer):
+                        results[name] = model.encode_text(text, trim_padding=trim_padding)
+                        if args.device == "cuda":
+                            torch.cuda.synchronize()
+            print_timings(name=f"Pytorch {name} text inference speed (batch-size: {batch_size}):", timings=time_buffer)
+
+        max_diff = (results["padded"] - results["trimmed"]).abs().max().item()
+        print(f"Max abs difference between padded and trimmed features: {max_diff:.2e}")
+        assert torch.allclose(results["padded"], results["trimmed"], atol=1e-4), \
+            "Trimmed text features differ from the padded ones"
+
+    print("Done!")
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+This script checks that FastTokenizer produces exactly the same tokens and ids as FullTokenizer over a large
+corpus (the Chinese zero-shot class names and prompt templates, optional text files, and random strings mixing
+CJK, ASCII, punctuation, accents, control and whitespace characters), then compares the speed of clip.tokenize
+batches with both tokenizers.
+It also checks clip.tokenize_batch, which fills the id matrix, attention mask and lengths in one pass, against
+building the padded matrix row by row, and times it on a huge batch with thread and process executors.
+"""
+
+import argparse
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import torch
+
+import cn_clip.clip.utils as clip_utils
+from cn_clip.clip.bert_tokenizer import FullTokenizer, FastTokenizer
+from cn_clip.deploy.benchmark_utils import track_infer_time, print_timings
+from cn_clip.eval import cvinw_zeroshot_templates
+from cn_clip.eval.imagenet_zeroshot_templates import imagenet_classnames, openai_imagenet_template
+
+# code point ranges the random strings are drawn from
+_RANGES = [
+    (0x20, 0x7E),  # printable ASCII
+    (0x00, 0x1F), (0x7F, 0x9F),  # control characters
+    (0xC0, 0x17F), (0x300, 0x36F),  # accented Latin letters and combining marks
+    (0x370, 0x3FF), (0x400, 0x4FF),  # Greek and Cyrillic
+    (0x1FE0, 0x1FFF),  # Greek with accents, some decompose into ASCII punctuation
+    (0x2000, 0x206F),  # general punctuation, unicode spaces, zero-width and line separators
+    (0x3000, 0x303F), (0x3040, 0x30FF), (0xAC00, 0xAC7F),  # CJK symbols, kana and Hangul
+    (0x3400, 0x34FF), (0x4E00, 0x9FFF),  # CJK ideographs
+    (0xF900, 0xFAFF), (0x2F800, 0x2F8FF),  # CJK compatibility ideographs
+    (0xFF00, 0xFFEF), (0xFFF0, 0xFFFF),  # full-width forms and specials
+    (0x1F300, 0x1F64F), (0x20000, 0x200FF),  # emoji and CJK extension B
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', type=str, default=None,
+                        help='Comma separated text files added to the differential check, one text per line, '
+                             'either raw text or a json object with a "text" field (e.g. test_texts.jsonl).')
+    parser.add_argument('--num-random', default=200000, type=int,
+                        help='Number of random strings in the differential check. Default to 200000.')
+    parser.add_argument('--batch-sizes', type=str, default="1,32,256",
+                        help='Comma separated batch sizes of the clip.tokenize speed test. Default to 1,32,256.')
+    parser.add_argument(
+        "--context-length", type=int, default=52, help="The padded length of input text (include [CLS] & [SEP] tokens). Default to 52."
+    )
+    parser.add_argument('--huge-batch-size', default=50000, type=int,
+                        help='Batch size of the parallel clip.tokenize_batch test. Default to 50000.')
+    parser.add_argument('--workers', default=4, type=int,
+                        help='Number of thread / process workers of the parallel test. Default to 4.')
+    parser.add_argument('--n', default=50, type=int, help='The iteration number for the speed test. Default to 50.')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed.')
+    return parser.parse_args()
+
+
+def build_corpus(args):
+    corpus = list(imagenet_classnames)
+    corpus += [template(classname) for template in openai_imagenet_template for classname in imagenet_classnames[:100]]
+    corpus += [template(classname) for template in cvinw_zeroshot_templates.openai_templates
+               for classname in imagenet_classnames[100:200]]
+    if args.corpus:
+        for path in args.corpus.split(","):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line.startswith("{"):
+                        line = str(json.loads(line).get("text", ""))
+                    corpus.append(line)
+    for i in range(args.num_random):
+        chars = []
+        for j in range(random.randint(0, 80)):
+            low, high = random.choice(_RANGES)
+            chars.append(chr(random.randint(low, high)))
+        corpus.append("".join(chars))
+    # words longer than max_input_chars_per_word become [UNK]
+    corpus += ["a" * 201, "中文" + "b" * 300 + "。"]
+    return corpus
+
+
+def reference_ids(tokenizer, text):
+    return tuple(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text)))
+
+
+def tokenize_rowwise(texts, context_length):
+    # the original clip.tokenize output construction: one python list and one tensor per row
+    tokenizer = clip_utils._tokenizer
+    all_tokens = [[tokenizer.vocab['[CLS]']] + list(tokenizer.encode(text)[:context_length - 2]) +
+                  [tokenizer.vocab['[SEP]']] for text in texts]
+    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
+    for i, tokens in enumerate(all_tokens):
+        result[i, :len(tokens)] = torch.tensor(tokens)
+    return result
+
+
+def time_tokenize(name, fn, batches):
+    fn(batches[0])
+    time_buffer = list()
+    for batch in batches:
+        with track_infer_time(time_buffer):
+            fn(batch)
+    print_timings(name=name, timings=time_buffer)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    random.seed(args.seed)
+    full_tokenizer = FullTokenizer()
+    fast_tokenizer = FastTokenizer()
+
+    corpus = build_corpus(args)
+    print(f"Differential check over {len(corpus)} texts...")
+    mismatches = [text for text in corpus
+                  if fast_tokenizer.encode(text) != reference_ids(full_tokenizer, text)
+                  or fast_tokenizer.tokenize(text) != full_tokenizer.tokenize(text)]
+    print(f"{len(mismatches)} mismatches")
+    assert not mismatches, f"FastTokenizer differs from FullTokenizer on {mismatches[0]!r}"
+
+    queries = [random.choice(openai_imagenet_template)(classname) for classname in imagenet_classnames]
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        batches = [random.sample(queries, batch_size) for i in range(args.n)]
+        # a fresh FastTokenizer without the whole-text cache measures unseen texts,
+        # running the same batches twice through the cached tokenizer measures repeated texts
+        for name, tokenizer, rounds in (("FullTokenizer", FullTokenizer(), 1),
+                                        ("FastTokenizer (unseen texts)", FastTokenizer(cache_size=0), 1),
+                                        ("FastTokenizer (repeated texts)", FastTokenizer(), 2)):
+            clip_utils._tokenizer = tokenizer
+            for i in range(rounds):
+                time_buffer = list()
+                for batch in batches:
+                    with track_infer_time(time_buffer):
+                        clip_utils.tokenize(batch, context_length=args.context_length)
+            print_timings(name=f"{name} clip.tokenize speed (batch-size: {batch_size}):", timings=time_buffer)
+
+    clip_utils._tokenizer = fast_tokenizer
+    batch = clip_utils.tokenize_batch(corpus, context_length=args.context_length)
+    reference = tokenize_rowwise(corpus, args.context_length)
+    assert torch.equal(batch.input_ids, reference), "tokenize_batch ids differ from the row-wise construction"
+    assert torch.equal(batch.attention_mask, reference.ne(0).long()), "tokenize_batch mask differs from the padding"
+    assert torch.equal(batch.lengths, reference.ne(0).sum(dim=1)), "tokenize_batch lengths differ from the padding"
+    print(f"tokenize_batch output matches the row-wise construction over {len(corpus)} texts")
+
+    # texts are already in the whole-text cache here, so this only times the output construction
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        batches = [random.sample(queries, batch_size) for i in range(args.n)]
+        time_tokenize(f"Row-wise output construction (batch-size: {batch_size}):",
+                      lambda batch: tokenize_rowwise(batch, args.context_length), batches)
+        time_tokenize(f"tokenize_batch output construction (batch-size: {batch_size}):",
+                      lambda batch: clip_utils.tokenize_batch(batch, args.context_length), batches)
+
+    # unseen texts, tokenized in parallel chunks
+    huge_batches = [[f"{random.choice(queries)} {i}-{j}" for j in range(args.huge_batch_size)] for i in range(3)]
+    clip_utils._tokenizer = FastTokenizer(cache_size=0)
+    time_tokenize(f"tokenize_batch serial (batch-size: {args.huge_batch_size}):",
+                  lambda batch: clip_utils.tokenize_batch(batch, args.context_length), huge_batches)
+    for name, executor_class in (("threads", ThreadPoolExecutor), ("processes", ProcessPoolExecutor)):
+        with executor_class(max_workers=args.workers) as executor:
+            time_tokenize(f"tokenize_batch with {args.workers} {name} (batch-size: {args.huge_batch_size}):",
+                          lambda batch: clip_utils.tokenize_batch(batch, args.context_length, executor=executor),
+                          huge_batches)
+
+    print("Done!")
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+'''
+This script benchmarks approximate nearest-neighbor text-to-image search on the features written by
+extract_features.py. The exact top-k search is the baseline: its top-1 image for every text serves as the
+reference annotation, so the recall@1/5/10 computed by evaluation.py measures how often the approximate search
+finds the true nearest neighbor. With --golden, the recall against the ground-truth annotations is reported too.
+For the IVF index, the recall and the per-query latency are reported for every nprobe in --nprobes.
+For product quantization, the compression ratio, the recall of the exhaustive asymmetric-distance search and its
+per-query latency are reported for every number of code bytes in --pq-m.
+For the HNSW graph index, the index is built incrementally, saved and re-opened memory-mapped, and the recall and
+the single-query latency are reported for every ef in --ef-searches. With --query-type image, --text-feats holds
+image features (e.g. the frames to look up near-duplicates for) and the search is image-to-image.
+'''
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from cn_clip.eval.evaluation import compute_score
+from cn_clip.index import HNSWIndex, IVFIndex, ProductQuantizer, blocked_topk, train_kmeans
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--image-feats',
+        type=str,
+        required=True,
+        help="Specify the path of image features."
+    )
+    parser.add_argument(
+        '--text-feats',
+        type=str,
+        required=True,
+        help="Specify the path of text features, or of image features with --query-type image."
+    )
+    parser.add_argument(
+        '--query-type',
+        choices=["text", "image"],
+        default="text",
+        help="Whether the queries in --text-feats are text or image features."
+    )
+    parser.add_argument(
+        '--golden',
+        type=str,
+        default=None,
+        help="Optional ground-truth text-to-image annotations (e.g. test_queries_answers.jsonl)."
+    )
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        required=True,
+        help="Directory of the prediction files, reference annotations and the index."
+    )
+    parser.add_argument(
+        '--n-lists',
+        type=int,
+        default=None,
+        help="Number of IVF posting lists, default to 4 * sqrt(number of images)."
+    )
+    parser.add_argument(
+        '--nprobes',
+        type=str,
+        default="1,2,4,8,16,32,64",
+        help="Comma separated numbers of probed posting lists."
+    )
+    parser.add_argument(
+        '--pq-m',
+        type=str,
+        default="32,64",
+        help="Comma separated PQ code sizes in bytes (empty to skip PQ), the feature dimension must be divisible by each."
+    )
+    parser.add_argument(
+        '--hnsw-m',
+        type=int,
+        default=16,
+        help="Maximum number of HNSW neighbors per node in the upper layers (2 * M in layer 0), 0 to skip HNSW."
+    )
+    parser.add_argument(
+        '--ef-construction',
+        type=int,
+        default=100,
+        help="Size of the HNSW candidate list when inserting."
+    )
+    parser.add_argument(
+        '--ef-searches',
+        type=str,
+        default="16,32,64,128",
+        help="Comma separated sizes of the HNSW candidate list when searching."
+    )
+    parser.add_argument(
+        '--kmeans-iters',
+        type=int,
+        default=20,
+        help="Number of k-means iterations."
+    )
+    parser.add_argument(
+        '--kmeans-sample-size',
+        type=int,
+        default=262144,
+        help="Number of image features sampled to train the coarse quantizer."
+    )
+    parser.add_argument(
+        '--dtype',
+        choices=["float32", "float16"],
+        default="float32",
+        help="Storage type of the indexed vectors."
+    )
+    parser.add_argument(
+        '--query-batch-size',
+        type=int,
+        default=1,
+        help="Number of texts searched together, 1 measures the single-query latency."
+    )
+    parser.add_argument(
+        '--eval-batch-size',
+        type=int,
+        default=32768,
+        help="Image-side batch size of the exact search."
+    )
+    parser.add_argument(
+        '--device',
+        choices=["cuda", "cpu"],
+        default="cpu",
+        help="Device of the exact search and the k-means training."
+    )
+    return parser.parse_args()
+
+
+def load_features(path, id_key):
+    ids, feats = [], []
+    with open(path, "r") as fin:
+        for line in tqdm(fin):
+            obj = json.loads(line.strip())
+            ids.append(obj[id_key])
+            feats.append(obj['feature'])
+    return np.array(ids, dtype=np.int64), np.array(feats, dtype=np.float32)
+
+
+def exact_search(image_feats, text_feats, top_k, eval_batch_size, device):
+    """Exact top-k image indices for every text: image blocks are scored against all texts at once."""
+    texts = torch.from_numpy(text_feats).to(device)
+    return blocked_topk(texts, torch.from_numpy(image_feats).to(device), top_k, eval_batch_size)[1].cpu().numpy()
+
+
+def write_predictions(path, text_ids, predictions):
+    with open(path, "w") as fout:
+        for text_id, image_ids in zip(text_ids.tolist(), predictions.tolist()):
+            # evaluation.py requires k distinct integer ids, pad missing results with distinct negative ids
+            image_ids = [image_id if image_id >= 0 else -rank - 1 for rank, image_id in enumerate(image_ids)]
+            fout.write("{}\n".format(json.dumps({"text_id": text_id, "image_ids": image_ids})))
+
+
+def print_scores(name, scores, golden_scores, latency=None):
+    row = "{:<24}{:>8.2f}{:>8.2f}{:>8.2f}".format(name, *scores[1:])
+    row += "{:>12.2f}".format(golden_scores[0]) if golden_scores else "{:>12}".format("-")
+    if latency is not None:
+        row += "{:>14.3f}{:>10.0f}".format(latency * 1e3, 1 / latency)
+    print(row)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    top_k = 10
+
+    print("Begin to load image and text features...")
+    image_ids, image_feats = load_features(args.image_feats, 'image_id')
+    text_ids, text_feats = load_features(args.text_feats, 'text_id' if args.query_type == "text" else 'image_id')
+    print(f"Loaded {len(image_ids)} image features and {len(text_ids)} text features.")
+
+    # exact baseline, its top-1 image is the reference annotation of every text
+    start = time.time()
+    exact = image_ids[exact_search(image_feats, text_feats, top_k, args.eval_batch_size, args.device)]
+    exact_time = time.time() - start
+    reference_file = os.path.join(args.output_dir, "exact_top1.jsonl")
+    with open(reference_file, "w") as fout:
+        for text_id, image_id in zip(text_ids.tolist(), exact[:, 0].tolist()):
+            fout.write("{}\n".format(json.dumps({"text_id": text_id, "image_ids": [image_id]})))
+    exact_file = os.path.join(args.output_dir, "predictions.exact.jsonl")
+    write_predictions(exact_file, text_ids, exact)
+
+    # IVF index
+    n_lists = args.n_lists or min(int(4 * np.sqrt(len(image_ids))), len(image_ids))
+    print(f"Train the coarse quantizer with {n_lists} lists...")
+    start = time.time()
+    centroids = train_kmeans(image_feats, n_lists, n_iter=args.kmeans_iters, sample_size=args.kmeans_sample_size,
+                             device=args.device)
+    train_time = time.time() - start
+    start = time.time()
+    index = IVFIndex.build(os.path.join(args.output_dir, "ivf_index"), image_feats, image_ids, centroids,
+                           dtype=args.dtype, device=args.device)
+    build_time = time.time() - start
+    sizes = index.list_sizes()
+    print(f"Trained in {train_time:.1f}s, built in {build_time:.1f}s; posting list sizes: "
+          f"min {sizes.min()}, median {int(np.median(sizes))}, max {sizes.max()}")
+
+    print("{:<24}{:>8}{:>8}{:>8}{:>12}{:>14}{:>10}".format(
+        "search", "R@1", "R@5", "R@10", "golden MR", "ms / query", "QPS"))
+    golden_scores = compute_score(args.golden, exact_file) if args.golden else None
+    print_scores("exact (batched)", compute_score(reference_file, exact_file), golden_scores,
+                 exact_time / len(text_ids))
+    for nprobe in [int(x) for x in args.nprobes.split(",")]:
+        predictions = []
+        start = time.perf_counter()
+        for begin in range(0, len(text_feats), args.query_batch_size):
+            predictions.append(index.search(text_feats[begin:begin + args.query_batch_size], top_k, nprobe)[0])
+        latency = (time.perf_counter() - start) / len(text_feats)
+        predict_file = os.path.join(args.output_dir, f"predictions.ivf.nprobe{nprobe}.jsonl")
+        write_predictions(predict_file, text_ids, np.concatenate(predictions))
+        golden_scores = compute_score(args.golden, predict_file) if args.golden else None
+        print_scores(f"ivf nprobe={nprobe}", compute_score(reference_file, predict_file), golden_scores, latency)
+
+    # product quantization, exhaustive ADC search over the codes
+    for m in [int(x) for x in args.pq_m.split(",") if x]:
+        quantizer = ProductQuantizer.train(image_feats, m, n_iter=args.kmeans_iters,
+                                           sample_size=args.kmeans_sample_size, device=args.device)
+        codes = quantizer.encode(image_feats)
+        predictions = []
+        start = time.perf_counter()
+        for begin in range(0, len(text_feats), args.query_batch_size):
+            predictions.append(quantizer.search(codes, text_feats[begin:begin + args.query_batch_size], top_k)[0])
+        latency = (time.perf_counter() - start) / len(text_feats)
+        predict_file = os.path.join(args.output_dir, f"predictions.pq.m{m}.jsonl")
+        write_predictions(predict_file, text_ids, image_ids[np.concatenate(predictions)])
+        golden_scores = compute_score(args.golden, predict_file) if args.golden else None
+        print_scores(f"pq M={m} ({quantizer.compression_ratio():.0f}x)", compute_score(reference_file, predict_file),
+                     golden_scores, latency)
+
+    # HNSW graph index, inserted incrementally and searched one query at a time
+    if args.hnsw_m > 0:
+        index = HNSWIndex(image_feats.shape[1], m=args.hnsw_m, ef_construction=args.ef_construction)
+        start = time.time()
+        for begin in tqdm(range(0, len(image_feats), 10000)):
+            index.add(image_feats[begin:begin + 10000], image_ids[begin:begin + 10000])
+        build_time = time.time() - start
+        index.save(os.path.join(args.output_dir, "hnsw_index"))
+        start = time.time()
+        index = HNSWIndex.load(os.path.join(args.output_dir, "hnsw_index"))
+        print(f"Built the HNSW index in {build_time:.1f}s ({len(index) / build_time:.0f} vectors/s), "
+              f"re-opened in {(time.time() - start) * 1e3:.1f}ms")
+        for ef in [int(x) for x in args.ef_searches.split(",")]:
+            predictions = []
+            start = time.perf_counter()
+            for query in text_feats:
+                predictions.append(index.search(query, top_k, ef)[0])
+            latency = (time.perf_counter() - start) / len(text_feats)
+            predict_file = os.path.join(args.output_dir, f"predictions.hnsw.ef{ef}.jsonl")
+            write_predictions(predict_file, text_ids, np.concatenate(predictions))
+            golden_scores = compute_score(args.golden, predict_file) if args.golden else None
+            print_scores(f"hnsw ef={ef}", compute_score(reference_file, predict_file), golden_scores, latency)
+
+    print("Done!")
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+This script compresses the image features written by extract_features.py with product quantization (PQ).
+It trains the PQ codebooks on the features (or reuses the codebooks given by --codebooks), encodes every feature
+to --m bytes and writes the PQ feature directory (codebooks.npy, codes.npy, ids.npy) read by
+make_topk_predictions.py --image-pq. The codebooks.npy of the output can be passed to extract_features.py
+--pq-codebooks to encode the features of new images while they are extracted.
+'''
+
+import argparse
+import json
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from cn_clip.index import ProductQuantizer, write_pq_features
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--image-feats',
+        type=str,
+        required=True,
+        help="Specify the path of image features."
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        required=True,
+        help="Specify the output PQ feature directory."
+    )
+    parser.add_argument(
+        '--codebooks',
+        type=str,
+        default=None,
+        help="Path of trained codebooks (codebooks.npy), if not specified the codebooks are trained on the features."
+    )
+    parser.add_argument(
+        '--m',
+        type=int,
+        default=64,
+        help="Number of subspaces, i.e. bytes per code. The feature dimension must be divisible by it."
+    )
+    parser.add_argument(
+        '--kmeans-iters',
+        type=int,
+        default=25,
+        help="Number of k-means iterations per subspace."
+    )
+    parser.add_argument(
+        '--kmeans-sample-size',
+        type=int,
+        default=65536,
+        help="Number of image features sampled to train the codebooks."
+    )
+    parser.add_argument(
+        '--device',
+        choices=["cuda", "cpu"],
+        default="cpu",
+        help="Device of the codebook training."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    print("Begin to load image features...")
+    image_ids, image_feats = [], []
+    with open(args.image_feats, "r") as fin:
+        for line in tqdm(fin):
+            obj = json.loads(line.strip())
+            image_ids.append(obj['image_id'])
+            image_feats.append(obj['feature'])
+    image_feats = np.array(image_feats, dtype=np.float32)
+    print(f"Loaded {len(image_ids)} image features of dimension {image_feats.shape[1]}.")
+
+    if args.codebooks:
+        quantizer = ProductQuantizer(np.load(args.codebooks))
+        print(f"Loaded {quantizer.m} codebooks from {args.codebooks}.")
+    else:
+        start = time.time()
+        quantizer = ProductQuantizer.train(image_feats, args.m, n_iter=args.kmeans_iters,
+                                           sample_size=args.kmeans_sample_size, device=args.device)
+        print(f"Trained {quantizer.m} codebooks in {time.time() - start:.1f}s.")
+
+    start = time.time()
+    codes = quantizer.encode(image_feats)
+    print(f"Encoded {len(codes)} features in {time.time() - start:.1f}s.")
+    error = np.linalg.norm(quantizer.decode(codes) - image_feats, axis=1)
+    print(f"{quantizer.code_size} bytes per image, compression ratio {quantizer.compression_ratio():.1f}x "
+          f"against float32, mean reconstruction error {error.mean():.4f}")
+
+    write_pq_features(args.output, quantizer, np.array(image_ids, dtype=np.int64), codes)
+    print(f"PQ features are stored in {args.output}")
+    print("Done!")
@@ -8,16 +8,11 @@ import base64
 from io import BytesIO
 import torch
 import lmdb
-from torchvision.transforms import Compose, Resize, ToTensor, Normalize, InterpolationMode
 from torch.utils.data import Dataset, DataLoader, SubsetRandomSampler
 from torch.utils.data.distributed import DistributedSampler
 from torch.utils.data.sampler import SequentialSampler
 import torchvision.datasets as datasets
-from cn_clip.clip import tokenize
-
-
-def _convert_to_rgb(image):
-    return image.convert('RGB')
+from cn_clip.clip import tokenize, BatchImageTransform
 
 
 def _preprocess_text(text):
@@ -64,16 +59,8 @@ class EvalImgDataset(Dataset):
         self.number_images = int(self.txn_imgs.get(key=b'num_images').tobytes().decode('utf-8'))
         logging.info("The specified LMDB directory contains {} images.".format(self.number_images))
 
-        self.transform = self._build_transform(resolution)
-
-    def _build_transform(self, resolution):
-        normalize = Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
-        return Compose([
-                Resize((resolution, resolution), interpolation=InterpolationMode.BICUBIC),
-                _convert_to_rgb,
-                ToTensor(),
-                normalize,
-            ])
+        # images are resized per sample into uint8 arrays and normalized once per batch in collate()
+        self.transform = BatchImageTransform(resolution)
 
     def __len__(self):
         return self.number_images
@@ -89,10 +76,14 @@ class EvalImgDataset(Dataset):
         img_id = int(img_id.decode(encoding="utf8", errors="ignore"))
         image_b64 = image_b64.decode(encoding="utf8", errors="ignore")
         image = Image.open(BytesIO(base64.urlsafe_b64decode(image_b64))) # already resized
-        image = self.transform(image)
+        image = self.transform.resize(image)
 
         return img_id, image
 
+    def collate(self, batch):
+        img_ids, images = zip(*batch)
+        return torch.tensor(img_ids), self.transform.normalize(self.transform.stack(images))
+
 
 @dataclass
 class DataInfo:
@@ -144,6 +135,7 @@ def get_eval_img_dataset(args):
         pin_memory=True,
         sampler=sampler,
         drop_last=False,
+        collate_fn=dataset.collate,
     )
     dataloader.num_samples = num_samples
     dataloader.num_batches = len(dataloader)
@@ -9,12 +9,14 @@ import logging
 from pathlib import Path
 import json
 
+import numpy as np
 import torch
 from tqdm import tqdm
 
 from cn_clip.clip.model import convert_weights, CLIP
 from cn_clip.training.main import convert_models_to_fp32
 from cn_clip.eval.data import get_eval_img_dataset, get_eval_txt_dataset
+from cn_clip.index import ProductQuantizer, write_pq_features
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -54,6 +56,18 @@ def parse_args():
         default=None, 
         help="If --extract-image-feats is True, specify the path of output text features."
     )
+    parser.add_argument(
+        '--pq-codebooks',
+        type=str,
+        default=None,
+        help="If specified, the image features are also encoded with these PQ codebooks (codebooks.npy written by build_pq_features.py)."
+    )
+    parser.add_argument(
+        '--image-pq-output-path',
+        type=str,
+        default=None,
+        help="If --pq-codebooks is specified, the output directory of the PQ image features, default to the image feature path with the .pq suffix."
+    )
     parser.add_argument(
         "--img-batch-size", type=int, default=64, help="Image batch size."
     )
@@ -187,6 +201,8 @@ if __name__ == "__main__":
         if args.image_feat_output_path is None:
             # by default, we store the image features under the same directory with the text features
             args.image_feat_output_path = "{}.img_feat.jsonl".format(args.text_data.replace("_texts.jsonl", "_imgs"))
+        quantizer = ProductQuantizer(np.load(args.pq_codebooks)) if args.pq_codebooks else None
+        pq_ids, pq_codes = [], []
         write_cnt = 0
         with open(args.image_feat_output_path, "w") as fout:
             model.eval()
@@ -197,9 +213,18 @@ if __name__ == "__main__":
                     images = images.cuda(args.gpu, non_blocking=True)
                     image_features = model(images, None)
                     image_features /= image_features.norm(dim=-1, keepdim=True)
+                    if quantizer is not None:
+                        pq_ids.append(image_ids.numpy())
+                        pq_codes.append(quantizer.encode(image_features))
                     for image_id, image_feature in zip(image_ids.tolist(), image_features.tolist()):
                         fout.write("{}\n".format(json.dumps({"image_id": image_id, "feature": image_feature})))
                         write_cnt += 1
         print('{} image features are stored in {}'.format(write_cnt, args.image_feat_output_path))
+        if quantizer is not None:
+            if args.image_pq_output_path is None:
+                args.image_pq_output_path = "{}.pq".format(os.path.splitext(args.image_feat_output_path)[0])
+            write_pq_features(args.image_pq_output_path, quantizer, np.concatenate(pq_ids), np.concatenate(pq_codes))
+            print('{} PQ image features ({} bytes each) are stored in {}'.format(
+                write_cnt, quantizer.code_size, args.image_pq_output_path))
 
     print("Done!")
\ No newline at end of file
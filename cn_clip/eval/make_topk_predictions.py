@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 '''
-This scripts performs kNN search on inferenced image and text features (on single-GPU) and outputs text-to-image prediction file for evaluation.
+This scripts performs kNN search on inferenced image and text features (on single-GPU or CPU) and outputs text-to-image prediction file for evaluation.
+Texts are searched in batches: every batch is scored against blocks of images with one matrix product per block,
+keeping a running top-k (see cn_clip/index/topk.py).
+With --image-pq instead of --image-feats, the search runs on the CPU over the product-quantized image features
+written by build_pq_features.py or extract_features.py --pq-codebooks, with asymmetric distance computation.
 '''
 
 import argparse
@@ -11,14 +15,22 @@ import json
 import numpy as np
 import torch
 
+from cn_clip.index import blocked_topk, read_pq_features
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '--image-feats', 
         type=str, 
-        required=True,
+        default=None,
         help="Specify the path of image features."
     )  
+    parser.add_argument(
+        '--image-pq',
+        type=str,
+        default=None,
+        help="Specify the directory of PQ image features, used instead of --image-feats."
+    )
     parser.add_argument(
         '--text-feats', 
         type=str, 
@@ -37,6 +49,24 @@ def parse_args():
         default=32768,
         help="Specify the image-side batch size when computing the inner products, default to 8192"
     )    
+    parser.add_argument(
+        '--text-batch-size',
+        type=int,
+        default=1024,
+        help="Specify the number of texts searched together, default to 1024"
+    )
+    parser.add_argument(
+        '--device',
+        choices=["cuda", "cpu"],
+        default="cuda",
+        help="Specify the device of the exact search, default to cuda"
+    )
+    parser.add_argument(
+        '--gallery-on-device',
+        action="store_true",
+        default=False,
+        help="Whether to copy all the image features to the device once, by default they stay on the CPU and are copied block by block."
+    )
     parser.add_argument(
         '--output', 
         type=str, 
@@ -45,8 +75,42 @@ def parse_args():
     )         
     return parser.parse_args()
 
+def make_pq_predictions(args):
+    quantizer, image_ids, codes = read_pq_features(args.image_pq)
+    print("Loaded {} PQ image features ({} bytes each).".format(len(image_ids), quantizer.code_size))
+
+    print("Begin to compute top-{} predictions for texts...".format(args.top_k))
+    text_ids = []
+    text_feats = []
+    with open(args.output, "w") as fout:
+        with open(args.text_feats, "r") as fin:
+            for line in tqdm(fin):
+                obj = json.loads(line.strip())
+                text_ids.append(obj['text_id'])
+                text_feats.append(obj['feature'])
+                if len(text_ids) == args.text_batch_size:
+                    write_pq_predictions(fout, quantizer, image_ids, codes, text_ids, text_feats, args.top_k)
+                    text_ids, text_feats = [], []
+        if text_ids:
+            write_pq_predictions(fout, quantizer, image_ids, codes, text_ids, text_feats, args.top_k)
+
+
+def write_predictions(fout, image_ids, image_feats_tensor, text_ids, text_feats, args):
+    text_feats_tensor = torch.tensor(text_feats, dtype=torch.float, device=args.device) # [batch_size, feature_dim]
+    _, indices = blocked_topk(text_feats_tensor, image_feats_tensor, args.top_k, args.eval_batch_size)
+    for text_id, image_indices in zip(text_ids, indices.tolist()):
+        fout.write("{}\n".format(json.dumps({"text_id": text_id, "image_ids": [image_ids[idx] for idx in image_indices]})))
+
+
+def write_pq_predictions(fout, quantizer, image_ids, codes, text_ids, text_feats, top_k):
+    rows, _ = quantizer.search(codes, np.array(text_feats, dtype=np.float32), top_k)
+    for text_id, image_rows in zip(text_ids, rows):
+        fout.write("{}\n".format(json.dumps({"text_id": text_id, "image_ids": image_ids[image_rows].tolist()})))
+
+
 if __name__ == "__main__":
     args = parse_args()
+    assert (args.image_feats is None) != (args.image_pq is None), "Specify exactly one of --image-feats and --image-pq!"
 
     # Log params.
     print("Params:")
@@ -54,35 +118,38 @@ if __name__ == "__main__":
         val = getattr(args, name)
         print(f"  {name}: {val}")
 
-    print("Begin to load image features...")
-    image_ids = []
-    image_feats = []
-    with open(args.image_feats, "r") as fin:
-        for line in tqdm(fin):
-            obj = json.loads(line.strip())
-            image_ids.append(obj['image_id'])
-            image_feats.append(obj['feature'])
-    image_feats_array = np.array(image_feats, dtype=np.float32)
-    print("Finished loading image features.")
-
-    print("Begin to compute top-{} predictions for texts...".format(args.top_k))
-    with open(args.output, "w") as fout:
-        with open(args.text_feats, "r") as fin:
+    if args.image_pq:
+        make_pq_predictions(args)
+    else:
+        print("Begin to load image features...")
+        image_ids = []
+        image_feats = []
+        with open(args.image_feats, "r") as fin:
             for line in tqdm(fin):
                 obj = json.loads(line.strip())
-                text_id = obj['text_id']
-                text_feat = obj['feature']
-                score_tuples = []
-                text_feat_tensor = torch.tensor([text_feat], dtype=torch.float).cuda() # [1, feature_dim]
-                idx = 0
-                while idx < len(image_ids):
-                    img_feats_tensor = torch.from_numpy(image_feats_array[idx : min(idx + args.eval_batch_size, len(image_ids))]).cuda() # [batch_size, feature_dim]
-                    batch_scores = text_feat_tensor @ img_feats_tensor.t() # [1, batch_size]
-                    for image_id, score in zip(image_ids[idx : min(idx + args.eval_batch_size, len(image_ids))], batch_scores.squeeze(0).tolist()):
-                        score_tuples.append((image_id, score))
-                    idx += args.eval_batch_size
-                top_k_predictions = sorted(score_tuples, key=lambda x:x[1], reverse=True)[:args.top_k]
-                fout.write("{}\n".format(json.dumps({"text_id": text_id, "image_ids": [entry[0] for entry in top_k_predictions]})))
-    
+                image_ids.append(obj['image_id'])
+                image_feats.append(obj['feature'])
+        image_feats_array = np.array(image_feats, dtype=np.float32)
+        print("Finished loading image features.")
+
+        print("Begin to compute top-{} predictions for texts...".format(args.top_k))
+        # image blocks are copied to the device when scored, unless --gallery-on-device
+        image_feats_tensor = torch.from_numpy(image_feats_array) # [num_images, feature_dim]
+        if args.gallery_on_device:
+            image_feats_tensor = image_feats_tensor.to(args.device)
+        text_ids = []
+        text_feats = []
+        with open(args.output, "w") as fout:
+            with open(args.text_feats, "r") as fin:
+                for line in tqdm(fin):
+                    obj = json.loads(line.strip())
+                    text_ids.append(obj['text_id'])
+                    text_feats.append(obj['feature'])
+                    if len(text_ids) == args.text_batch_size:
+                        write_predictions(fout, image_ids, image_feats_tensor, text_ids, text_feats, args)
+                        text_ids, text_feats = [], []
+            if text_ids:
+                write_predictions(fout, image_ids, image_feats_tensor, text_ids, text_feats, args)
+
     print("Top-{} predictions are saved in {}".format(args.top_k, args.output))
     print("Done!")
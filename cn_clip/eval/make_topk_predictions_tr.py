@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 '''
-This scripts performs kNN search on inferenced image and text features (on single-GPU) and outputs image-to-text retrieval prediction file for evaluation.
+This scripts performs kNN search on inferenced image and text features (on single-GPU or CPU) and outputs image-to-text retrieval prediction file for evaluation.
+Images are searched in batches: every batch is scored against blocks of texts with one matrix product per block,
+keeping a running top-k (see cn_clip/index/topk.py).
 '''
 
 import argparse
@@ -11,6 +13,8 @@ import json
 import numpy as np
 import torch
 
+from cn_clip.index import blocked_topk
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -35,8 +39,26 @@ def parse_args():
         '--eval-batch-size', 
         type=int, 
         default=32768,
-        help="Specify the image-side batch size when computing the inner products, default to 8192"
+        help="Specify the text-side batch size when computing the inner products, default to 32768"
     )    
+    parser.add_argument(
+        '--image-batch-size',
+        type=int,
+        default=1024,
+        help="Specify the number of images searched together, default to 1024"
+    )
+    parser.add_argument(
+        '--device',
+        choices=["cuda", "cpu"],
+        default="cuda",
+        help="Specify the device of the search, default to cuda"
+    )
+    parser.add_argument(
+        '--gallery-on-device',
+        action="store_true",
+        default=False,
+        help="Whether to copy all the text features to the device once, by default they stay on the CPU and are copied block by block."
+    )
     parser.add_argument(
         '--output', 
         type=str, 
@@ -45,6 +67,12 @@ def parse_args():
     )         
     return parser.parse_args()
 
+def write_predictions(fout, text_ids, text_feats_tensor, image_ids, image_feats, args):
+    image_feats_tensor = torch.tensor(image_feats, dtype=torch.float, device=args.device) # [batch_size, feature_dim]
+    _, indices = blocked_topk(image_feats_tensor, text_feats_tensor, args.top_k, args.eval_batch_size)
+    for image_id, text_indices in zip(image_ids, indices.tolist()):
+        fout.write("{}\n".format(json.dumps({"image_id": image_id, "text_ids": [text_ids[idx] for idx in text_indices]})))
+
 if __name__ == "__main__":
     args = parse_args()
 
@@ -66,23 +94,23 @@ if __name__ == "__main__":
     print("Finished loading text features.")
 
     print("Begin to compute top-{} predictions for images...".format(args.top_k))
+    # text blocks are copied to the device when scored, unless --gallery-on-device
+    text_feats_tensor = torch.from_numpy(text_feats_array) # [num_texts, feature_dim]
+    if args.gallery_on_device:
+        text_feats_tensor = text_feats_tensor.to(args.device)
+    image_ids = []
+    image_feats = []
     with open(args.output, "w") as fout:
         with open(args.image_feats, "r") as fin:
             for line in tqdm(fin):
                 obj = json.loads(line.strip())
-                image_id = obj['image_id']
-                image_feat = obj['feature']
-                score_tuples = []
-                image_feat_tensor = torch.tensor([image_feat], dtype=torch.float).cuda() # [1, feature_dim]
-                idx = 0
-                while idx < len(text_ids):
-                    text_feats_tensor = torch.from_numpy(text_feats_array[idx : min(idx + args.eval_batch_size, len(text_ids))]).cuda() # [batch_size, feature_dim]
-                    batch_scores = image_feat_tensor @ text_feats_tensor.t() # [1, batch_size]
-                    for text_id, score in zip(text_ids[idx : min(idx + args.eval_batch_size, len(text_ids))], batch_scores.squeeze(0).tolist()):
-                        score_tuples.append((text_id, score))
-                    idx += args.eval_batch_size
-                top_k_predictions = sorted(score_tuples, key=lambda x:x[1], reverse=True)[:args.top_k]
-                fout.write("{}\n".format(json.dumps({"image_id": image_id, "text_ids": [entry[0] for entry in top_k_predictions]})))
+                image_ids.append(obj['image_id'])
+                image_feats.append(obj['feature'])
+                if len(image_ids) == args.image_batch_size:
+                    write_predictions(fout, text_ids, text_feats_tensor, image_ids, image_feats, args)
+                    image_ids, image_feats = [], []
+        if image_ids:
+            write_predictions(fout, text_ids, text_feats_tensor, image_ids, image_feats, args)
     
     print("Top-{} predictions are saved in {}".format(args.top_k, args.output))
     print("Done!")
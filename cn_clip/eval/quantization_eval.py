@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''
+This script is the accuracy regression check of the dynamic int8 quantized CPU inference mode.
+It extracts image and text features of a retrieval test set with the fp32 model and with the int8 model
+(cn_clip.clip.quantize_dynamic_int8), makes the top-10 text-to-image predictions for both and reports the
+recall scores computed by evaluation.py, together with the feature extraction time.
+'''
+
+import argparse
+import copy
+import json
+import os
+import time
+
+import torch
+from tqdm import tqdm
+
+from cn_clip.clip.utils import create_model, quantize_dynamic_int8
+from cn_clip.eval.data import get_eval_img_dataset, get_eval_txt_dataset
+from cn_clip.eval.evaluation import compute_score
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--image-data',
+        type=str,
+        default="../Multimodal_Retrieval/lmdb/test/imgs",
+        help="Specify the path of the LMDB directory storing input image base64 strings."
+    )
+    parser.add_argument(
+        '--text-data',
+        type=str,
+        default="../Multimodal_Retrieval/test_texts.jsonl",
+        help="Specify the path of input text Jsonl file."
+    )
+    parser.add_argument(
+        '--golden',
+        type=str,
+        default="../Multimodal_Retrieval/test_queries_answers.jsonl",
+        help="Specify the path of the ground-truth text-to-image annotations."
+    )
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        default=None,
+        help="Directory of the prediction files of both models, default to the directory of --text-data."
+    )
+    parser.add_argument(
+        "--img-batch-size", type=int, default=64, help="Image batch size."
+    )
+    parser.add_argument(
+        "--text-batch-size", type=int, default=64, help="Text batch size."
+    )
+    parser.add_argument(
+        "--context-length", type=int, default=52, help="The maximum length of input text (include [CLS] & [SEP] tokens)."
+    )
+    parser.add_argument(
+        "--resume",
+        default=None,
+        type=str,
+        help="path to the checkpoint to evaluate",
+    )
+    parser.add_argument(
+        "--vision-model",
+        choices=["ViT-B-32", "ViT-B-16", "ViT-L-14", "ViT-L-14-336", "ViT-H-14", "RN50"],
+        default="ViT-B-16",
+        help="Name of the vision backbone to use.",
+    )
+    parser.add_argument(
+        "--text-model",
+        choices=["RoBERTa-wwm-ext-base-chinese", "RoBERTa-wwm-ext-large-chinese", "RBT3-chinese"],
+        default="RoBERTa-wwm-ext-base-chinese",
+        help="Name of the text backbone to use.",
+    )
+    parser.add_argument(
+        "--num-threads", type=int, default=0, help="Number of CPU threads used by torch, 0 to keep the default."
+    )
+    parser.add_argument(
+        "--max-recall-drop",
+        type=float,
+        default=None,
+        help="If set, fail when the mean recall of the int8 model is lower than fp32 by more than this many points."
+    )
+    args = parser.parse_args()
+
+    return args
+
+
+def extract_features(model, args):
+    # the image dataset iterates an LMDB cursor, so a fresh one is needed for every pass
+    img_data = get_eval_img_dataset(args)
+    text_data = get_eval_txt_dataset(args, max_txt_length=args.context_length)
+
+    image_ids, image_feats = [], []
+    text_ids, text_feats = [], []
+    start = time.time()
+    with torch.no_grad():
+        for ids, images in tqdm(img_data.dataloader):
+            features = model(images, None)
+            image_feats.append(features / features.norm(dim=-1, keepdim=True))
+            image_ids.extend(ids.tolist())
+        for ids, texts in tqdm(text_data.dataloader):
+            features = model(None, texts)
+            text_feats.append(features / features.norm(dim=-1, keepdim=True))
+            text_ids.extend(ids.tolist())
+    elapsed = time.time() - start
+    return image_ids, torch.cat(image_feats), text_ids, torch.cat(text_feats), elapsed
+
+
+def write_predictions(path, image_ids, image_feats, text_ids, text_feats, top_k=10):
+    image_ids = torch.tensor(image_ids)
+    with open(path, "w") as fout:
+        for text_id, text_feat in zip(text_ids, text_feats):
+            indices = (image_feats @ text_feat).topk(top_k).indices
+            fout.write("{}\n".format(json.dumps({"text_id": text_id, "image_ids": image_ids[indices].tolist()})))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Log params.
+    print("Params:")
+    for name in sorted(vars(args)):
+        val = getattr(args, name)
+        print(f"  {name}: {val}")
+
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.text_data))
+    os.makedirs(output_dir, exist_ok=True)
+
+    checkpoint = None
+    if args.resume:
+        assert os.path.exists(args.resume), "The checkpoint file {} not exists!".format(args.resume)
+        checkpoint = torch.load(args.resume, map_location='cpu')
+    else:
+        print("No checkpoint is given, the randomly initialized model is evaluated.")
+    fp32_model = create_model(f"{args.vision_model}@{args.text_model}", checkpoint)
+    fp32_model.float().eval()
+    int8_model = quantize_dynamic_int8(copy.deepcopy(fp32_model))
+
+    results = {}
+    for name, model in (("fp32", fp32_model), ("int8", int8_model)):
+        print(f"Make inference with the {name} model...")
+        image_ids, image_feats, text_ids, text_feats, elapsed = extract_features(model, args)
+        predict_file = os.path.join(output_dir, f"test_predictions.{name}.jsonl")
+        write_predictions(predict_file, image_ids, image_feats, text_ids, text_feats)
+        results[name] = compute_score(args.golden, predict_file) + [elapsed]
+        if name == "fp32":
+            reference_feats = (image_feats, text_feats)
+        else:
+            print("Mean cosine similarity to fp32 features: image {:.4f}, text {:.4f}".format(
+                (image_feats * reference_feats[0]).sum(dim=-1).mean().item(),
+                (text_feats * reference_feats[1]).sum(dim=-1).mean().item()))
+
+    print("{:<8}{:>10}{:>10}{:>10}{:>10}{:>12}".format("model", "mean", "R@1", "R@5", "R@10", "time (s)"))
+    for name, scores in results.items():
+        print("{:<8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}".format(name, *scores))
+    deltas = [int8 - fp32 for fp32, int8 in zip(results["fp32"], results["int8"])]
+    print("{:<8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>12.1f}".format("delta", *deltas))
+
+    if args.max_recall_drop is not None:
+        assert -deltas[0] <= args.max_recall_drop, \
+            "Mean recall of the int8 model drops by {:.2f} points (> {})".format(-deltas[0], args.max_recall_drop)
+
+    print("Done!")
@@ -0,0 +1,4 @@
+from .hnsw import HNSWIndex
+from .ivf import IVFIndex, train_kmeans
+from .pq import ProductQuantizer, read_pq_features, write_pq_features
+from .topk import blocked_topk
@@ -0,0 +1,253 @@
+"""
+Hierarchical navigable small world (HNSW) graph index over normalized CN-CLIP embeddings.
+
+Every vector is a node of a layered proximity graph (Malkov & Yashunin, 2016): a node is inserted into layers
+0..level with an exponentially decaying random level, and is linked in every layer to at most M neighbors
+(2 * M in layer 0) picked by the neighbor-diversity heuristic among the ef_construction closest nodes found.
+A query descends greedily through the sparse upper layers and runs a best-first search with a dynamic list of
+ef_search candidates in layer 0, so it only scores a few hundred to a few thousand vectors. Scores are inner
+products, i.e. cosine similarities of the normalized vectors.
+
+Vectors can be inserted at any time. An index is saved as a directory of .npy arrays that are memory-mapped
+when loaded, so a saved index opens instantly; the arrays are copied to memory by the first insert that
+outgrows them.
+"""
+
+import heapq
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+_ARRAYS = ("vectors", "ids", "levels", "upper_offsets", "links", "upper_links")
+
+
+class HNSWIndex:
+    """
+    Arrays of the graph, the first `size` rows (`n_upper` rows for the upper layers) are valid:
+      vectors        [N, D] float32 normalized vectors
+      ids            [N] int64 ids, not required to be unique
+      levels         [N] int32 top layer of every node
+      upper_offsets  [N] int64, the layer-l links of a node with level >= l >= 1 are row upper_offsets + l - 1
+                     of upper_links
+      links          [N, 2 * M] int32 layer-0 neighbors, padded with -1
+      upper_links    [U, M] int32 neighbors in the upper layers, padded with -1
+    Inserts are not thread-safe, concurrent searches are.
+    """
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 200, ef_search: int = 64, seed: int = 0):
+        self.dim = dim
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_multiplier = 1 / np.log(m)
+        self.rng = np.random.RandomState(seed)
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.levels = np.empty(0, dtype=np.int32)
+        self.upper_offsets = np.empty(0, dtype=np.int64)
+        self.links = np.empty((0, 2 * m), dtype=np.int32)
+        self.upper_links = np.empty((0, m), dtype=np.int32)
+        self.size = 0
+        self.n_upper = 0
+        self.entry_point = -1
+        self.max_level = -1
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size: int, n_upper: int):
+        if size > len(self.vectors):
+            capacity = max(size, 2 * len(self.vectors), 1024)
+            for name in ("vectors", "ids", "levels", "upper_offsets", "links"):
+                array = getattr(self, name)
+                grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                setattr(self, name, grown)
+        if n_upper > len(self.upper_links):
+            grown = np.empty((max(n_upper, 2 * len(self.upper_links), 64), self.m), dtype=np.int32)
+            grown[:self.n_upper] = self.upper_links[:self.n_upper]
+            self.upper_links = grown
+
+    def _link_row(self, node: int, layer: int) -> np.ndarray:
+        """The (writable) padded neighbor row of a node in a layer."""
+        if layer == 0:
+            return self.links[node]
+        return self.upper_links[self.upper_offsets[node] + layer - 1]
+
+    def _neighbors(self, node: int, layer: int) -> np.ndarray:
+        row = self._link_row(node, layer)
+        return row[row >= 0]
+
+    def _set_neighbors(self, node: int, layer: int, neighbors: List[int]):
+        row = self._link_row(node, layer)
+        row[:len(neighbors)] = neighbors
+        row[len(neighbors):] = -1
+
+    def _greedy(self, query: np.ndarray, node: int, score: float, layer: int) -> Tuple[int, float]:
+        """Move to the best-scoring neighbor until no neighbor improves the score."""
+        while True:
+            neighbors = self._neighbors(node, layer)
+            if len(neighbors) == 0:
+                return node, score
+            scores = self.vectors[neighbors] @ query
+            best = int(scores.argmax())
+            if scores[best] <= score:
+                return node, score
+            node, score = int(neighbors[best]), float(scores[best])
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[int], ef: int, layer: int) -> List[Tuple[float, int]]:
+        """Best-first search of one layer, returns the ef best (score, node) pairs sorted by decreasing score."""
+        visited = set(entry_points)
+        scores = (self.vectors[entry_points] @ query).tolist()
+        candidates = [(-score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        results = heapq.nlargest(ef, zip(scores, entry_points))
+        heapq.heapify(results)
+        while candidates:
+            negative_score, node = heapq.heappop(candidates)
+            if -negative_score < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [neighbor for neighbor in self._link_row(node, layer).tolist()
+                         if neighbor >= 0 and neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            worst = results[0][0]
+            for score, neighbor in zip((self.vectors[neighbors] @ query).tolist(), neighbors):
+                if len(results) < ef:
+                    heapq.heappush(results, (score, neighbor))
+                elif score > worst:
+                    heapq.heapreplace(results, (score, neighbor))
+                else:
+                    continue
+                heapq.heappush(candidates, (-score, neighbor))
+                worst = results[0][0]
+        return sorted(results, reverse=True)
+
+    def _select(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """
+        Neighbor-diversity heuristic: walking the candidates by decreasing score, keep a candidate only if it is
+        closer to the base vector than to every candidate kept so far, up to m candidates.
+        """
+        selected = []
+        for score, node in candidates:
+            if len(selected) == m:
+                break
+            if not selected or (self.vectors[selected] @ self.vectors[node]).max() < score:
+                selected.append(node)
+        return selected
+
+    def _connect(self, node: int, neighbor: int, layer: int):
+        """Add a link from neighbor to node, pruning the links of neighbor with the heuristic when it is full."""
+        row = self._link_row(neighbor, layer)
+        free = np.flatnonzero(row < 0)
+        if len(free) > 0:
+            row[free[0]] = node
+            return
+        nodes = np.append(row, node)
+        scores = self.vectors[nodes] @ self.vectors[neighbor]
+        order = np.argsort(-scores)
+        self._set_neighbors(neighbor, layer, self._select(list(zip(scores[order].tolist(), nodes[order].tolist())),
+                                                          len(row)))
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray):
+        """Insert the vectors (normalized on insertion) with their int64 ids one by one."""
+        vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        assert vectors.shape == (len(ids), self.dim), f"Expected {len(ids)} vectors of dimension {self.dim}"
+        for vector, id_ in zip(vectors, ids):
+            self._insert(vector, id_)
+
+    def _insert(self, vector: np.ndarray, id_: int):
+        node = self.size
+        level = int(-np.log(1.0 - self.rng.random_sample()) * self.level_multiplier)
+        self._reserve(node + 1, self.n_upper + level)
+        self.vectors[node] = vector
+        self.ids[node] = id_
+        self.levels[node] = level
+        self.upper_offsets[node] = self.n_upper if level > 0 else -1
+        self.links[node] = -1
+        self.upper_links[self.n_upper:self.n_upper + level] = -1
+        self.n_upper += level
+        self.size += 1
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return
+
+        entry_point = self.entry_point
+        score = float(self.vectors[entry_point] @ vector)
+        for layer in range(self.max_level, level, -1):
+            entry_point, score = self._greedy(vector, entry_point, score, layer)
+        entry_points = [entry_point]
+        for layer in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(vector, entry_points, self.ef_construction, layer)
+            neighbors = self._select(candidates, self.m)
+            self._set_neighbors(node, layer, neighbors)
+            for neighbor in neighbors:
+                self._connect(node, neighbor, layer)
+            entry_points = [candidate for _, candidate in candidates]
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def search(self, queries: np.ndarray, k: int, ef: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k inner-product search. Returns ([Q, k] ids, [Q, k] scores) sorted by decreasing score,
+        padded with id -1 and score -inf when the index holds fewer than k vectors.
+        ef defaults to the ef_search attribute of the index and is raised to k if smaller.
+        """
+        ef = max(ef or self.ef_search, k)
+        queries = np.array(queries, dtype=np.float32, ndmin=2)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        result_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if self.size == 0:
+            return result_ids, result_scores
+        for i, query in enumerate(queries):
+            node = self.entry_point
+            score = float(self.vectors[node] @ query)
+            for layer in range(self.max_level, 0, -1):
+                node, score = self._greedy(query, node, score, layer)
+            results = self._search_layer(query, [node], ef, 0)[:k]
+            result_scores[i, :len(results)] = [score for score, _ in results]
+            result_ids[i, :len(results)] = self.ids[[node for _, node in results]]
+        return result_ids, result_scores
+
+    def save(self, path: str):
+        """
+        Write the valid part of every array and the parameters to path, meta.json last. Every file is written to a
+        temporary file and renamed into place, so path may be the directory this index was loaded from: the
+        memory-mapped files keep their content until they are unmapped.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            array = getattr(self, name)
+            filename = os.path.join(path, f"{name}.npy")
+            with open(f"{filename}.tmp", "wb") as f:
+                np.save(f, array[:self.n_upper if name == "upper_links" else self.size])
+            os.replace(f"{filename}.tmp", filename)
+        filename = os.path.join(path, "meta.json")
+        with open(f"{filename}.tmp", "w") as f:
+            json.dump({"dim": self.dim, "m": self.m, "ef_construction": self.ef_construction,
+                       "ef_search": self.ef_search, "size": self.size, "n_upper": self.n_upper,
+                       "entry_point": self.entry_point, "max_level": self.max_level}, f)
+        os.replace(f"{filename}.tmp", filename)
+
+    @staticmethod
+    def load(path: str, ef_search: Optional[int] = None) -> "HNSWIndex":
+        """
+        Open a saved index. The arrays are memory-mapped copy-on-write: inserts modify private copies of the
+        mapped pages, and the files only change when the index is saved again.
+        """
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        index = HNSWIndex(meta["dim"], m=meta["m"], ef_construction=meta["ef_construction"],
+                          ef_search=ef_search or meta["ef_search"], seed=meta["size"])
+        for name in _ARRAYS:
+            # a plain ndarray view of the memmap avoids the per-indexing overhead of the np.memmap subclass
+            setattr(index, name, np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")))
+        index.size, index.n_upper = meta["size"], meta["n_upper"]
+        index.entry_point, index.max_level = meta["entry_point"], meta["max_level"]
+        return index
@@ -0,0 +1,192 @@
+"""
+Inverted-file (IVF) approximate nearest-neighbor index over normalized CN-CLIP embeddings.
+
+A spherical k-means coarse quantizer splits the gallery into `n_lists` clusters. The vectors are stored on
+disk grouped by cluster, so every posting list is one contiguous slice of a memory-mapped array, and a query
+only scans the `nprobe` lists whose centroids are closest to it. Scores are inner products, i.e. cosine
+similarities for normalized features such as the ones written by extract_features.py.
+"""
+
+import json
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+_FILES = ("centroids.npy", "offsets.npy", "vectors.npy", "ids.npy")
+
+
+def _normalize(x: torch.Tensor) -> torch.Tensor:
+    return x / x.norm(dim=-1, keepdim=True).clamp_min(1e-12)
+
+
+def _assign(x, centroids: torch.Tensor, block_rows: int = 65536) -> torch.Tensor:
+    """
+    Index of the closest (largest inner product) centroid for every row of x (a tensor, or a possibly
+    memory-mapped numpy array), computed block by block on the device of the centroids.
+    """
+    assignments = []
+    for start in range(0, len(x), block_rows):
+        block = x[start:start + block_rows]
+        if isinstance(block, np.ndarray):
+            block = torch.from_numpy(np.ascontiguousarray(block, dtype=np.float32))
+        assignments.append((block.to(centroids.device) @ centroids.T).argmax(dim=1).cpu())
+    return torch.cat(assignments)
+
+
+def train_kmeans(x: np.ndarray, n_clusters: int, n_iter: int = 20, sample_size: Optional[int] = 262144,
+                 seed: int = 0, device: str = "cpu", verbose: bool = False) -> np.ndarray:
+    """
+    Spherical k-means on (a random sample of at most sample_size rows of) x.
+    Centroids are initialized from random samples, updated as the normalized mean of their members, and
+    empty clusters are re-seeded from random samples. Returns the [n_clusters, D] float32 centroids.
+    """
+    rng = np.random.RandomState(seed)
+    if sample_size is not None and len(x) > sample_size:
+        x = x[np.sort(rng.choice(len(x), sample_size, replace=False))]
+    assert len(x) >= n_clusters, f"Need at least {n_clusters} training vectors, got {len(x)}"
+    x = _normalize(torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)).to(device))
+    centroids = x[torch.from_numpy(rng.choice(len(x), n_clusters, replace=False)).to(device)].clone()
+
+    for i in range(n_iter):
+        assignments = _assign(x, centroids).to(device)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, x)
+        counts = torch.bincount(assignments, minlength=n_clusters)
+        empty = (counts == 0).nonzero().flatten()
+        if len(empty) > 0:
+            sums[empty] = x[torch.from_numpy(rng.choice(len(x), len(empty), replace=False)).to(device)]
+        centroids = _normalize(sums)
+        if verbose:
+            objective = (x * centroids[assignments]).sum(dim=1).mean().item()
+            print(f"k-means iteration {i + 1}/{n_iter}: mean similarity {objective:.4f}, {len(empty)} empty clusters")
+    return centroids.cpu().numpy()
+
+
+class IVFIndex:
+    """
+    Inverted-file index stored in a directory:
+      centroids.npy  [n_lists, D] float32 coarse centroids
+      offsets.npy    [n_lists + 1] int64, posting list l is rows offsets[l]:offsets[l + 1]
+      vectors.npy    [N, D] float32 or float16 vectors, grouped by posting list
+      ids.npy        [N] int64 ids, in the same order as vectors.npy
+      meta.json      dimension, dtype, sizes
+    vectors.npy and ids.npy are memory-mapped, so opening an index is instant and only the probed posting
+    lists are read from disk.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, vectors: np.ndarray, ids: np.ndarray,
+                 nprobe: int = 8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = offsets
+        self.vectors = vectors
+        self.ids = ids
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def build(path: str, vectors: np.ndarray, ids: np.ndarray, centroids: np.ndarray, dtype: str = "float32",
+              block_rows: int = 65536, device: str = "cpu") -> "IVFIndex":
+        """
+        Assign the vectors to the posting lists of the trained centroids and write the index to path.
+        vectors may itself be a memory-mapped array larger than RAM: it is read block by block.
+        """
+        assert dtype in ("float32", "float16"), f"Unsupported dtype {dtype}"
+        assert len(vectors) == len(ids)
+        os.makedirs(path, exist_ok=True)
+        centroid_tensor = torch.from_numpy(np.ascontiguousarray(centroids, dtype=np.float32)).to(device)
+        assignments = _assign(vectors, centroid_tensor, block_rows).numpy()
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=len(centroids)), out=offsets[1:])
+
+        out_vectors = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+", dtype=dtype,
+                                                shape=(len(vectors), vectors.shape[1]))
+        for start in range(0, len(order), block_rows):
+            rows = order[start:start + block_rows]
+            block = np.asarray(vectors[np.sort(rows)], dtype=np.float32)[np.argsort(np.argsort(rows))]
+            block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+            out_vectors[start:start + len(rows)] = block
+        out_vectors.flush()
+        del out_vectors
+        np.save(os.path.join(path, "ids.npy"), np.asarray(ids, dtype=np.int64)[order])
+        np.save(os.path.join(path, "centroids.npy"), np.asarray(centroids, dtype=np.float32))
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"dim": int(vectors.shape[1]), "dtype": dtype, "size": len(order),
+                       "n_lists": len(centroids)}, f)
+        return IVFIndex.load(path)
+
+    @staticmethod
+    def load(path: str, nprobe: int = 8) -> "IVFIndex":
+        centroids, offsets, vectors, ids = [
+            np.load(os.path.join(path, filename), mmap_mode="r" if filename in ("vectors.npy", "ids.npy") else None)
+            for filename in _FILES]
+        return IVFIndex(centroids, offsets, vectors, ids, nprobe=nprobe)
+
+    def list_sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k inner-product search. Returns ([Q, k] ids, [Q, k] scores) sorted by decreasing score;
+        queries whose probed lists hold fewer than k vectors are padded with id -1 and score -inf.
+        Each probed posting list is scored once for all the queries probing it, with one matrix product.
+        nprobe defaults to the nprobe attribute of the index.
+        """
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        queries = np.array(queries, dtype=np.float32, ndmin=2)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe] if nprobe < self.n_lists \
+            else np.broadcast_to(np.arange(self.n_lists), coarse.shape)
+
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(queries) == 1:
+            # a single query scores all its probed lists and selects the top-k once
+            ranges = [(self.offsets[list_id], self.offsets[list_id + 1]) for list_id in probes[0]]
+            scores = np.concatenate([np.asarray(self.vectors[begin:end], dtype=np.float32) @ queries[0]
+                                     for begin, end in ranges] + [best_scores[0]])
+            rows = np.concatenate([np.arange(begin, end) for begin, end in ranges] + [best_rows[0]])
+            top = np.argpartition(-scores, k - 1)[:k]
+            best_scores[0], best_rows[0] = scores[top], rows[top]
+        else:
+            self._search_lists(queries, probes, best_scores, best_rows)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        ids = np.where(best_rows >= 0, np.asarray(self.ids[np.maximum(best_rows, 0)]), -1)
+        return ids, best_scores
+
+    def _search_lists(self, queries, probes, best_scores, best_rows):
+        """Score every probed posting list once for all the queries probing it, merging into the running top-k."""
+        k = best_scores.shape[1]
+        # group the (query, list) pairs by list
+        query_index = np.repeat(np.arange(len(queries)), probes.shape[1])
+        list_index = probes.reshape(-1)
+        order = np.argsort(list_index, kind="stable")
+        list_index, query_index = list_index[order], query_index[order]
+        boundaries = np.flatnonzero(np.diff(list_index)) + 1
+        for list_queries, lists in zip(np.split(query_index, boundaries), np.split(list_index, boundaries)):
+            begin, end = self.offsets[lists[0]], self.offsets[lists[0] + 1]
+            if begin == end:
+                continue
+            scores = queries[list_queries] @ np.asarray(self.vectors[begin:end], dtype=np.float32).T
+            rows = np.broadcast_to(np.arange(begin, end), scores.shape)
+            scores = np.concatenate([best_scores[list_queries], scores], axis=1)
+            rows = np.concatenate([best_rows[list_queries], rows], axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores[list_queries] = np.take_along_axis(scores, top, axis=1)
+            best_rows[list_queries] = np.take_along_axis(rows, top, axis=1)
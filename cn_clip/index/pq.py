@@ -0,0 +1,152 @@
+"""
+Product quantization (PQ) of normalized CN-CLIP embeddings.
+
+A D-dimensional feature is split into M sub-vectors of D / M dimensions, and each sub-vector is replaced by the
+index of its nearest centroid in a 256-entry codebook trained for that subspace, so every feature is stored as
+M bytes (e.g. 64 bytes instead of 3 KB for a 768-dim float32 ViT-L feature).
+Search uses asymmetric distance computation (ADC): the query stays in float32, a [M, 256] lookup table of the
+inner products between its sub-vectors and all codewords is computed once, and the approximate score of a code
+is the sum of M table entries.
+
+PQ features are stored in a directory: codebooks.npy ([M, 256, D / M] float32), codes.npy ([N, M] uint8) and
+ids.npy ([N] int64). codes.npy and ids.npy are memory-mapped when read.
+"""
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+from .topk import merge_topk
+
+N_CENTROIDS = 256
+
+
+def _kmeans(x: torch.Tensor, k: int, n_iter: int, rng: np.random.RandomState) -> torch.Tensor:
+    """Euclidean k-means on the rows of x, empty clusters are re-seeded from random rows."""
+    centroids = x[torch.from_numpy(rng.choice(len(x), k, replace=False)).to(x.device)].clone()
+    for i in range(n_iter):
+        assignments = _nearest(x, centroids)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, x)
+        counts = torch.bincount(assignments, minlength=k)
+        empty = (counts == 0).nonzero().flatten()
+        centroids = sums / counts.clamp_min(1).unsqueeze(1).to(sums.dtype)
+        if len(empty) > 0:
+            centroids[empty] = x[torch.from_numpy(rng.choice(len(x), len(empty), replace=False)).to(x.device)]
+    return centroids
+
+
+def _nearest(x: torch.Tensor, centroids: torch.Tensor, block_rows: int = 65536) -> torch.Tensor:
+    """Index of the nearest (Euclidean) centroid for every row of x: argmax of x.c - |c|^2 / 2."""
+    half_norms = 0.5 * (centroids * centroids).sum(dim=1)
+    return torch.cat([(x[start:start + block_rows] @ centroids.T - half_norms).argmax(dim=1)
+                      for start in range(0, len(x), block_rows)])
+
+
+class ProductQuantizer:
+    """M codebooks of 256 centroids, encoding D-dim features (D divisible by M) to M-byte codes."""
+
+    def __init__(self, codebooks: np.ndarray):
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+        self.m, n_centroids, self.dsub = self.codebooks.shape
+        assert n_centroids == N_CENTROIDS, f"Expected {N_CENTROIDS} centroids per codebook, got {n_centroids}"
+
+    @property
+    def dim(self) -> int:
+        return self.m * self.dsub
+
+    @property
+    def code_size(self) -> int:
+        """Bytes per encoded feature."""
+        return self.m
+
+    def compression_ratio(self, dtype=np.float32) -> float:
+        return self.dim * np.dtype(dtype).itemsize / self.code_size
+
+    @staticmethod
+    def train(x: np.ndarray, m: int, n_iter: int = 25, sample_size: Optional[int] = 65536, seed: int = 0,
+              device: str = "cpu") -> "ProductQuantizer":
+        """Train one k-means codebook per subspace on (a random sample of at most sample_size rows of) x."""
+        assert x.shape[1] % m == 0, f"The feature dimension {x.shape[1]} is not divisible by M={m}"
+        rng = np.random.RandomState(seed)
+        if sample_size is not None and len(x) > sample_size:
+            x = x[np.sort(rng.choice(len(x), sample_size, replace=False))]
+        assert len(x) >= N_CENTROIDS, f"Need at least {N_CENTROIDS} training vectors, got {len(x)}"
+        x = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)).to(device)
+        dsub = x.shape[1] // m
+        codebooks = [_kmeans(x[:, i * dsub:(i + 1) * dsub].contiguous(), N_CENTROIDS, n_iter, rng).cpu().numpy()
+                     for i in range(m)]
+        return ProductQuantizer(np.stack(codebooks))
+
+    def encode(self, x, block_rows: int = 65536) -> np.ndarray:
+        """Encode the rows of x (a numpy array or tensor, possibly memory-mapped) to [N, M] uint8 codes."""
+        codebooks = torch.from_numpy(self.codebooks)
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for start in range(0, len(x), block_rows):
+            block = x[start:start + block_rows]
+            if isinstance(block, np.ndarray):
+                block = torch.from_numpy(np.ascontiguousarray(block, dtype=np.float32))
+            block = block.float().cpu()
+            for i in range(self.m):
+                codes[start:start + len(block), i] = _nearest(
+                    block[:, i * self.dsub:(i + 1) * self.dsub], codebooks[i]).numpy()
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """Reconstruct [N, D] float32 features from their codes."""
+        codes = np.asarray(codes)
+        return np.concatenate([self.codebooks[i][codes[:, i]] for i in range(self.m)], axis=1)
+
+    def lookup_tables(self, queries: np.ndarray) -> torch.Tensor:
+        """[Q, M, 256] inner products between the query sub-vectors and all codewords."""
+        queries = torch.from_numpy(np.array(queries, dtype=np.float32, ndmin=2))
+        return torch.einsum("qmd,mkd->qmk", queries.view(len(queries), self.m, self.dsub),
+                            torch.from_numpy(self.codebooks))
+
+    def search(self, codes: np.ndarray, queries: np.ndarray, k: int, max_block_elements: int = 1 << 24,
+               decode_batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exhaustive ADC top-k over the codes (a numpy array, possibly memory-mapped). Returns ([Q, k] row
+        indices, [Q, k] approximate scores) sorted by decreasing score. Codes are scanned in blocks of at most
+        16384 codes, sized so that the [Q, block] score matrix holds at most max_block_elements entries.
+        With at least decode_batch_size queries, every block is decoded once and scored with one matrix product
+        instead of M table lookups per (query, code) pair: the scores are the same, but the product is faster.
+        """
+        queries = np.array(queries, dtype=np.float32, ndmin=2)
+        # [M, Q, 256], every subspace table is contiguous for index_select
+        tables = self.lookup_tables(queries).transpose(0, 1).contiguous()
+        query_tensor = torch.from_numpy(queries)
+        codebooks = torch.from_numpy(self.codebooks)
+        subspaces = torch.arange(self.m).unsqueeze(0)
+        k = min(k, len(codes))
+        block_rows = min(max(1024, max_block_elements // len(queries)), 16384)
+        best_scores = torch.empty((len(queries), 0))
+        best_rows = torch.empty((len(queries), 0), dtype=torch.long)
+        for start in range(0, len(codes), block_rows):
+            block = torch.from_numpy(np.asarray(codes[start:start + block_rows]).astype(np.int64))
+            n_rows = len(block)
+            if len(queries) >= decode_batch_size:
+                scores = query_tensor @ codebooks[subspaces, block].view(n_rows, self.dim).T
+            else:
+                block = block.T.contiguous()
+                scores = tables[0].index_select(1, block[0])
+                for i in range(1, self.m):
+                    scores += tables[i].index_select(1, block[i])
+            best_scores, best_rows = merge_topk(best_scores, best_rows, scores, start, k)
+        return best_rows.numpy(), best_scores.numpy()
+
+
+def write_pq_features(path: str, quantizer: ProductQuantizer, ids: np.ndarray, codes: np.ndarray):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "codebooks.npy"), quantizer.codebooks)
+    np.save(os.path.join(path, "codes.npy"), np.asarray(codes, dtype=np.uint8))
+    np.save(os.path.join(path, "ids.npy"), np.asarray(ids, dtype=np.int64))
+
+
+def read_pq_features(path: str) -> Tuple[ProductQuantizer, np.ndarray, np.ndarray]:
+    """Return (quantizer, ids, codes), the ids and codes are memory-mapped."""
+    quantizer = ProductQuantizer(np.load(os.path.join(path, "codebooks.npy")))
+    ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+    codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+    return quantizer, ids, codes
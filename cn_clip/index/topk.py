@@ -0,0 +1,42 @@
+"""
+Exact blocked top-k search: a batch of queries is scored against the gallery block by block with one matrix
+product per block, and the top-k of every block is merged into a running top-k, so the memory used is bounded
+by the [queries, block] score matrix whatever the gallery size. Runs on the device of the queries (CPU or CUDA).
+"""
+
+from typing import Tuple, Union
+
+import numpy as np
+import torch
+
+
+def blocked_topk(queries: torch.Tensor, gallery: Union[torch.Tensor, np.ndarray], k: int,
+                 block_size: int = 32768) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Top-k inner products of every query over the rows of gallery. Returns ([Q, min(k, N)] scores, [Q, min(k, N)]
+    gallery row indices) sorted by decreasing score, on the device of the queries, like torch.topk.
+    gallery may be a tensor on any device or a (possibly memory-mapped) numpy array; blocks that are not on the
+    device of the queries are copied there one at a time, so a gallery larger than the GPU memory can stay on
+    the CPU, at the cost of one copy of the gallery per call.
+    """
+    best_scores = torch.empty((len(queries), 0), dtype=queries.dtype, device=queries.device)
+    best_indices = torch.empty((len(queries), 0), dtype=torch.long, device=queries.device)
+    for start in range(0, len(gallery), block_size):
+        block = gallery[start:start + block_size]
+        if isinstance(block, np.ndarray):
+            block = torch.from_numpy(np.ascontiguousarray(block))
+        block = block.to(queries.device, dtype=queries.dtype, non_blocking=True)
+        best_scores, best_indices = merge_topk(best_scores, best_indices, queries @ block.T, start, k)
+    return best_scores, best_indices
+
+
+def merge_topk(best_scores: torch.Tensor, best_indices: torch.Tensor, scores: torch.Tensor, offset: int,
+               k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Merge the [Q, B] scores of gallery rows offset..offset + B into the running top-k (best_scores, best_indices),
+    returns the new running top-k sorted by decreasing score.
+    """
+    scores, indices = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+    scores = torch.cat([best_scores, scores], dim=1)
+    best_scores, top = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+    return best_scores, torch.cat([best_indices, indices + offset], dim=1).gather(1, top)
@@ -17,11 +17,11 @@ import torch
 from torch.utils.data import Dataset, DataLoader
 from torch.utils.data.distributed import DistributedSampler
 
-from torchvision.transforms import Compose, Resize, ToTensor, Normalize, InterpolationMode
+from torchvision.transforms import Compose
 from timm.data import create_transform
 
 from cn_clip.clip import _tokenizer
-from cn_clip.clip import tokenize
+from cn_clip.clip import tokenize, BatchImageTransform
 
 
 def _convert_to_rgb(image):
@@ -82,12 +82,8 @@ class LMDBDataset(Dataset):
                          )
             transform = Compose(transform.transforms[:-3] + [_convert_to_rgb] + transform.transforms[-3:])
         else:
-            transform = Compose([
-                Resize((resolution, resolution), interpolation=InterpolationMode.BICUBIC),
-                _convert_to_rgb,
-                ToTensor(),
-                Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
-            ])
+            # images are resized per sample into uint8 arrays and normalized once per batch in collate()
+            transform = BatchImageTransform(resolution)
         return transform
 
     def __del__(self):
@@ -108,12 +104,23 @@ class LMDBDataset(Dataset):
         image_b64 = self.txn_imgs.get("{}".format(image_id).encode('utf-8')).tobytes()
         image_b64 = image_b64.decode(encoding="utf8", errors="ignore")
         image = Image.open(BytesIO(base64.urlsafe_b64decode(image_b64))) # already resized
-        image = self.transform(image)
+        if isinstance(self.transform, BatchImageTransform):
+            image = self.transform.resize(image)
+        else:
+            image = self.transform(image)
 
         text = tokenize([_preprocess_text(raw_text)], context_length=self.max_txt_length)[0]
         eos_index = text.numpy().tolist().index(_tokenizer.vocab['[SEP]'])
         return image, text, eos_index
 
+    def collate(self, batch):
+        images, texts, eos_indices = zip(*batch)
+        if isinstance(self.transform, BatchImageTransform):
+            images = self.transform.normalize(self.transform.stack(images))
+        else:
+            images = torch.stack(images)
+        return images, torch.stack(texts), torch.tensor(eos_indices)
+
 
 def pad_dataset(dataset, global_batch_size):
     # edit dataset.__len__() of the dataset
@@ -172,6 +179,7 @@ def get_dataset(args, is_train, max_txt_length=64, epoch_id=0):
         pin_memory=False,
         num_workers=args.num_workers if is_train else args.valid_num_workers,
         sampler=sampler,
+        collate_fn=dataset.collate,
     )
 
     dataloader.num_samples = num_samples
@@ -11,3 +11,61 @@ class Config:
     # 其他配置项
     IMAGE_SIZE = 336  # ViT-L-14-336的输入分辨率
     DEVICE = os.getenv('DEVICE', 'cuda')  # 可以通过环境变量配置使用CPU或GPU
+
+    # 动态批处理配置: 并发请求最多等待 BATCH_MAX_WAIT_MS 毫秒或凑满 BATCH_MAX_SIZE 条后执行一次批量推理
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '32'))
+    BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+
+    # 推理执行器配置: thread 为线程池共享一份模型, process 为每个推理进程各自加载一份模型
+    INFERENCE_EXECUTOR = os.getenv('INFERENCE_EXECUTOR', 'thread')
+    INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+    INFERENCE_TORCH_THREADS = int(os.getenv('INFERENCE_TORCH_THREADS', '0'))  # 0表示使用PyTorch默认线程数
+
+    # 图片URL下载配置: 共享连接池大小、单个host的并发上限、超时(秒)和响应体大小上限(字节)
+    FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', '10'))
+    FETCH_MAX_CONNECTIONS = int(os.getenv('FETCH_MAX_CONNECTIONS', '100'))
+    FETCH_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('FETCH_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    FETCH_PER_HOST_LIMIT = int(os.getenv('FETCH_PER_HOST_LIMIT', '16'))
+    FETCH_MAX_BODY_BYTES = int(os.getenv('FETCH_MAX_BODY_BYTES', str(20 * 1024 * 1024)))
+    FETCH_MAX_REDIRECTS = int(os.getenv('FETCH_MAX_REDIRECTS', '5'))
+
+    # embedding缓存配置: 内存预算(字节),设为0时关闭缓存;指定目录时被淘汰的条目落盘保存
+    EMBEDDING_CACHE_BYTES = int(os.getenv('EMBEDDING_CACHE_BYTES', str(256 * 1024 * 1024)))
+    EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', '')
+
+    # 图片上传接口(multipart/原始字节)单张图片的大小上限(字节)
+    UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+    # multipart上传接口单次请求的最大图片数,请求体总大小上限为 UPLOAD_MAX_BYTES * UPLOAD_MAX_FILES
+    UPLOAD_MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', '64'))
+
+    # JPEG快速解码: 在DCT域按1/2、1/4、1/8缩放直接解码到接近输入分辨率,对高分辨率视频帧可大幅降低解码耗时
+    FAST_JPEG_DECODE = os.getenv('FAST_JPEG_DECODE', 'false').lower() in ('1', 'true', 'yes')
+
+    # 图片解码进程数: 0表示在主进程的线程池中解码;大于0时由独立的解码进程解码和缩放,像素经共享内存返回
+    DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', '0'))
+    # 解码进程池的共享内存槽位数,即同时解码的最大图片数,每个槽位占用 输入分辨率^2*3 字节
+    DECODE_SLOTS = int(os.getenv('DECODE_SLOTS', '64'))
+
+    # /match标签矩阵缓存的内存预算(字节),相同的有序标签列表直接复用归一化后的文本embedding矩阵,设为0关闭
+    LABEL_CACHE_BYTES = int(os.getenv('LABEL_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+    # 零样本分类头的保存目录,为空时只保存在内存中,重启后丢失
+    CLASSIFIER_DIR = os.getenv('CLASSIFIER_DIR', '')
+
+    # 注意力计算使用PyTorch融合的scaled_dot_product_attention(需要PyTorch>=2.0),CPU推理时可明显降低延迟
+    USE_SDPA = os.getenv('USE_SDPA', 'false').lower() in ('1', 'true', 'yes')
+
+    # CPU推理时对BERT和ViT中的Linear层做int8动态量化,开启后强制使用CPU推理
+    QUANTIZE_INT8 = os.getenv('QUANTIZE_INT8', 'false').lower() in ('1', 'true', 'yes')
+
+    # 加载的模型部分: both(默认)、text(只加载文本模型,只提供文本推理)、vision(只加载图像模型,只提供图像推理)
+    MODEL_TOWERS = os.getenv('MODEL_TOWERS', 'both').lower()
+
+    # embedding索引的保存目录,为空时只保存在内存中,重启后丢失
+    INDEX_DIR = os.getenv('INDEX_DIR', '')
+    # 索引向量的存储类型: float32(默认)或float16(内存减半,分数误差约1e-3)
+    INDEX_DTYPE = os.getenv('INDEX_DTYPE', 'float32')
+    # 索引修改后延迟写盘的秒数,期间的多次修改合并为一次保存;服务退出时保存全部未写盘的修改
+    INDEX_SAVE_DELAY_S = float(os.getenv('INDEX_SAVE_DELAY_S', '5'))
+    # 精确检索时每次与查询做矩阵乘法的索引行数
+    INDEX_SEARCH_BLOCK_ROWS = int(os.getenv('INDEX_SEARCH_BLOCK_ROWS', '16384'))
@@ -1,16 +1,26 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Union
-import torch
-import cn_clip.clip as clip
+from typing import List, Optional, Tuple
+import numpy as np
 from PIL import Image
 import io
-import requests
+import asyncio
 import base64
+import logging
+import time
 from config.config import Config
+from service.batching import MicroBatcher
+from service.cache import EmbeddingCache, LabelMatrixCache
+from service.classifiers import ClassifierRegistry, ZeroShotClassifier, resolve_templates
+from service.encoding import EmbeddingFormat, embedding_format
+from service.decode_pool import DecodePool, ImageDecodeError
+from service.executor import InferenceExecutor
+from service.fetch import FetchError, ImageFetcher
+from service.index import IndexRegistry, VectorIndex, normalize_rows
 import json
-from pathlib import Path
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="CN-CLIP API",
@@ -56,6 +66,18 @@ class TextInput(BaseModel):
     text: str
 
 
+class ClassifierRequest(BaseModel):
+    name: str
+    classnames: List[str]
+    template_set: str = "openai"
+    templates: Optional[List[str]] = None  # 自定义模板,以{}表示类别名,优先于template_set
+    overwrite: bool = False
+
+
+class ClassifyRequest(ImageRequest):
+    top_k: int = 5
+
+
 class EmbeddingInput(BaseModel):
     text: Optional[str] = None
     image: Optional[ImageInput] = None
@@ -69,97 +91,584 @@ class EmbeddingsRequest(BaseModel):
     inputs: List[EmbeddingInput]
 
 
+class IndexInput(EmbeddingInput):
+    embedding: Optional[List[float]] = None  # 直接提供embedding向量,不经过模型推理
+
+    @property
+    def is_valid(self):
+        return sum(map(bool, (self.text, self.image, self.embedding))) == 1  # 确保只提供了text、image或embedding中的一种
+
+
+class IndexItem(IndexInput):
+    id: str
+
+
+class IndexAddRequest(BaseModel):
+    items: List[IndexItem]
+
+
+class IndexSearchRequest(BaseModel):
+    queries: List[IndexInput]
+    top_k: int = 10
+
+
+class IndexDeleteRequest(BaseModel):
+    ids: List[str]
+
+
 # CN-CLIP服务类
 class CNClipService:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.processor = clip.load_from_name(
-            name=Config.CN_CLIP_MODEL_PATH,
-            device=self.device,
+        # torch和cn_clip.clip在加载模型时才导入,导入server模块本身(包括spawn出的子进程)不需要它们
+        import cn_clip.clip as clip
+        from service.runner import ClipModelRunner
+
+        model_kwargs = dict(
+            model_path=Config.CN_CLIP_MODEL_PATH,
             vision_model_name="ViT-L-14-336",
             text_model_name="RoBERTa-wwm-ext-base-chinese",
-            input_resolution=336
+            input_resolution=336,
+            use_sdpa=Config.USE_SDPA,
+            quantize_int8=Config.QUANTIZE_INT8,
+            towers=Config.MODEL_TOWERS
         )
-        self.model.eval()
-        self.tokenizer = clip.tokenize
-
-    async def process_image(self, image: Image.Image):
-        process_image = self.processor(image).unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            image_features = self.model.encode_image(process_image)
-            return image_features[0].detach().cpu().numpy().tolist()
+        self.input_resolution = model_kwargs["input_resolution"]
+        self.fast_decode = Config.FAST_JPEG_DECODE
+        # 只加载文本或图像模型时只提供对应的推理,只读取需要的权重,降低内存占用和启动时间
+        self.towers = Config.MODEL_TOWERS
+        # 模型标识(含预处理方式)参与缓存键的计算,更换模型后不会命中旧模型的缓存
+        # 只加载部分模型不改变embedding,towers不参与模型标识,文本副本和图像副本可以共享缓存和分类头
+        model_id_kwargs = {k: v for k, v in model_kwargs.items() if k != "towers"}
+        self.model_id = json.dumps(dict(model_id_kwargs, fast_decode=self.fast_decode), sort_keys=True)
+
+        # 模型只由推理执行器持有,前向推理在执行器的线程或进程中进行,不阻塞事件循环
+        self.executor = InferenceExecutor(
+            ClipModelRunner,
+            model_kwargs,
+            kind=Config.INFERENCE_EXECUTOR,
+            workers=Config.INFERENCE_WORKERS,
+            torch_threads=Config.INFERENCE_TORCH_THREADS
+        )
+        # 进程模式下等待所有推理进程加载完模型,/ready返回200时即可立即处理请求
+        self.executor.warmup()
+        # 批量预处理: 图片缩放后写入uint8批次,归一化在推理设备上对整个批次一次完成
+        # 开启FAST_JPEG_DECODE时,JPEG图片在DCT域直接解码到接近输入分辨率,再做bicubic缩放
+        self.processor = clip.BatchImageTransform(self.input_resolution, fast_decode=self.fast_decode)
+        # 批量分词: 一次填充整个id矩阵,同时返回attention mask和真实长度,推理时不再从padding重新计算
+        self.tokenizer = clip.tokenize_batch
+        self._logit_scale = None
+
+        # 动态批处理: 合并并发的单条请求,一次前向推理处理整个批次
+        self.image_batcher = MicroBatcher(self._encode_image_batch, max_batch_size=Config.BATCH_MAX_SIZE,
+                                          max_wait_ms=Config.BATCH_MAX_WAIT_MS, name="image",
+                                          max_concurrent_batches=Config.INFERENCE_WORKERS)
+        self.text_batcher = MicroBatcher(self._encode_text_batch, max_batch_size=Config.BATCH_MAX_SIZE,
+                                         max_wait_ms=Config.BATCH_MAX_WAIT_MS, name="text",
+                                         max_concurrent_batches=Config.INFERENCE_WORKERS)
+
+        # embedding缓存: 相同图像(按缩放后的像素)和相同文本直接返回缓存结果
+        self.embedding_cache = EmbeddingCache(max_bytes=Config.EMBEDDING_CACHE_BYTES,
+                                              spill_dir=Config.EMBEDDING_CACHE_DIR)
+
+        # /match标签矩阵缓存: 相同的有序标签列表直接复用归一化后的文本embedding矩阵
+        self.label_cache = LabelMatrixCache(max_bytes=Config.LABEL_CACHE_BYTES)
+
+        # 零样本分类头: 注册时计算一次类别权重矩阵并写入磁盘,启动时读回
+        self.classifiers = ClassifierRegistry(Config.CLASSIFIER_DIR, namespace=self.model_id)
+        self.classifiers.load()
+
+        # embedding索引: 向量保存在进程内的连续矩阵中,检索时查询向量不离开服务进程
+        self.indexes = IndexRegistry(Config.INDEX_DIR, namespace=self.model_id, dtype=Config.INDEX_DTYPE,
+                                     block_rows=Config.INDEX_SEARCH_BLOCK_ROWS)
+        self.indexes.load()
+        self._pending_saves = {}
+
+        # 解码进程池: DECODE_WORKERS>0时图片解码和缩放在独立进程中执行,像素经共享内存返回
+        self.decode_pool = None
+        if Config.DECODE_WORKERS > 0 and self.towers != "text":
+            self.decode_pool = DecodePool(self.input_resolution, fast_decode=self.fast_decode,
+                                          workers=Config.DECODE_WORKERS, slots=Config.DECODE_SLOTS,
+                                          namespace=self.model_id if self.embedding_cache.enabled else None)
+
+    async def _encode_image_batch(self, images: List[np.ndarray]):
+        image_features = await self.executor.call("encode_image", self.processor.stack(images))
+        return list(image_features)
+
+    async def _encode_text_batch(self, texts: List[str]):
+        text_features = await self.executor.call("encode_text", *self.tokenizer(texts))
+        return list(text_features)
+
+    def _decode(self, images: List[bytes]) -> Tuple[np.ndarray, Optional[List[str]]]:
+        try:
+            pixels = self.processor.to_uint8([Image.open(io.BytesIO(image_data)) for image_data in images])
+        except Exception as e:
+            raise ImageDecodeError(str(e) or type(e).__name__) from e
+        keys = None
+        if self.embedding_cache.enabled:
+            keys = [self.embedding_cache.image_key(image_pixels, self.model_id) for image_pixels in pixels]
+        return pixels, keys
+
+    async def _preprocess(self, images: List[bytes]) -> Tuple[np.ndarray, Optional[List[str]]]:
+        """解码并缩放图片,返回uint8像素批次和缓存键(未开启缓存时为None)
+        图片解码和缩放是CPU密集操作,配置了解码进程池时在解码进程中执行,否则放到默认线程池中执行
+        """
+        if self.decode_pool is not None:
+            pixels, keys = await self.decode_pool.decode(images)
+            return pixels, keys if self.embedding_cache.enabled else None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._decode, images)
+
+    async def _image_features(self, images: List[bytes]) -> List[np.ndarray]:
+        """查询缓存后只对未命中的图像做推理. 单张图像经动态批处理与其他请求合并,多张图像直接批量推理"""
+        pixels, keys = await self._preprocess(images)
+        if keys is not None:
+            features = await self.embedding_cache.get_many(keys)
+        else:
+            features = [None] * len(images)
+
+        missing = [i for i, feature in enumerate(features) if feature is None]
+        if missing:
+            if len(missing) == 1:
+                new_features = [await self.image_batcher.submit(pixels[missing[0]])]
+            else:
+                missing_pixels = pixels if len(missing) == len(images) else pixels[missing]
+                new_features = list(await self.executor.call("encode_image", missing_pixels))
+            for i, feature in zip(missing, new_features):
+                features[i] = feature
+                if keys is not None:
+                    self.embedding_cache.put(keys[i], feature)
+        return features
+
+    async def _text_features(self, texts: List[str]) -> List[np.ndarray]:
+        """查询缓存后只对未命中的文本做推理. 单条文本经动态批处理与其他请求合并,多条文本直接批量推理"""
+        if self.embedding_cache.enabled:
+            keys = [self.embedding_cache.text_key(text, self.model_id) for text in texts]
+            features = await self.embedding_cache.get_many(keys)
+        else:
+            keys, features = None, [None] * len(texts)
+
+        missing = [i for i, feature in enumerate(features) if feature is None]
+        if missing:
+            if len(missing) == 1:
+                new_features = [await self.text_batcher.submit(texts[missing[0]])]
+            else:
+                new_features = list(await self.executor.call("encode_text",
+                                                             *self.tokenizer([texts[i] for i in missing])))
+            for i, feature in zip(missing, new_features):
+                features[i] = feature
+                if keys is not None:
+                    self.embedding_cache.put(keys[i], feature)
+        return features
+
+    async def process_image(self, image: bytes) -> np.ndarray:
+        image_features = await self._image_features([image])
+        return image_features[0]
+
+    async def process_text(self, text: str) -> np.ndarray:
+        text_features = await self._text_features([text])
+        return text_features[0]
+
+    async def process_images(self, images: List[bytes]) -> List[np.ndarray]:
+        """批量生成图像embedding: 并行解码和缩放全部图像后执行一次批量前向推理"""
+        return await self._image_features(images)
+
+    async def process_texts(self, texts: List[str]) -> List[np.ndarray]:
+        """批量生成文本embedding: 统一分词后执行一次批量前向推理"""
+        return await self._text_features(texts)
+
+    def stats(self):
+        return {
+            "batching": {
+                "image": self.image_batcher.stats(),
+                "text": self.text_batcher.stats(),
+            },
+            "executor": {
+                "kind": self.executor.kind,
+                "workers": self.executor.workers,
+            },
+            "cache": self.embedding_cache.stats(),
+            "label_cache": self.label_cache.stats(),
+            "decode": self.decode_pool.stats() if self.decode_pool is not None else {"workers": 0},
+        }
+
+    async def _label_matrix(self, texts: List[str]) -> np.ndarray:
+        """返回按顺序排列、已归一化的 [L, D] 标签embedding矩阵,优先从标签矩阵缓存中读取"""
+        key = self.label_cache.key(texts, self.model_id)
+        label_matrix = self.label_cache.get(key)
+        if label_matrix is None:
+            label_matrix = np.stack(await self._text_features(texts)).astype(np.float32)
+            label_matrix /= np.linalg.norm(label_matrix, axis=1, keepdims=True)
+            self.label_cache.put(key, label_matrix)
+        return label_matrix
+
+    async def match(self, image: bytes, texts: List[str]):
+        """计算图文匹配相似度,与CN-CLIP原生的get_similarity计算方式一致
+        标签矩阵命中缓存时只对图像做一次前向推理
+        """
+        if self._logit_scale is None:
+            self._logit_scale = await self.executor.call("logit_scale")
+        image_feature, label_matrix = await asyncio.gather(self._image_features([image]),
+                                                           self._label_matrix(texts))
+
+        # 归一化后计算余弦相似度,乘以logit_scale后做softmax
+        image_feature = image_feature[0].astype(np.float32)
+        image_feature /= np.linalg.norm(image_feature)
+        logits = self._logit_scale * (label_matrix @ image_feature)
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+
+        # 将概率值与文本对应
+        return {text: float(prob) for text, prob in zip(texts, probs)}
+
+    async def register_classifier(self, name: str, classnames: List[str], template_set: str,
+                                  templates: Optional[List[str]] = None) -> ZeroShotClassifier:
+        """计算零样本分类头并注册,类别数和模板数较多时耗时较长"""
+        weights = await self.executor.call("build_classifier", classnames, template_set, templates)
+        return self.classifiers.register(name, classnames, weights, template_set, templates)
+
+    async def classify(self, image: bytes, classifier: ZeroShotClassifier, top_k: int):
+        """零样本分类: 一次图像前向推理加一次与类别权重矩阵的矩阵乘法,返回概率最高的top_k个类别"""
+        if self._logit_scale is None:
+            self._logit_scale = await self.executor.call("logit_scale")
+        image_feature = (await self._image_features([image]))[0].astype(np.float32)
+        image_feature /= np.linalg.norm(image_feature)
+        logits = self._logit_scale * (classifier.weights @ image_feature)
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+
+        top_indices = np.argsort(-probs)[:top_k]
+        return [{"label": classifier.classnames[i], "score": float(probs[i])} for i in top_indices]
+
+    async def index_add(self, name: str, ids: List[str], vectors: np.ndarray) -> dict:
+        """添加或覆盖索引中的向量,索引不存在时按向量维度创建
+        创建索引之前先校验向量,添加失败时不会留下空索引
+        """
+        vectors = normalize_rows(vectors)
+        if len(vectors) != len(ids):
+            raise ValueError(f"id数量({len(ids)})与向量数量({len(vectors)})不一致")
+        index = self.indexes.get_or_create(name, vectors.shape[1])
+        added = await asyncio.get_running_loop().run_in_executor(None, index.add, ids, vectors)
+        self._schedule_save(name)
+        return dict(index.info(), added=added, updated=len(set(ids)) - added)
+
+    async def index_delete(self, index: VectorIndex, ids: List[str]) -> int:
+        """index由路由解析,期间索引被并发删除时只修改已脱离注册表的索引对象"""
+        deleted = await asyncio.get_running_loop().run_in_executor(None, index.delete, ids)
+        self._schedule_save(index.name)
+        return deleted
+
+    async def index_search(self, index: VectorIndex, queries: np.ndarray, top_k: int):
+        """精确内积检索在默认线程池中执行,大索引的矩阵乘法不阻塞事件循环"""
+        ids, scores = await asyncio.get_running_loop().run_in_executor(None, index.search, queries, top_k)
+        return [[{"id": id_, "score": float(score)} for id_, score in zip(query_ids, query_scores)]
+                for query_ids, query_scores in zip(ids, scores)]
+
+    def _schedule_save(self, name: str):
+        """索引修改后延迟INDEX_SAVE_DELAY_S秒写盘,期间的多次修改只保存一次"""
+        if self.indexes.directory and name not in self._pending_saves:
+            self._pending_saves[name] = asyncio.get_running_loop().create_task(self._save_index_later(name))
+
+    async def _save_index_later(self, name: str):
+        try:
+            await asyncio.sleep(Config.INDEX_SAVE_DELAY_S)
+        finally:
+            # 先移除再保存,保存期间的修改会安排下一次保存
+            self._pending_saves.pop(name, None)
+        index = self.indexes.get(name)
+        if index is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.indexes.save, index)
+            except OSError:
+                logger.exception(f"保存索引{name}失败")
+
+    async def shutdown(self):
+        await self.image_batcher.close()
+        await self.text_batcher.close()
+        self.indexes.save_all()
+        self.embedding_cache.close()
+        self.executor.shutdown()
+        if self.decode_pool is not None:
+            self.decode_pool.shutdown()
+
+
+# 服务实例在启动后由后台任务创建,模型加载完成前为None
+clip_service: Optional[CNClipService] = None
+# 模型加载状态: loading(加载中) / ready(可用) / failed(加载失败),由 /ready 返回
+service_state = {"status": "loading", "error": None, "load_seconds": None}
+image_fetcher = ImageFetcher(
+    timeout=Config.FETCH_TIMEOUT,
+    max_connections=Config.FETCH_MAX_CONNECTIONS,
+    max_keepalive_connections=Config.FETCH_MAX_KEEPALIVE_CONNECTIONS,
+    per_host_limit=Config.FETCH_PER_HOST_LIMIT,
+    max_body_bytes=Config.FETCH_MAX_BODY_BYTES,
+    max_redirects=Config.FETCH_MAX_REDIRECTS
+)
 
-    async def process_text(self, text: str):
-        text = self.tokenizer([text]).to(self.device)
-        with torch.no_grad():
-            text_features = self.model.encode_text(text)
-            return text_features[0].detach().cpu().numpy().tolist()
 
-    async def match(self, image: Image.Image, texts: List[str]):
-        """计算图文匹配相似度,使用CN-CLIP原生的计算方式"""
-        processed_image = self.processor(image).unsqueeze(0).to(self.device)
-        text = self.tokenizer(texts).to(self.device)
+async def load_service():
+    """在线程中导入torch并加载模型,不阻塞事件循环,加载期间/health和/ready可以正常响应"""
+    global clip_service
+    start = time.perf_counter()
+    try:
+        service = await asyncio.get_running_loop().run_in_executor(None, CNClipService)
+    except Exception as e:
+        logger.exception("模型加载失败")
+        service_state.update(status="failed", error=str(e) or type(e).__name__)
+        return
+    clip_service = service
+    service_state.update(status="ready", load_seconds=round(time.perf_counter() - start, 3))
+    logger.info("模型加载完成,耗时%.1f秒", service_state["load_seconds"])
 
-        with torch.no_grad():
-            # 使用模型原生的相似度计算方法
-            logits_per_image, logits_per_text = self.model.get_similarity(processed_image, text)
-            probs = logits_per_image.softmax(dim=-1).cpu().numpy()
 
-            # 将概率值与文本对应
-            return {text: float(prob) for text, prob in zip(texts, probs[0])}
+class UploadSizeLimit:
+    """按Content-Length在读取请求体之前拒绝超大的上传请求
 
+    multipart表单在进入路由函数之前就会被完整解析,只能在ASGI层提前拦截. 没有Content-Length的分块请求
+    不在此拦截: multipart文件超过1MB后写入临时文件,原始字节接口在分块读取时检查上限.
+    """
 
-# 创建服务实例
-clip_service = CNClipService()
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is not None:
+            content_length = dict(scope["headers"]).get(b"content-length")
+            if content_length is not None and (not content_length.isdigit() or int(content_length) > limit):
+                response = JSONResponse(status_code=413, content={"detail": f"请求体超过上限{limit}字节"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimit, limits={
+    "/embeddings/image/raw": Config.UPLOAD_MAX_BYTES,
+    # 每张图片不超过UPLOAD_MAX_BYTES,另外留出multipart分隔符和表单头的空间
+    "/embeddings/image/upload": Config.UPLOAD_MAX_FILES * (Config.UPLOAD_MAX_BYTES + 4096),
+})
+
+
+@app.on_event("startup")
+async def startup():
+    # 模型在后台加载: 进程启动后立即开始接受连接,加载完成前/ready返回503,模型相关接口也返回503
+    app.state.load_task = asyncio.get_running_loop().create_task(load_service())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await image_fetcher.close()
+    if clip_service is not None:
+        await clip_service.shutdown()
+
+
+def service_ready():
+    """路由依赖: 模型加载完成前拒绝请求"""
+    if clip_service is None:
+        if service_state["status"] == "failed":
+            raise HTTPException(status_code=503, detail=f"模型加载失败: {service_state['error']}")
+        raise HTTPException(status_code=503, detail="模型加载中,请稍后重试")
+
+
+def check_image(image_data: bytes):
+    """校验图片格式. Image.open只解析文件头,不解码像素,像素的解码和缩放由CNClipService完成"""
+    Image.open(io.BytesIO(image_data))
+
+
+async def load_image(image_url: Optional[str], image_base64: Optional[str]) -> bytes:
+    """按图片URL或base64编码获取图片原始字节,失败时返回400错误"""
+    if image_url:
+        try:
+            image_data = await image_fetcher.fetch(image_url)
+        except FetchError as e:
+            raise HTTPException(status_code=400, detail=f"获取图片URL失败: {str(e)}")
+        try:
+            check_image(image_data)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"处理URL图片失败: {str(e)}")
+    else:  # 使用base64
+        try:
+            image_data = base64.b64decode(image_base64)
+            check_image(image_data)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"处理base64图片失败: {str(e)}")
+    return image_data
+
+
+def check_uploaded_image(image_data: bytes, name: str) -> bytes:
+    """校验上传的原始图片字节,失败时返回400错误"""
+    if not image_data:
+        raise HTTPException(status_code=400, detail=f"上传的图片{name}为空")
+    if len(image_data) > Config.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"上传的图片{name}超过上限{Config.UPLOAD_MAX_BYTES}字节")
+    try:
+        check_image(image_data)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"处理上传图片{name}失败: {str(e)}")
+    return image_data
+
+
+async def read_upload(file: UploadFile, name: str) -> bytes:
+    """最多读取 UPLOAD_MAX_BYTES + 1 字节,超过上限时不再继续读取"""
+    return check_uploaded_image(await file.read(Config.UPLOAD_MAX_BYTES + 1), name)
+
+
+async def read_body(http_request: Request) -> bytes:
+    """分块读取请求体,累计超过 UPLOAD_MAX_BYTES 时立即返回413,不会把超大的请求体整个读入内存"""
+    body = bytearray()
+    async for chunk in http_request.stream():
+        body += chunk
+        if len(body) > Config.UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"上传的图片body超过上限{Config.UPLOAD_MAX_BYTES}字节")
+    return check_uploaded_image(bytes(body), "body")
+
+
+async def embed_inputs(inputs: List[IndexInput]) -> np.ndarray:
+    """按输入顺序返回 [N, D] 的embedding矩阵: 文本和图像分别批量推理,embedding直接使用"""
+    if not inputs:
+        raise HTTPException(status_code=400, detail="输入不能为空")
+    for input_item in inputs:
+        if not input_item.is_valid:
+            raise HTTPException(status_code=400, detail="每个输入项必须且只能包含text、image或embedding其中之一")
+        if input_item.image and not input_item.image.has_valid_input:
+            raise HTTPException(status_code=400, detail="图像输入必须且只能提供image_url或image_base64其中之一")
+
+    results = [input_item.embedding for input_item in inputs]
+    text_positions = [i for i, input_item in enumerate(inputs) if input_item.text]
+    image_positions = [i for i, input_item in enumerate(inputs) if input_item.image]
+    if text_positions:
+        require_tower("text")
+        text_embeddings = await clip_service.process_texts([inputs[i].text for i in text_positions])
+        for i, embedding in zip(text_positions, text_embeddings):
+            results[i] = embedding
+    if image_positions:
+        require_tower("vision")
+        images = await asyncio.gather(*[load_image(inputs[i].image.image_url, inputs[i].image.image_base64)
+                                        for i in image_positions])
+        try:
+            image_embeddings = await clip_service.process_images(images)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
+        for i, embedding in zip(image_positions, image_embeddings):
+            results[i] = embedding
+    if len({len(embedding) for embedding in results}) != 1:
+        raise HTTPException(status_code=400, detail="所有embedding的维度必须一致")
+    return np.array(results, dtype=np.float32)
+
+
+def get_index(name: str):
+    """返回已存在的索引,不存在时返回404错误"""
+    index = clip_service.indexes.get(name)
+    if index is None:
+        raise HTTPException(status_code=404, detail=f"索引{name}不存在")
+    return index
+
+
+def require_tower(tower: str):
+    """只加载了部分模型时,拒绝需要未加载模型(text或vision)的请求"""
+    if clip_service.towers not in ("both", tower):
+        name = "文本" if tower == "text" else "图像"
+        raise HTTPException(status_code=400, detail=f"当前服务未加载{name}模型(MODEL_TOWERS={clip_service.towers})")
 
 
 # API路由
-@app.post("/embeddings/image")
-async def image_embedding(request: ImageRequest):
+@app.get("/health")
+async def health():
+    """健康检查(存活探针): 进程可以响应请求即返回ok,不等待模型加载"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """就绪检查(就绪探针): 模型加载完成返回200,加载中或加载失败返回503"""
+    return JSONResponse(dict(service_state), status_code=200 if service_state["status"] == "ready" else 503)
+
+
+@app.post("/embeddings/image", dependencies=[Depends(service_ready)])
+async def image_embedding(request: ImageRequest, response_format: EmbeddingFormat = Depends(embedding_format)):
     """生成图像的embedding向量
     支持两种图片输入方式:
     1. 图片URL
     2. Base64编码
+    响应格式通过format查询参数或Accept请求头协商,见EmbeddingFormat
     """
+    require_tower("vision")
     try:
         if not request.has_valid_input:
             raise HTTPException(status_code=400, detail="必须且只能提供一种图片输入方式: image_url 或 image_base64")
 
         # 获取图像
-        if request.image_url:
-            try:
-                response = requests.get(request.image_url)
-                response.raise_for_status()  # 检查请求是否成功
-                image = Image.open(io.BytesIO(response.content))
-            except requests.exceptions.RequestException as e:
-                raise HTTPException(status_code=400, detail=f"获取图片URL失败: {str(e)}")
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"处理URL图片失败: {str(e)}")
-        else:  # 使用base64
-            try:
-                image_data = base64.b64decode(request.image_base64)
-                image = Image.open(io.BytesIO(image_data))
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"处理base64图片失败: {str(e)}")
+        image = await load_image(request.image_url, request.image_base64)
 
         # 生成embedding
         embedding = await clip_service.process_image(image)
-        return JSONResponse({
+        return response_format.render({
+            "success": True,
+            "embedding": embedding
+        })
+    except HTTPException:
+        raise
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+
+@app.post("/embeddings/image/upload", dependencies=[Depends(service_ready)])
+async def image_upload_embedding(files: List[UploadFile] = File(...),
+                                 response_format: EmbeddingFormat = Depends(embedding_format)):
+    """通过multipart/form-data上传一张或多张图片(字段名files),批量生成图像embedding
+    免去base64编码带来的体积膨胀和JSON解析开销,结果按上传顺序返回
+    """
+    require_tower("vision")
+    try:
+        if len(files) > Config.UPLOAD_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"上传的图片数量超过上限{Config.UPLOAD_MAX_FILES}")
+        images = [await read_upload(file, file.filename or str(i)) for i, file in enumerate(files)]
+        try:
+            image_embeddings = await clip_service.process_images(images)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
+        return response_format.render({
+            "success": True,
+            "results": [{
+                "type": "image",
+                "input": file.filename or "upload_image",
+                "embedding": embedding
+            } for file, embedding in zip(files, image_embeddings)]
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+
+@app.post("/embeddings/image/raw", dependencies=[Depends(service_ready)])
+async def image_raw_embedding(http_request: Request, response_format: EmbeddingFormat = Depends(embedding_format)):
+    """请求体直接为图片原始字节(Content-Type: application/octet-stream 或 image/*),生成图像的embedding向量"""
+    require_tower("vision")
+    try:
+        image = await read_body(http_request)
+        embedding = await clip_service.process_image(image)
+        return response_format.render({
             "success": True,
             "embedding": embedding
         })
     except HTTPException:
         raise
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
 
-@app.post("/embeddings/text")
-async def text_embedding(request: TextRequest):
+@app.post("/embeddings/text", dependencies=[Depends(service_ready)])
+async def text_embedding(request: TextRequest, response_format: EmbeddingFormat = Depends(embedding_format)):
     """生成文本的embedding向量"""
+    require_tower("text")
     try:
         embedding = await clip_service.process_text(request.text)
-        return JSONResponse({
+        return response_format.render({
             "success": True,
             "embedding": embedding
         })
@@ -167,13 +676,15 @@ async def text_embedding(request: TextRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/match")
+@app.post("/match", dependencies=[Depends(service_ready)])
 async def match(request: MatchRequest):
     """计算图文匹配相似度
     支持两种图片输入方式:
     1. 图片URL
     2. Base64编码
     """
+    require_tower("text")
+    require_tower("vision")
     try:
         if not request.texts:
             raise HTTPException(status_code=400, detail="texts不能为空")
@@ -182,21 +693,7 @@ async def match(request: MatchRequest):
             raise HTTPException(status_code=400, detail="必须且只能提供一种图片输入方式: image_url 或 image_base64")
 
         # 获取图像
-        if request.image_url:
-            try:
-                response = requests.get(request.image_url)
-                response.raise_for_status()  # 检查请求是否成功
-                image = Image.open(io.BytesIO(response.content))
-            except requests.exceptions.RequestException as e:
-                raise HTTPException(status_code=400, detail=f"获取图片URL失败: {str(e)}")
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"处理URL图片失败: {str(e)}")
-        else:  # 使用base64
-            try:
-                image_data = base64.b64decode(request.image_base64)
-                image = Image.open(io.BytesIO(image_data))
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"处理base64图片失败: {str(e)}")
+        image = await load_image(request.image_url, request.image_base64)
 
         # 计算匹配度
         scores = await clip_service.match(image, request.texts)
@@ -206,69 +703,241 @@ async def match(request: MatchRequest):
         })
     except HTTPException:
         raise
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
 
-@app.post("/embeddings")
-async def embeddings(request: EmbeddingsRequest):
+@app.post("/embeddings", dependencies=[Depends(service_ready)])
+async def embeddings(request: EmbeddingsRequest, response_format: EmbeddingFormat = Depends(embedding_format)):
     """统一的向量化接口
     支持文本和图像混合输入:
     1. 文本输入格式: {"text": "文本内容"}
     2. 图像输入格式: {"image": {"image_url": "URL"}} 或 {"image": {"image_base64": "BASE64"}}
+    binary格式按输入顺序返回embedding矩阵,每行的类型见X-Embedding-Types响应头
     """
     try:
         if not request.inputs:
             raise HTTPException(status_code=400, detail="输入不能为空")
 
-        results = []
         for input_item in request.inputs:
             if not input_item.is_valid:
                 raise HTTPException(status_code=400, detail="每个输入项必须且只能包含text或image其中之一")
-
-            if input_item.text:
-                # 处理文本
-                embedding = await clip_service.process_text(input_item.text)
-                results.append({
+            if input_item.image and not input_item.image.has_valid_input:
+                raise HTTPException(status_code=400, detail="图像输入必须且只能提供image_url或image_base64其中之一")
+
+        text_positions = [i for i, input_item in enumerate(request.inputs) if input_item.text]
+        image_positions = [i for i, input_item in enumerate(request.inputs) if not input_item.text]
+        results = [None] * len(request.inputs)
+        if text_positions:
+            require_tower("text")
+        if image_positions:
+            require_tower("vision")
+
+        # 处理文本: 所有文本统一分词,一次批量推理
+        if text_positions:
+            texts = [request.inputs[i].text for i in text_positions]
+            text_embeddings = await clip_service.process_texts(texts)
+            for i, text, embedding in zip(text_positions, texts, text_embeddings):
+                results[i] = {
                     "type": "text",
-                    "input": input_item.text,
+                    "input": text,
                     "embedding": embedding
-                })
-            else:
-                # 处理图像
-                if not input_item.image.has_valid_input:
-                    raise HTTPException(status_code=400, detail="图像输入必须且只能提供image_url或image_base64其中之一")
-
-                try:
-                    if input_item.image.image_url:
-                        response = requests.get(input_item.image.image_url)
-                        response.raise_for_status()
-                        image = Image.open(io.BytesIO(response.content))
-                    else:
-                        image_data = base64.b64decode(input_item.image.image_base64)
-                        image = Image.open(io.BytesIO(image_data))
-
-                    embedding = await clip_service.process_image(image)
-                    results.append({
-                        "type": "image",
-                        "input": input_item.image.image_url or "base64_image",
-                        "embedding": embedding
-                    })
-                except requests.exceptions.RequestException as e:
-                    raise HTTPException(status_code=400, detail=f"获取图片URL失败: {str(e)}")
-                except Exception as e:
-                    raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
+                }
 
+        # 处理图像: 并发下载和解码所有图像,一次批量推理
+        if image_positions:
+            image_inputs = [request.inputs[i].image for i in image_positions]
+            images = await asyncio.gather(*[load_image(image_input.image_url, image_input.image_base64)
+                                            for image_input in image_inputs])
+            try:
+                image_embeddings = await clip_service.process_images(images)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
+            for i, image_input, embedding in zip(image_positions, image_inputs, image_embeddings):
+                results[i] = {
+                    "type": "image",
+                    "input": image_input.image_url or "base64_image",
+                    "embedding": embedding
+                }
+
+        return response_format.render({
+            "success": True,
+            "results": results
+        }, headers={"X-Embedding-Types": ",".join(result["type"] for result in results)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+
+@app.post("/classifiers", dependencies=[Depends(service_ready)])
+async def register_classifier(request: ClassifierRequest):
+    """注册零样本分类头
+    按类别名和prompt模板集合(template_set, 或以{}表示类别名的自定义templates)计算类别权重矩阵,
+    之后通过 /classify/{name} 分类,无需每次请求都发送全部类别文本
+    """
+    require_tower("text")
+    try:
+        ClassifierRegistry.validate_name(request.name)
+        resolve_templates(request.template_set, request.templates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not request.classnames or not all(classname.strip() for classname in request.classnames):
+        raise HTTPException(status_code=400, detail="classnames不能为空,且不能包含空字符串")
+    if clip_service.classifiers.get(request.name) is not None and not request.overwrite:
+        raise HTTPException(status_code=409, detail=f"分类器{request.name}已存在,如需覆盖请设置overwrite为true")
+
+    try:
+        classifier = await clip_service.register_classifier(request.name, request.classnames,
+                                                            request.template_set, request.templates)
+        return JSONResponse({
+            "success": True,
+            "classifier": classifier.info()
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+
+@app.get("/classifiers", dependencies=[Depends(service_ready)])
+async def list_classifiers():
+    """列出已注册的零样本分类头"""
+    return JSONResponse({
+        "success": True,
+        "classifiers": clip_service.classifiers.list()
+    })
+
+
+@app.delete("/classifiers/{name}", dependencies=[Depends(service_ready)])
+async def delete_classifier(name: str):
+    """删除零样本分类头"""
+    if not clip_service.classifiers.remove(name):
+        raise HTTPException(status_code=404, detail=f"分类器{name}不存在")
+    return JSONResponse({"success": True})
+
+
+@app.post("/classify/{name}", dependencies=[Depends(service_ready)])
+async def classify(name: str, request: ClassifyRequest):
+    """使用已注册的零样本分类头对图像分类,返回概率最高的top_k个类别
+    支持两种图片输入方式:
+    1. 图片URL
+    2. Base64编码
+    """
+    require_tower("vision")
+    try:
+        classifier = clip_service.classifiers.get(name)
+        if classifier is None:
+            raise HTTPException(status_code=404, detail=f"分类器{name}不存在")
+
+        if not request.has_valid_input:
+            raise HTTPException(status_code=400, detail="必须且只能提供一种图片输入方式: image_url 或 image_base64")
+
+        if request.top_k < 1:
+            raise HTTPException(status_code=400, detail="top_k必须大于0")
+
+        # 获取图像
+        image = await load_image(request.image_url, request.image_base64)
+
+        labels = await clip_service.classify(image, classifier, request.top_k)
+        return JSONResponse({
+            "success": True,
+            "classifier": name,
+            "labels": labels
+        })
+    except HTTPException:
+        raise
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"处理图片失败: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+
+@app.post("/index/{name}/add", dependencies=[Depends(service_ready)])
+async def index_add(name: str, request: IndexAddRequest):
+    """向索引中添加向量,索引不存在时自动创建
+    每项包含唯一的id,以及text、image({"image_url"}或{"image_base64"})或embedding其中之一;
+    文本和图像在服务内推理后直接写入索引,id已存在时覆盖原向量
+    """
+    try:
+        IndexRegistry.validate_name(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        vectors = await embed_inputs(request.items)
+        index = await clip_service.index_add(name, [item.id for item in request.items], vectors)
+        return JSONResponse({
+            "success": True,
+            "index": index
+        })
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+
+@app.post("/index/{name}/search", dependencies=[Depends(service_ready)])
+async def index_search(name: str, request: IndexSearchRequest):
+    """在索引中检索与查询最相似的top_k个向量(余弦相似度,精确检索)
+    查询可以是text(以文搜图)、image(以图搜图)或embedding,一次请求可包含多个查询,结果按查询顺序返回
+    """
+    index = get_index(name)
+    if request.top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k必须大于0")
+    try:
+        queries = await embed_inputs(request.queries)
+        results = await clip_service.index_search(index, queries, request.top_k)
         return JSONResponse({
             "success": True,
             "results": results
         })
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
 
+@app.post("/index/{name}/delete", dependencies=[Depends(service_ready)])
+async def index_delete(name: str, request: IndexDeleteRequest):
+    """按id删除索引中的向量,返回实际删除的数量"""
+    index = get_index(name)
+    deleted = await clip_service.index_delete(index, request.ids)
+    return JSONResponse({
+        "success": True,
+        "deleted": deleted,
+        "index": index.info()
+    })
+
+
+@app.get("/index", dependencies=[Depends(service_ready)])
+async def list_indexes():
+    """列出全部索引"""
+    return JSONResponse({
+        "success": True,
+        "indexes": clip_service.indexes.list()
+    })
+
+
+@app.delete("/index/{name}", dependencies=[Depends(service_ready)])
+async def delete_index(name: str):
+    """删除整个索引(包括磁盘上的文件)"""
+    if not clip_service.indexes.remove(name):
+        raise HTTPException(status_code=404, detail=f"索引{name}不存在")
+    return JSONResponse({"success": True})
+
+
+@app.get("/metrics", dependencies=[Depends(service_ready)])
+async def metrics():
+    """服务运行指标: 动态批处理的批大小与排队延迟、embedding缓存命中情况"""
+    stats = clip_service.stats()
+    stats["fetch"] = image_fetcher.stats()
+    return JSONResponse(stats)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,172 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, List
+
+
+class _PendingItem:
+    __slots__ = ("payload", "future", "enqueued_at")
+
+    def __init__(self, payload: Any, future: asyncio.Future, enqueued_at: float):
+        self.payload = payload
+        self.future = future
+        self.enqueued_at = enqueued_at
+
+
+class MicroBatcher:
+    """动态批处理调度器
+
+    把并发到达的单条请求合并成一个批次执行一次前向推理,再把结果分发回各个等待的协程.
+    队首请求最多等待 max_wait_ms 毫秒,或凑满 max_batch_size 条后立即执行.
+    batch_fn 接收输入列表,返回与输入等长、顺序一致的结果列表.
+    max_concurrent_batches 限制同时执行的批次数,通常与推理执行器的worker数量一致.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "batcher", max_concurrent_batches: int = 1,
+                 window: int = 1024):
+        assert max_batch_size >= 1, "max_batch_size必须大于0"
+        assert max_concurrent_batches >= 1, "max_concurrent_batches必须大于0"
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.max_concurrent_batches = max_concurrent_batches
+
+        # 队列、信号量和后台任务在第一次提交时创建,保证绑定到正在运行的事件循环
+        self._queue = None
+        self._slots = None
+        self._worker = None
+        # 正在执行的批次任务,保留引用避免任务在执行中被垃圾回收,关闭时统一取消
+        self._tasks = set()
+
+        # 统计指标
+        self._num_batches = 0
+        self._num_items = 0
+        self._max_batch_size_seen = 0
+        self._batch_size_hist = {}
+        self._total_queue_delay = 0.0
+        self._max_queue_delay = 0.0
+        self._recent_delays = deque(maxlen=window)
+
+    async def submit(self, payload: Any) -> Any:
+        """提交一条输入,等待所在批次执行完毕后返回对应结果"""
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._queue.put_nowait(_PendingItem(payload, future, loop.time()))
+        return await future
+
+    async def _collect(self) -> List[_PendingItem]:
+        loop = asyncio.get_running_loop()
+        first = await self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 等待结束后把已经到达的请求一并带上
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 先等到有空闲的执行槽位再开始收集,执行期间到达的请求会累积到下一个批次
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # 客户端断开等原因被取消的请求不再参与推理
+            batch = [item for item in batch if not item.future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            self._record(batch, loop.time())
+            task = loop.create_task(self._execute(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """停止收集新批次,取消正在执行的批次并等待其结束,排队中的请求同样被取消"""
+        tasks = [self._worker, *self._tasks] if self._worker is not None else list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait().future.cancel()
+
+    async def _execute(self, batch: List[_PendingItem]):
+        try:
+            results = await self.batch_fn([item.payload for item in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name}批处理返回了{len(results)}条结果,期望{len(batch)}条")
+        except BaseException as e:
+            # 任务被取消(如服务关闭)时CancelledError不是Exception的子类,同样要结束所有等待的请求,否则调用方会一直挂起
+            cancelled = isinstance(e, asyncio.CancelledError)
+            for item in batch:
+                if not item.future.done():
+                    if cancelled:
+                        item.future.cancel()
+                    else:
+                        item.future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        finally:
+            self._slots.release()
+
+        for item, result in zip(batch, results):
+            if not item.future.done():
+                item.future.set_result(result)
+
+    def _record(self, batch: List[_PendingItem], started_at: float):
+        size = len(batch)
+        self._num_batches += 1
+        self._num_items += size
+        self._max_batch_size_seen = max(self._max_batch_size_seen, size)
+        self._batch_size_hist[size] = self._batch_size_hist.get(size, 0) + 1
+        for item in batch:
+            delay = started_at - item.enqueued_at
+            self._total_queue_delay += delay
+            self._max_queue_delay = max(self._max_queue_delay, delay)
+            self._recent_delays.append(delay)
+
+    def stats(self) -> dict:
+        """返回批大小和排队延迟统计,延迟单位为毫秒"""
+        recent = sorted(self._recent_delays)
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(p / 100.0 * len(recent)))] * 1e3
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1e3,
+            "max_concurrent_batches": self.max_concurrent_batches,
+            "num_batches": self._num_batches,
+            "num_items": self._num_items,
+            "avg_batch_size": self._num_items / self._num_batches if self._num_batches else 0.0,
+            "max_batch_size_seen": self._max_batch_size_seen,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_size_hist.items())},
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "avg_queue_delay_ms": self._total_queue_delay / self._num_items * 1e3 if self._num_items else 0.0,
+            "max_queue_delay_ms": self._max_queue_delay * 1e3,
+            "p50_queue_delay_ms": percentile(50),
+            "p99_queue_delay_ms": percentile(99),
+        }
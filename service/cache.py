@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每个缓存条目除向量本身以外的大致内存开销(键、OrderedDict节点、numpy对象头)
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+class EmbeddingCache:
+    """内容寻址的embedding缓存
+
+    键为缩放后图像像素(或归一化后的文本)与模型标识的哈希,内存中按LRU淘汰,总占用不超过 max_bytes.
+    指定 spill_dir 时,被淘汰的条目写入磁盘,之后命中时再读回内存. 磁盘读取在默认线程池中执行,
+    淘汰条目由单独的写盘线程在后台写入,事件循环不等待磁盘IO; 写盘完成前的条目仍可从待写队列中命中.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, spill_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or None
+        self._writer = None
+        # 已淘汰但还没有写入磁盘的条目
+        self._pending_spills = {}
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-spill")
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        # 统计指标
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def image_key(pixels: np.ndarray, namespace: str) -> str:
+        """按缩放后输入模型的uint8像素计算图像的缓存键,不同编码方式但像素相同的图片共享同一条缓存"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(namespace.encode("utf-8"))
+        digest.update(f"image:{'x'.join(str(dim) for dim in pixels.shape)}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(pixels).data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def text_key(text: str, namespace: str) -> str:
+        """按归一化后的文本计算缓存键. 分词器会去掉首尾空白并转小写,因此这两步不改变模型输入"""
+        normalized = text.strip().lower()
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(namespace.encode("utf-8"))
+        digest.update(b"text:")
+        digest.update(normalized.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, key[:2], f"{key}.npy")
+
+    async def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """按顺序返回每个键的缓存向量,未命中为None. 内存中未命中的键一次性到磁盘上查找"""
+        if not self.enabled:
+            return [None] * len(keys)
+        values = []
+        on_disk = []
+        for i, key in enumerate(keys):
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            elif self.spill_dir:
+                value = self._pending_spills.get(key)
+                if value is None:
+                    on_disk.append(i)
+                else:
+                    self.disk_hits += 1
+                    self._insert(key, value)
+            values.append(value)
+
+        if on_disk:
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                None, self._load_spilled, [keys[i] for i in on_disk])
+            for i, value in zip(on_disk, loaded):
+                if value is not None:
+                    self.disk_hits += 1
+                    self._insert(keys[i], value)
+                    values[i] = value
+        self.misses += sum(value is None for value in values)
+        return values
+
+    def _load_spilled(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        values = []
+        for key in keys:
+            path = self._spill_path(key)
+            try:
+                values.append(np.load(path) if os.path.exists(path) else None)
+            except (OSError, ValueError):
+                values.append(None)
+        return values
+
+    def put(self, key: str, value: np.ndarray):
+        if not self.enabled or key in self._entries:
+            return
+        self._insert(key, np.array(value, copy=True))
+
+    def _insert(self, key: str, value: np.ndarray):
+        self._entries[key] = value
+        self._bytes += value.nbytes + _ENTRY_OVERHEAD_BYTES
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._bytes -= old_value.nbytes + _ENTRY_OVERHEAD_BYTES
+            self.evictions += 1
+            if self._writer is not None and old_key not in self._pending_spills:
+                self._pending_spills[old_key] = old_value
+                self._writer.submit(self._spill, old_key, old_value)
+
+    def _spill(self, key: str, value: np.ndarray):
+        """在写盘线程中执行. 写盘失败(如磁盘已满)只记录日志,条目被丢弃"""
+        path = self._spill_path(key)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # 先写临时文件再重命名,避免读到写了一半的文件
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, value)
+                os.replace(tmp_path, path)
+                self.spills += 1
+        except OSError:
+            logger.exception(f"缓存条目写入磁盘失败: {path}")
+        finally:
+            self._pending_spills.pop(key, None)
+
+    def close(self):
+        """等待待写的淘汰条目写入磁盘"""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "spills": self.spills,
+            "pending_spills": len(self._pending_spills),
+            "spill_dir": self.spill_dir,
+        }
+
+
+class LabelMatrixCache:
+    """有序标签列表到归一化文本embedding矩阵的缓存
+
+    /match的调用方通常反复发送固定的标签集合,命中时只需对图像做一次前向推理,
+    [L, D] 的标签矩阵直接作为一次矩阵乘法的操作数. 内存中按LRU淘汰,总占用不超过 max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        # 统计指标
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(texts: List[str], namespace: str) -> str:
+        """按标签列表(保持顺序)计算缓存键,顺序不同的标签列表对应不同的矩阵"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(namespace.encode("utf-8"))
+        digest.update(b"labels:")
+        digest.update(json.dumps(texts, ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        if not self.enabled:
+            return None
+        matrix = self._entries.get(key)
+        if matrix is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return matrix
+
+    def put(self, key: str, matrix: np.ndarray):
+        """缓存标签矩阵. 矩阵在多个请求间共享,因此设为只读"""
+        if not self.enabled or key in self._entries:
+            return
+        matrix.setflags(write=False)
+        self._entries[key] = matrix
+        self._bytes += matrix.nbytes + _ENTRY_OVERHEAD_BYTES
+        while self._bytes > self.max_bytes and self._entries:
+            _, old_matrix = self._entries.popitem(last=False)
+            self._bytes -= old_matrix.nbytes + _ENTRY_OVERHEAD_BYTES
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
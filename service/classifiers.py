@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from cn_clip.eval import cvinw_zeroshot_templates
+from cn_clip.eval.imagenet_zeroshot_templates import openai_imagenet_template
+
+logger = logging.getLogger(__name__)
+
+# 可选的prompt模板集合,复用CN-CLIP零样本评测中的模板
+TEMPLATE_SETS = {
+    "imagenet": openai_imagenet_template,
+    "openai": cvinw_zeroshot_templates.openai_templates,
+    "normal": cvinw_zeroshot_templates.normal_templates,
+    "flower": cvinw_zeroshot_templates.flower_templates,
+    "food": cvinw_zeroshot_templates.food_templates,
+    "aircraft": cvinw_zeroshot_templates.aircraft_templates,
+    "eurosat": cvinw_zeroshot_templates.eurosat_templates,
+    "country211": cvinw_zeroshot_templates.country211_templates,
+    "hatefulmemes": cvinw_zeroshot_templates.hatefulmemes_templates,
+    "kitti": cvinw_zeroshot_templates.kitti_templates,
+    "cars": cvinw_zeroshot_templates.cars_templates,
+    "dtd": cvinw_zeroshot_templates.dtd_templates,
+    "patch": cvinw_zeroshot_templates.patch_templates,
+    "pet": cvinw_zeroshot_templates.pet_templates,
+    "cifar100": cvinw_zeroshot_templates.cifar100_templates,
+    "caltech101": cvinw_zeroshot_templates.caltech101_templates,
+    "fer": cvinw_zeroshot_templates.fer_templates,
+}
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+
+def resolve_templates(template_set: str, templates: Optional[List[str]] = None) -> List[Callable[[str], str]]:
+    """返回prompt模板函数列表. templates为自定义模板字符串(以{}表示类别名),优先于template_set"""
+    if templates:
+        for template in templates:
+            if "{}" not in template:
+                raise ValueError(f"自定义模板必须包含{{}}占位符: {template}")
+        return [lambda c, template=template: template.replace("{}", c) for template in templates]
+    if template_set not in TEMPLATE_SETS:
+        raise ValueError(f"不支持的模板集合: {template_set}, 可选 {', '.join(TEMPLATE_SETS)}")
+    return TEMPLATE_SETS[template_set]
+
+
+@dataclass
+class ZeroShotClassifier:
+    name: str
+    classnames: List[str]
+    weights: np.ndarray  # [C, D], 每行为归一化后的类别embedding
+    template_set: str
+    templates: Optional[List[str]]
+    created_at: float
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "num_classes": len(self.classnames),
+            "template_set": self.template_set if not self.templates else "custom",
+            "num_templates": len(self.templates) if self.templates else len(TEMPLATE_SETS[self.template_set]),
+            "created_at": self.created_at,
+        }
+
+
+class ClassifierRegistry:
+    """零样本分类头注册表
+
+    每个分类头是由类别名和prompt模板集合计算出的 [C, D] 类别权重矩阵(与zero_shot_classifier的计算方式一致),
+    只在注册时计算一次. 指定 directory 时分类头写入磁盘({name}.npy 为权重, {name}.json 为元数据),
+    服务启动时通过 load() 读回. namespace 为模型标识,与当前模型不一致的分类头不会被加载.
+    """
+
+    def __init__(self, directory: Optional[str] = None, namespace: str = ""):
+        self.directory = directory or None
+        self.namespace = namespace
+        self._classifiers = {}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def validate_name(name: str):
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"分类器名称只能包含字母、数字、下划线和连字符,长度不超过64: {name}")
+
+    def _paths(self, name: str):
+        return os.path.join(self.directory, f"{name}.npy"), os.path.join(self.directory, f"{name}.json")
+
+    def load(self) -> int:
+        """从磁盘加载全部分类头,返回加载的数量"""
+        if not self.directory:
+            return 0
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            name = filename[:-len(".json")]
+            weights_path, meta_path = self._paths(name)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("model_id") != self.namespace:
+                    logger.warning(f"分类器{name}由其他模型生成,跳过加载")
+                    continue
+                weights = np.load(weights_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"加载分类器{name}失败: {e}")
+                continue
+            self._classifiers[name] = ZeroShotClassifier(name=name, classnames=meta["classnames"], weights=weights,
+                                                         template_set=meta["template_set"],
+                                                         templates=meta.get("templates"),
+                                                         created_at=meta["created_at"])
+        return len(self._classifiers)
+
+    def register(self, name: str, classnames: List[str], weights: np.ndarray, template_set: str,
+                 templates: Optional[List[str]] = None) -> ZeroShotClassifier:
+        classifier = ZeroShotClassifier(name=name, classnames=list(classnames),
+                                        weights=np.ascontiguousarray(weights, dtype=np.float32),
+                                        template_set=template_set, templates=templates or None,
+                                        created_at=time.time())
+        if self.directory:
+            self._save(classifier)
+        self._classifiers[name] = classifier
+        return classifier
+
+    def _save(self, classifier: ZeroShotClassifier):
+        weights_path, meta_path = self._paths(classifier.name)
+        meta = {
+            "model_id": self.namespace,
+            "classnames": classifier.classnames,
+            "template_set": classifier.template_set,
+            "templates": classifier.templates,
+            "created_at": classifier.created_at,
+        }
+        # 先写临时文件再重命名,元数据最后写入,保证读到元数据时权重文件已经完整
+        with open(f"{weights_path}.tmp", "wb") as f:
+            np.save(f, classifier.weights)
+        os.replace(f"{weights_path}.tmp", weights_path)
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def get(self, name: str) -> Optional[ZeroShotClassifier]:
+        return self._classifiers.get(name)
+
+    def remove(self, name: str) -> bool:
+        if self._classifiers.pop(name, None) is None:
+            return False
+        if self.directory:
+            for path in reversed(self._paths(name)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return True
+
+    def list(self) -> List[dict]:
+        return [classifier.info() for classifier in self._classifiers.values()]
@@ -0,0 +1,121 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from service.cache import EmbeddingCache
+
+# 解码进程中的状态(共享内存、像素缓冲区、预处理对象、缓存键命名空间),由进程池的initializer创建
+_worker_state = None
+
+
+class ImageDecodeError(ValueError):
+    """图片解码失败"""
+
+
+def _init_worker(shm_name: str, shape: tuple, image_size: int, fast_decode: bool, namespace: Optional[str]):
+    global _worker_state
+    from cn_clip.clip.utils import BatchImageTransform
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffer = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    transform = BatchImageTransform(image_size, fast_decode=fast_decode, num_threads=1)
+    _worker_state = (shm, buffer, transform, namespace)
+
+
+def _decode_worker(data: bytes, slot: int) -> Optional[str]:
+    _, buffer, transform, namespace = _worker_state
+    try:
+        buffer[slot] = transform.resize(Image.open(io.BytesIO(data)))
+    except Exception as e:
+        raise ImageDecodeError(str(e) or type(e).__name__) from None
+    if namespace is None:
+        return None
+    return EmbeddingCache.image_key(buffer[slot], namespace)
+
+
+class DecodePool:
+    """图片解码进程池
+
+    图片解码和缩放是纯CPU操作,在主进程中执行时会与推理和请求处理争抢GIL.
+    DecodePool 把原始图片字节交给 workers 个解码进程,解码进程把缩放后的uint8像素直接写入共享内存中的槽位,
+    只通过进程间通信返回很小的缓存键,大数组不经过pickle. 共 slots 个槽位,同时解码的图片数不超过槽位数.
+    namespace 不为None时,解码进程同时按缩放后的像素计算embedding缓存键.
+    """
+
+    def __init__(self, image_size: int, fast_decode: bool = False, workers: int = 2, slots: int = 64,
+                 namespace: Optional[str] = None):
+        assert workers >= 1, "解码进程数量必须大于0"
+        assert slots >= 1, "共享内存槽位数量必须大于0"
+        self.workers = workers
+        self.slots = slots
+        self.shape = (slots, image_size, image_size, 3)
+
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+        self._buffer = np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf)
+        # 解码进程不使用CUDA,但主进程中已经加载了模型,fork出的子进程不安全,因此同样使用spawn方式创建进程
+        self._pool = ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker,
+                                         initargs=(self._shm.name, self.shape, image_size, fast_decode, namespace))
+        # 空闲槽位队列在第一次解码时创建,保证绑定到正在运行的事件循环
+        self._free_slots = None
+
+        # 统计指标
+        self.decoded = 0
+        self.failed = 0
+
+    def _release(self, slot: int, future: asyncio.Future):
+        if not future.cancelled():
+            future.exception()
+        self._free_slots.put_nowait(slot)
+
+    async def _decode_one(self, data: bytes, out: np.ndarray, index: int) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        slot = await self._free_slots.get()
+        future = loop.run_in_executor(self._pool, _decode_worker, data, slot)
+        try:
+            # 请求被取消时解码进程仍在写入该槽位,必须等解码结束后才能归还槽位
+            key = await asyncio.shield(future)
+            out[index] = self._buffer[slot]
+            self.decoded += 1
+            return key
+        except ImageDecodeError:
+            self.failed += 1
+            raise
+        finally:
+            if future.done():
+                self._release(slot, future)
+            else:
+                future.add_done_callback(lambda f: self._release(slot, f))
+
+    async def decode(self, images: List[bytes]) -> Tuple[np.ndarray, List[Optional[str]]]:
+        """解码并缩放一批图片,返回uint8 NHWC像素批次和每张图片的缓存键"""
+        if self._free_slots is None:
+            self._free_slots = asyncio.Queue()
+            for slot in range(self.slots):
+                self._free_slots.put_nowait(slot)
+
+        out = np.empty((len(images),) + self.shape[1:], dtype=np.uint8)
+        keys = await asyncio.gather(*[self._decode_one(data, out, i) for i, data in enumerate(images)])
+        return out, list(keys)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "slots": self.slots,
+            "free_slots": self._free_slots.qsize() if self._free_slots is not None else self.slots,
+            "decoded": self.decoded,
+            "failed": self.failed,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        del self._buffer
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,95 @@
+import base64
+import importlib
+import importlib.util
+from typing import Optional
+
+import numpy as np
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+
+if importlib.util.find_spec('msgpack'):
+    msgpack = importlib.import_module('msgpack')
+else:
+    msgpack = None
+
+FORMATS = ("json", "base64", "binary", "msgpack")
+DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+_ACCEPT_FORMATS = {
+    "application/octet-stream": "binary",
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+    "application/json": "json",
+}
+
+
+class EmbeddingFormat:
+    """embedding响应的编码方式
+
+    json: 默认格式, embedding为浮点数列表;
+    base64: JSON响应, embedding为小端字节序浮点数组的base64字符串;
+    binary: application/octet-stream, 响应体为按顺序拼接的 [N, D] 小端字节序浮点矩阵, 形状和类型放在响应头中;
+    msgpack: application/x-msgpack, 结构与JSON相同, embedding为小端字节序浮点数组的原始字节(需要安装msgpack).
+    """
+
+    def __init__(self, format: str = "json", dtype: str = "float32"):
+        self.format = format
+        self.dtype = dtype
+        self.np_dtype = DTYPES[dtype]
+
+    def render(self, content: dict, headers: Optional[dict] = None) -> Response:
+        """把content中的numpy数组按当前格式编码后返回响应, headers仅用于binary格式"""
+        if self.format == "binary":
+            arrays = []
+            _walk(content, arrays.append)
+            matrix = np.stack(arrays).astype(self.np_dtype, copy=False) if arrays else np.zeros((0, 0), self.np_dtype)
+            response_headers = {
+                "X-Embedding-Dtype": self.dtype,
+                "X-Embedding-Shape": ",".join(str(dim) for dim in matrix.shape),
+            }
+            response_headers.update(headers or {})
+            return Response(content=matrix.tobytes(), media_type="application/octet-stream",
+                            headers=response_headers)
+
+        if self.format == "json":
+            return JSONResponse(_walk(content, lambda array: array.astype(self.np_dtype, copy=False).tolist()))
+
+        encoding = {"format": self.format, "dtype": self.dtype, "byteorder": "little"}
+        if self.format == "base64":
+            body = _walk(content, lambda array: base64.b64encode(
+                array.astype(self.np_dtype, copy=False).tobytes()).decode("ascii"))
+            body["encoding"] = encoding
+            return JSONResponse(body)
+
+        body = _walk(content, lambda array: array.astype(self.np_dtype, copy=False).tobytes())
+        body["encoding"] = encoding
+        return Response(content=msgpack.packb(body, use_bin_type=True), media_type="application/x-msgpack")
+
+
+def _walk(obj, fn):
+    if isinstance(obj, np.ndarray):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {key: _walk(value, fn) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_walk(value, fn) for value in obj]
+    return obj
+
+
+def embedding_format(request: Request, format: Optional[str] = Query(None, description="json/base64/binary/msgpack"),
+                     dtype: str = Query("float32", description="float32/float16")) -> EmbeddingFormat:
+    """按查询参数format优先、Accept请求头其次的顺序协商embedding响应格式,默认返回JSON浮点数列表"""
+    if format is None:
+        format = "json"
+        for media_type in request.headers.get("accept", "").split(","):
+            media_type = media_type.split(";")[0].strip().lower()
+            if media_type in _ACCEPT_FORMATS:
+                format = _ACCEPT_FORMATS[media_type]
+                break
+    if format not in FORMATS:
+        raise HTTPException(status_code=406, detail=f"不支持的响应格式: {format}, 可选 {', '.join(FORMATS)}")
+    if dtype not in DTYPES:
+        raise HTTPException(status_code=406, detail=f"不支持的数据类型: {dtype}, 可选 {', '.join(DTYPES)}")
+    if format == "msgpack" and msgpack is None:
+        raise HTTPException(status_code=406, detail="服务端未安装msgpack,无法返回msgpack格式")
+    return EmbeddingFormat(format, dtype)
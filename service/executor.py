@@ -0,0 +1,73 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+# 推理进程中的模型实例,由进程池的initializer创建
+_worker_target = None
+
+
+def _init_worker(factory: Callable, kwargs: dict, num_threads: int):
+    global _worker_target
+    if num_threads > 0:
+        import torch
+        torch.set_num_threads(num_threads)
+    _worker_target = factory(**kwargs)
+
+
+def _call_worker(method: str, args: tuple):
+    return getattr(_worker_target, method)(*args)
+
+
+def _worker_pid(_=None):
+    return os.getpid()
+
+
+class InferenceExecutor:
+    """绑定模型的推理执行器,让阻塞的PyTorch前向推理离开asyncio事件循环
+
+    kind="thread": 在当前进程加载一份模型,由线程池执行推理(PyTorch算子执行期间会释放GIL);
+    kind="process": 每个工作进程各自加载一份模型,适合CPU推理时进一步隔离GIL.
+    factory(**kwargs) 用于构造持有模型的对象,call(method, *args) 在执行器中调用其同名方法.
+    """
+
+    def __init__(self, factory: Callable, kwargs: dict, kind: str = "thread", workers: int = 1,
+                 torch_threads: int = 0):
+        assert kind in ("thread", "process"), f"不支持的推理执行器类型: {kind}"
+        assert workers >= 1, "推理执行器的worker数量必须大于0"
+        self.kind = kind
+        self.workers = workers
+        if kind == "thread":
+            if torch_threads > 0:
+                import torch
+                torch.set_num_threads(torch_threads)
+            self._target = factory(**kwargs)
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        else:
+            self._target = None
+            # CUDA和PyTorch的线程池在fork后不可用,因此使用spawn方式创建进程
+            self._pool = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker,
+                                             initargs=(factory, kwargs, torch_threads))
+
+    async def call(self, method: str, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._target is not None:
+            return await loop.run_in_executor(self._pool, functools.partial(getattr(self._target, method), *args))
+        return await loop.run_in_executor(self._pool, _call_worker, method, args)
+
+    def warmup(self):
+        """进程模式下启动全部推理进程并等待它们各自加载完模型,加载失败时抛出BrokenProcessPool
+        线程模式下模型已在构造时加载,直接返回
+        """
+        if self._target is not None:
+            return
+        pids = set()
+        while len(pids) < self.workers:
+            pids.update(self._pool.map(_worker_pid, range(self.workers)))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+
+import httpx
+
+
+class FetchError(Exception):
+    """图片URL下载失败"""
+
+
+class _HostLimit:
+    __slots__ = ("semaphore", "users")
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        # 正在下载和排队等待的请求数
+        self.users = 0
+
+
+class ImageFetcher:
+    """异步图片下载器
+
+    所有图片URL共享一个keep-alive连接池,按host限制并发数,并对超时和响应体大小做限制.
+    timeout 是整个下载(包括排队等待host名额和跟随重定向)的截止时间,而不只是单次读写的超时.
+    响应体以流的方式读取,超过 max_body_bytes 时立即中断下载. 重定向由下载器逐跳跟随,
+    每一跳占用目标host的并发名额,最多跟随 max_redirects 次.
+    """
+
+    def __init__(self, timeout: float = 10.0, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, per_host_limit: int = 16, max_body_bytes: int = 20 * 1024 * 1024,
+                 max_redirects: int = 5):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.per_host_limit = per_host_limit
+        self.max_body_bytes = max_body_bytes
+        self.max_redirects = max_redirects
+
+        # 客户端在第一次下载时创建,保证绑定到正在运行的事件循环
+        self._client = None
+        # 只保存有请求在下载或排队的host,最后一个请求结束时删除,host数量不会无限增长
+        self._host_limits = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive_connections,
+                                    keepalive_expiry=self.keepalive_expiry),
+                # 重定向在fetch中跟随,才能按重定向目标的host限制并发
+                follow_redirects=False
+            )
+        return self._client
+
+    @contextlib.asynccontextmanager
+    async def _host_slot(self, host: str):
+        """占用host的一个并发名额,该host没有其他请求时释放对应的信号量"""
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = _HostLimit(self.per_host_limit)
+        limit.users += 1
+        try:
+            async with limit.semaphore:
+                yield
+        finally:
+            limit.users -= 1
+            if limit.users == 0:
+                del self._host_limits[host]
+
+    async def fetch(self, url: str) -> bytes:
+        """下载URL内容并返回原始字节"""
+        try:
+            return await asyncio.wait_for(self._fetch(url), self.timeout)
+        except asyncio.TimeoutError as e:
+            raise FetchError(f"图片下载超过{self.timeout}秒: {url}") from e
+
+    async def _fetch(self, url: str) -> bytes:
+        for _ in range(self.max_redirects + 1):
+            try:
+                url = httpx.URL(url)
+            except Exception as e:
+                raise FetchError(f"无效的URL: {url}") from e
+            if not url.host:
+                raise FetchError(f"无效的URL: {url}")
+
+            async with self._host_slot(url.host):
+                try:
+                    async with self._get_client().stream("GET", url) as response:
+                        if response.is_redirect:
+                            url = response.url.join(response.headers["location"])
+                            continue
+                        response.raise_for_status()
+                        content_length = response.headers.get("content-length")
+                        if content_length and content_length.isdigit() and int(content_length) > self.max_body_bytes:
+                            raise FetchError(f"图片大小{content_length}字节超过上限{self.max_body_bytes}字节")
+                        body = bytearray()
+                        async for chunk in response.aiter_bytes():
+                            body.extend(chunk)
+                            if len(body) > self.max_body_bytes:
+                                raise FetchError(f"图片大小超过上限{self.max_body_bytes}字节")
+                        return bytes(body)
+                except httpx.HTTPError as e:
+                    raise FetchError(str(e) or type(e).__name__) from e
+        raise FetchError(f"重定向次数超过上限{self.max_redirects}次")
+
+    def stats(self) -> dict:
+        return {
+            "hosts": len(self._host_limits),
+            "per_host_limit": self.per_host_limit,
+            "max_connections": self.max_connections,
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+INDEX_DTYPES = ("float32", "float16")
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行L2归一化为float32矩阵,内积即余弦相似度"""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    if not np.all(norms > 0):
+        raise ValueError("向量不能全为0")
+    vectors /= norms
+    return vectors
+
+
+class VectorIndex:
+    """进程内的embedding索引
+
+    向量归一化后按行存放在一块连续的 [capacity, D] 矩阵中(float32或float16),前size行有效,
+    容量不足时按倍数扩容;删除时把最后一行移到被删除的位置,矩阵始终保持连续.
+    检索为精确的内积top-k: 一批查询与矩阵逐块(block_rows行)做一次矩阵乘法,每块取top-k后与已有结果合并,
+    float16矩阵按块转换为float32计算,额外内存只与块大小有关. 矩阵乘法和top-k由PyTorch在CPU上执行,不复制索引矩阵.
+    所有读写都持有同一把锁,可以在线程池中执行.
+    """
+
+    def __init__(self, name: str, dim: int, dtype: str = "float32", block_rows: int = 16384):
+        assert dtype in INDEX_DTYPES, f"不支持的索引数据类型: {dtype}"
+        self.name = name
+        self.dim = dim
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self.created_at = time.time()
+        self._vectors = np.empty((0, dim), dtype=dtype)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        # 修改计数,与保存时的计数比较判断是否需要写回磁盘
+        self.version = 0
+        self.saved_version = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._ids)
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "created_at": self.created_at,
+        }
+
+    def _reserve(self, size: int):
+        if size <= len(self._vectors):
+            return
+        capacity = max(size, 2 * len(self._vectors), 1024)
+        vectors = np.empty((capacity, self.dim), dtype=self.dtype)
+        vectors[:self.size] = self._vectors[:self.size]
+        self._vectors = vectors
+
+    def add(self, ids: List[str], vectors: np.ndarray) -> int:
+        """添加或覆盖向量,已存在的id原地替换,返回新增的数量"""
+        vectors = normalize_rows(vectors)
+        if vectors.shape != (len(ids), self.dim):
+            raise ValueError(f"向量维度与索引{self.name}不一致: 需要{self.dim}维,实际为{vectors.shape[-1]}维")
+        with self._lock:
+            added = 0
+            self._reserve(self.size + len(ids))
+            for id_, vector in zip(ids, vectors):
+                row = self._rows.get(id_)
+                if row is None:
+                    row = self.size
+                    self._rows[id_] = row
+                    self._ids.append(id_)
+                    added += 1
+                self._vectors[row] = vector
+            self.version += 1
+            return added
+
+    def delete(self, ids: List[str]) -> int:
+        """按id删除向量,返回实际删除的数量"""
+        with self._lock:
+            deleted = 0
+            for id_ in ids:
+                row = self._rows.pop(id_, None)
+                if row is None:
+                    continue
+                last = self.size - 1
+                if row != last:
+                    # 用最后一行填补空位,保持矩阵连续
+                    self._vectors[row] = self._vectors[last]
+                    self._ids[row] = self._ids[last]
+                    self._rows[self._ids[row]] = row
+                self._ids.pop()
+                deleted += 1
+            if deleted:
+                self.version += 1
+            return deleted
+
+    def search(self, queries: np.ndarray, top_k: int) -> Tuple[List[List[str]], np.ndarray]:
+        """精确内积检索,返回每个查询按分数从高到低排列的id列表和 [Q, k] 分数矩阵"""
+        queries = normalize_rows(queries)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查询向量维度与索引{self.name}不一致: 需要{self.dim}维,实际为{queries.shape[1]}维")
+        # torch导入较慢,在第一次检索时才导入(加载模型时通常已经导入)
+        import torch
+        from cn_clip.index.topk import blocked_topk
+
+        with self._lock:
+            size = self.size
+            k = min(top_k, size)
+            if k == 0:
+                return [[] for _ in queries], np.zeros((len(queries), 0), dtype=np.float32)
+            # float16矩阵在blocked_topk中逐块转换为float32
+            best_scores, best_rows = blocked_topk(torch.from_numpy(queries), self._vectors[:size], k,
+                                                  self.block_rows)
+            ids = [[self._ids[row] for row in query_rows] for query_rows in best_rows.tolist()]
+        return ids, best_scores.numpy()
+
+    def snapshot(self) -> Tuple[np.ndarray, List[str], int]:
+        """返回有效向量、id列表和修改计数的副本,用于在不持有锁的情况下写盘"""
+        with self._lock:
+            return self._vectors[:self.size].copy(), list(self._ids), self.version
+
+    def restore(self, vectors: np.ndarray, ids: List[str], created_at: float):
+        """从磁盘读回的数据恢复索引. vectors可以是写时复制的内存映射,第一次扩容时才复制到内存"""
+        with self._lock:
+            self._vectors = vectors
+            self._ids = list(ids)
+            self._rows = {id_: row for row, id_ in enumerate(self._ids)}
+            self.created_at = created_at
+
+
+class IndexRegistry:
+    """embedding索引注册表
+
+    指定 directory 时每个索引保存在 {directory}/{name}/ 下(vectors.npy 为向量矩阵, ids.json 为id列表,
+    meta.json 为元数据),服务启动时通过 load() 读回. namespace 为模型标识,与当前模型不一致的索引不会被加载.
+    """
+
+    def __init__(self, directory: Optional[str] = None, namespace: str = "", dtype: str = "float32",
+                 block_rows: int = 16384):
+        assert dtype in INDEX_DTYPES, f"不支持的索引数据类型: {dtype}"
+        self.directory = directory or None
+        self.namespace = namespace
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._save_lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def validate_name(name: str):
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"索引名称只能包含字母、数字、下划线和连字符,长度不超过64: {name}")
+
+    def _path(self, name: str, filename: str = "") -> str:
+        return os.path.join(self.directory, name, filename)
+
+    def load(self) -> int:
+        """从磁盘加载全部索引,返回加载的数量"""
+        if not self.directory:
+            return 0
+        for name in sorted(os.listdir(self.directory)):
+            meta_path = self._path(name, "meta.json")
+            if not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("model_id") != self.namespace:
+                    logger.warning(f"索引{name}由其他模型生成,跳过加载")
+                    continue
+                with open(self._path(name, "ids.json"), "r", encoding="utf-8") as f:
+                    ids = json.load(f)
+                vectors = np.load(self._path(name, "vectors.npy"), mmap_mode="c")
+            except (OSError, ValueError) as e:
+                logger.warning(f"加载索引{name}失败: {e}")
+                continue
+            if vectors.shape != (meta["size"], meta["dim"]) or len(ids) != meta["size"]:
+                # 保存过程中断时向量、id列表和元数据可能来自不同版本,行与id无法对应
+                logger.warning(f"索引{name}的文件不一致(向量{vectors.shape},id数量{len(ids)},"
+                               f"元数据记录{meta['size']}x{meta['dim']}),跳过加载")
+                continue
+            index = VectorIndex(name, meta["dim"], dtype=str(vectors.dtype), block_rows=self.block_rows)
+            index.restore(vectors, ids, meta["created_at"])
+            self._indexes[name] = index
+        return len(self._indexes)
+
+    def get(self, name: str) -> Optional[VectorIndex]:
+        return self._indexes.get(name)
+
+    def get_or_create(self, name: str, dim: int) -> VectorIndex:
+        index = self._indexes.get(name)
+        if index is None:
+            self.validate_name(name)
+            index = self._indexes[name] = VectorIndex(name, dim, dtype=self.dtype, block_rows=self.block_rows)
+        return index
+
+    def remove(self, name: str) -> bool:
+        if self._indexes.pop(name, None) is None:
+            return False
+        if self.directory:
+            with self._save_lock:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+        return True
+
+    def list(self) -> List[dict]:
+        return [index.info() for index in self._indexes.values()]
+
+    def save(self, index: VectorIndex):
+        """把索引写入磁盘. 先写临时文件再重命名,元数据最后写入,保证读到元数据时其余文件已经完整"""
+        if not self.directory or index.version == index.saved_version:
+            return
+        with self._save_lock:
+            if self._indexes.get(index.name) is not index:
+                return  # 已被删除
+            vectors, ids, version = index.snapshot()
+            os.makedirs(self._path(index.name), exist_ok=True)
+            meta = {"model_id": self.namespace, "dim": index.dim, "dtype": index.dtype,
+                    "size": len(ids), "created_at": index.created_at}
+            vectors_path, ids_path, meta_path = (self._path(index.name, filename)
+                                                 for filename in ("vectors.npy", "ids.json", "meta.json"))
+            with open(f"{vectors_path}.tmp", "wb") as f:
+                np.save(f, vectors)
+            os.replace(f"{vectors_path}.tmp", vectors_path)
+            with open(f"{ids_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(ids, f, ensure_ascii=False)
+            os.replace(f"{ids_path}.tmp", ids_path)
+            with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            index.saved_version = version
+
+    def save_all(self):
+        for index in list(self._indexes.values()):
+            self.save(index)
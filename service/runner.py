@@ -0,0 +1,73 @@
+from typing import List, Optional
+
+import numpy as np
+import torch
+import cn_clip.clip as clip
+from service.classifiers import resolve_templates
+
+
+class ClipModelRunner:
+    """持有CN-CLIP模型并执行同步的批量推理
+
+    只在推理执行器的工作线程或工作进程中调用,图像输入为缩放后的uint8像素批次,文本输入为分词后的张量,输出为CPU上的numpy数组.
+    """
+
+    def __init__(self, model_path: str, vision_model_name: str, text_model_name: str, input_resolution: int,
+                 device: str = None, use_sdpa: bool = False, quantize_int8: bool = False, towers: str = "both"):
+        if quantize_int8:
+            # int8动态量化的算子只有CPU实现
+            if device not in (None, "cpu"):
+                raise ValueError("int8动态量化只支持CPU推理")
+            device = "cpu"
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model, _ = clip.load_from_name(
+            name=model_path,
+            device=self.device,
+            vision_model_name=vision_model_name,
+            text_model_name=text_model_name,
+            input_resolution=input_resolution,
+            use_sdpa=use_sdpa,
+            towers=towers
+        )
+        if quantize_int8:
+            clip.quantize_dynamic_int8(self.model)
+        self.model.eval()
+        self.image_transform = clip.BatchImageTransform(input_resolution)
+
+    def encode_image(self, pixels: np.ndarray):
+        """pixels为缩放后的uint8 NHWC批次,在推理设备上按模型精度一次性完成归一化"""
+        with torch.no_grad():
+            images = self.image_transform.normalize(pixels, dtype=self.model.dtype, device=self.device)
+            image_features = self.model.encode_image(images)
+            return image_features.detach().cpu().numpy()
+
+    def encode_text(self, text: torch.Tensor, attention_mask: Optional[torch.Tensor] = None,
+                    lengths: Optional[torch.Tensor] = None):
+        """text/attention_mask/lengths为clip.tokenize_batch的输出,lengths留在CPU上,截掉padding时不需要设备同步"""
+        with torch.no_grad():
+            if attention_mask is not None:
+                attention_mask = attention_mask.to(self.device)
+            text_features = self.model.encode_text(text.to(self.device), attention_mask=attention_mask,
+                                                   lengths=lengths)
+            return text_features.detach().cpu().numpy()
+
+    def logit_scale(self) -> float:
+        return float(self.model.logit_scale.exp().item())
+
+    def build_classifier(self, classnames: List[str], template_set: str, templates: Optional[List[str]] = None):
+        """按zero_shot_classifier的方式计算零样本分类头,返回 [C, D] 的归一化类别权重
+
+        不引入cn_clip.eval.zeroshot_evaluation: 它依赖训练和评测数据模块(lmdb, timm, torchvision),
+        精简的服务镜像中没有安装.
+        """
+        templates = resolve_templates(template_set, templates)
+        weights = []
+        with torch.no_grad():
+            for classname in classnames:
+                # 与cn_clip.eval.data._preprocess_text一致,适配中文BERT词表
+                texts = [template(classname).lower().replace("“", "\"").replace("”", "\"") for template in templates]
+                class_embeddings = self.model.encode_text(clip.tokenize(texts, context_length=52).to(self.device))
+                class_embeddings /= class_embeddings.norm(dim=-1, keepdim=True)
+                class_embedding = class_embeddings.mean(dim=0)
+                weights.append(class_embedding / class_embedding.norm())
+        return torch.stack(weights).float().cpu().numpy()
@@ -0,0 +1,36 @@
+import tempfile
+
+import numpy as np
+
+from cn_clip.index import HNSWIndex
+
+
+def test_save_to_loaded_directory():
+    rng = np.random.RandomState(0)
+    vectors = rng.randn(600, 32).astype(np.float32)
+    queries = rng.randn(20, 32).astype(np.float32)
+    with tempfile.TemporaryDirectory() as path:
+        index = HNSWIndex(32, m=8, ef_construction=32)
+        index.add(vectors[:500], np.arange(500))
+        index.save(path)
+
+        # saving an unmodified, fully memory-mapped index back to its own directory
+        loaded = HNSWIndex.load(path)
+        expected = loaded.search(queries, 5)
+        loaded.save(path)
+        reloaded = HNSWIndex.load(path)
+        assert all(np.array_equal(a, b) for a, b in zip(reloaded.search(queries, 5), expected))
+
+        # level-0 inserts keep some arrays mapped, saving again must not corrupt them
+        reloaded.add(vectors[500:], np.arange(500, 600))
+        expected = reloaded.search(queries, 5)
+        reloaded.save(path)
+        reloaded = HNSWIndex.load(path)
+        assert len(reloaded) == 600
+        assert all(np.array_equal(a, b) for a, b in zip(reloaded.search(queries, 5), expected))
+        assert reloaded.search(vectors[550], 1)[0][0, 0] == 550
+
+
+if __name__ == "__main__":
+    test_save_to_loaded_directory()
+    print("Done!")